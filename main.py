@@ -1,3 +1,4 @@
+import argparse
 import sys
 
 import gymnasium as gym
@@ -38,8 +39,36 @@ def check_env():
     return True
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="环境验收 / 硬件探测 / rollout 参数自动调优")
+    parser.add_argument("--probe", action="store_true", help="Measure cores, /dev/shm, engine FPS per scenario and model cost")
+    parser.add_argument("--autotune", action="store_true", help="Probe, then search rollout settings and write a config")
+    parser.add_argument("--out", type=str, default="autotune.json", help="Autotune config output (for train_custom.py --autotune_config)")
+    parser.add_argument("--scenarios", nargs="+", default=None, help="Scenarios to probe (default: all custom_doom_*)")
+    parser.add_argument("--env", type=str, default=None, help="Tune for this scenario (default: the slowest probed one)")
+    parser.add_argument("--encoder-variant", type=str, default="legacy", help="Model encoder to cost")
+    parser.add_argument("--device", type=str, default=None, help="Learner device (default: cuda if available)")
+    parser.add_argument("--obs-uint8", action="store_true",
+                        help="Tune for --doom_obs_uint8 training (uint8 buffers, on-device scaling); default is float32 obs")
+    parser.add_argument("--probe-steps", type=int, default=500, help="Env steps per scenario for the FPS probe")
+    parser.add_argument("--top-k", type=int, default=5, help="Candidates to print")
+    parser.add_argument("--verify", type=int, default=0, help="Measure the top K candidates with short training runs")
+    parser.add_argument("--verify-steps", type=int, default=100000, help="Env steps per verification run")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    if check_env():
-        sys.exit(0)
-    else:
+    args = parse_args()
+    if not check_env():
         sys.exit(1)
+    if args.probe or args.autotune:
+        from src.autotune import run_probe, autotune, save_autotune_config
+        from src.envs.scenario_cache import SCENARIO_FILES
+        scenarios = args.scenarios or ([args.env] if args.env and not args.probe else list(SCENARIO_FILES))
+        probe = run_probe(scenarios, args.probe_steps, args.encoder_variant, args.device, args.obs_uint8)
+        if args.autotune:
+            config = autotune(probe, args.env, args.top_k, args.verify, args.verify_steps)
+            save_autotune_config(config, args.out)
+            print(f"\n💾 Saved: {args.out} ({' '.join(f'{k}={v}' for k, v in config['sf_args'].items())})")
+            print(f"   python src/train_custom.py --env {args.env or 'custom_doom_basic'} --autotune_config {args.out}")
+    sys.exit(0)
@@ -0,0 +1,345 @@
+"""
+硬件探测 + rollout 参数自动调优，入口在 main.py：
+    python main.py --probe                         # 只打印探测结果
+    python main.py --autotune --out autotune.json  # 探测 + 搜索，写出 train_custom.py 可用的配置
+    python src/train_custom.py --env custom_doom_basic --autotune_config autotune.json
+
+探测项：
+    - CPU 核数（含 affinity 限制）、内存、/dev/shm 容量（SF 的轨迹缓冲区放在共享内存里，太小会 Bus error）
+    - 每个场景单核的完整环境（create_vizdoom_env）steps/sec，以及环境实际输出的观察形状和 dtype
+    - 模型推理（不同 batch）和训练（前向 + 反向）每个样本的耗时（按上面的观察形状和 dtype）
+环境和模型都按 train_custom.py 实际训练时的 cfg 构造（--obs-uint8 对应 --doom_obs_uint8，默认 float32），
+调优结果里也写上 doom_obs_uint8，保证训练用的就是被测量的那条路径。
+搜索：在 num_workers x num_envs_per_worker x rollout x batch_size 网格上用下面的吞吐模型打分，
+满足共享内存 / 内存约束的候选里取估计吞吐最高的；--verify K 时再用 bench_train 实测前 K 个。
+
+吞吐模型（env steps/sec，取三者最小值）：
+    CPU 上限     cores / (t_env + t_infer(b) + t_learn)     所有进程分享 CPU
+    worker 上限  W / t_env                                  每个 worker 单线程步进自己的环境
+                 （E >= 2 时 SF 把环境分两半交替推理，推理等待被掩盖；E = 1 时要加上 t_infer）
+    learner 上限 1 / t_train                                每个样本的训练耗时
+其中 b = W * E / 2 是一次推理的批量（worker_num_splits=2）。模型只用来排序，绝对数值以实测为准。
+"""
+import json
+import os
+import platform
+import shutil
+import time
+
+import numpy as np
+
+# 与 train_custom.py 的默认值一致（doom_frame_stack=1, env_frameskip=1）
+TRAIN_DEFAULTS = {"env_frameskip": 1, "doom_frame_stack": 1, "res_w": 128, "res_h": 72}
+AUTOTUNE_VERSION = 1
+SF_KEYS = ("num_workers", "num_envs_per_worker", "rollout", "batch_size")
+# 写进配置、由 train_custom.py 作为默认值的全部参数
+TUNED_KEYS = SF_KEYS + ("doom_obs_uint8",)
+ENVS_PER_WORKER = (2, 4, 8, 16, 32)
+ROLLOUTS = (16, 32, 64)
+BATCH_SIZES = (512, 1024, 2048, 4096, 8192)
+# SF 的轨迹缓冲区大约是 W * E * rollout 条观察的两倍（双缓冲），再留 50% 余量
+SHM_BUFFER_FACTOR = 3.0
+# 估计吞吐差在这个比例以内视为持平：优先 worker 上限有余量的（env FPS 估计偏高时不至于卡在采样上），
+# 其次更小的 batch（policy lag 更小）和更少的内存
+TIE_MARGIN = 0.03
+WORKER_HEADROOM = 1.5
+
+
+def probe_system():
+    """CPU / 内存 / 共享内存"""
+    info = {
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        info["usable_cores"] = len(os.sched_getaffinity(0))
+    except AttributeError:
+        info["usable_cores"] = os.cpu_count()
+    try:
+        import psutil
+        info["physical_cores"] = psutil.cpu_count(logical=False)
+        info["mem_total_mb"] = psutil.virtual_memory().total / 2 ** 20
+        info["mem_available_mb"] = psutil.virtual_memory().available / 2 ** 20
+    except ImportError:
+        info["physical_cores"] = None
+        try:
+            info["mem_total_mb"] = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2 ** 20
+        except (ValueError, OSError, AttributeError):
+            info["mem_total_mb"] = None
+        info["mem_available_mb"] = info["mem_total_mb"]
+    if os.path.isdir("/dev/shm"):
+        usage = shutil.disk_usage("/dev/shm")
+        info["shm_total_mb"] = usage.total / 2 ** 20
+        info["shm_free_mb"] = usage.free / 2 ** 20
+    else:
+        info["shm_total_mb"] = info["shm_free_mb"] = None
+    try:
+        import torch
+        info["torch"] = torch.__version__
+        info["cuda"] = torch.cuda.is_available()
+        info["gpu"] = torch.cuda.get_device_name(0) if info["cuda"] else None
+    except ImportError:
+        info["torch"], info["cuda"], info["gpu"] = None, False, None
+    return info
+
+
+def probe_env_fps(scenarios, obs_uint8=False, steps=500, warmup=50):
+    """
+    每个场景单核跑完整环境（随机动作），返回 ({场景: steps/sec}, 观察信息)。
+    观察信息是环境实际输出的 {"shape", "dtype"}，模型探测和共享内存估计都用它。
+    """
+    from src.bench_env import GymLayer, measure, summarize_timings
+    from src.envs.vizdoom_env import AttrDict
+    cfg = AttrDict(record_to=None, wide_aspect_ratio=False, pixel_format="CHW", doom_obs_uint8=obs_uint8,
+                   **TRAIN_DEFAULTS)
+    fps = {}
+    obs_info = None
+    for env_name in scenarios:
+        env = GymLayer(env_name, cfg, None, seed=0)
+        try:
+            if obs_info is None:
+                space = env.env.observation_space
+                obs_info = {"shape": list(space.shape), "dtype": np.dtype(space.dtype).name}
+            step_ms, reset_ms = measure(env, steps, warmup)
+        finally:
+            env.close()
+        fps[env_name] = summarize_timings(step_ms, reset_ms)["steps_per_sec"]
+        print(f"   🎮 {env_name:<32} {fps[env_name]:8.1f} steps/s (1 core)")
+    print(f"   🖼️  Observations: {tuple(obs_info['shape'])} {obs_info['dtype']}")
+    return fps, obs_info
+
+
+def _time_per_call(fn, repeats, warmup=2):
+    for _ in range(warmup):
+        fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def probe_model(obs_info, encoder_variant="legacy", device="cpu", infer_batches=(1, 8, 32, 128), train_batch=256):
+    """
+    用环境实际输出的观察（probe_env_fps 的 obs_info）构造模型，
+    测推理每样本耗时（按 batch）和训练（前向+反向）每样本耗时，单位秒。
+    """
+    import gymnasium as gym
+    import torch
+    from src.checkpoint_io import policy_cfg_from_manifest
+    from src.models.custom_model import make_vizdoom_actor_critic
+
+    obs_shape = tuple(obs_info["shape"])
+    obs_dtype = np.dtype(obs_info["dtype"])
+    uint8 = obs_dtype == np.uint8
+    cfg = policy_cfg_from_manifest({"encoder_variant": encoder_variant,
+                                    "doom_frame_stack": TRAIN_DEFAULTS["doom_frame_stack"],
+                                    "doom_obs_uint8": uint8, "doom_legacy_obs_scale": False})
+    obs_space = gym.spaces.Dict({"obs": gym.spaces.Box(0, 255 if uint8 else 1, obs_shape, dtype=obs_dtype)})
+    model = make_vizdoom_actor_critic(cfg, obs_space, gym.spaces.Discrete(8)).to(device)
+    device = torch.device(device)
+    sync = torch.cuda.synchronize if device.type == "cuda" else (lambda: None)
+
+    def batch(n):
+        if uint8:
+            obs = torch.randint(0, 256, (n,) + obs_shape, dtype=torch.uint8, device=device)
+        else:
+            obs = torch.rand((n,) + obs_shape, device=device)
+        return {"obs": obs}, torch.zeros(n, cfg.rnn_size, device=device)
+
+    infer = {}
+    model.eval()
+    with torch.inference_mode():
+        for n in infer_batches:
+            obs, h = batch(n)
+            infer[n] = _time_per_call(lambda: (model(model.normalize_obs(obs), h), sync()), repeats=5) / n
+
+    model.train()
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+    obs, h = batch(train_batch)
+
+    def train_step():
+        out = model(model.normalize_obs(obs), h)
+        loss = out["action_logits"].logsumexp(-1).mean() + out["values"].pow(2).mean()
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        sync()
+    train = _time_per_call(train_step, repeats=3, warmup=1) / train_batch
+
+    params = sum(p.numel() for p in model.parameters())
+    return {"encoder_variant": encoder_variant, "device": str(device), "params": params,
+            "obs_bytes": int(np.prod(obs_shape)) * obs_dtype.itemsize, "infer_sec_per_sample": infer, "train_sec_per_sample": train}
+
+
+def infer_cost(model_probe, batch):
+    """按 log(batch) 线性插值推理的每样本耗时"""
+    points = sorted((int(k), v) for k, v in model_probe["infer_sec_per_sample"].items())
+    xs = np.log([p[0] for p in points])
+    ys = [p[1] for p in points]
+    return float(np.interp(np.log(max(1, batch)), xs, ys))
+
+
+def estimate_throughput(params, system, env_fps, model_probe):
+    """吞吐模型，返回估计的 env steps/sec 和各项上限"""
+    W, E = params["num_workers"], params["num_envs_per_worker"]
+    t_env = 1.0 / env_fps
+    t_infer = infer_cost(model_probe, max(1, W * E // 2))
+    t_train = model_probe["train_sec_per_sample"]
+    on_gpu = model_probe["device"].startswith("cuda")
+    cores = system["usable_cores"]
+    cpu_bound = cores / (t_env + (0.0 if on_gpu else t_infer + t_train))
+    worker_bound = W / (t_env if E >= 2 else t_env + t_infer)
+    learner_bound = 1.0 / t_train
+    return {"env_steps_per_sec": min(cpu_bound, worker_bound, learner_bound),
+            "cpu_bound": cpu_bound, "worker_bound": worker_bound, "learner_bound": learner_bound}
+
+
+def memory_need_mb(params, model_probe):
+    W, E, R = params["num_workers"], params["num_envs_per_worker"], params["rollout"]
+    return SHM_BUFFER_FACTOR * W * E * R * model_probe["obs_bytes"] / 2 ** 20
+
+
+def candidates(system):
+    cores = max(1, system["usable_cores"])
+    # 主进程 / learner 至少留一个核
+    workers = sorted({w for w in (1, 2, 4, 6, 8, 12, 16, 24, 32, 48, 64) if w <= max(1, cores - 1)} | {max(1, cores - 1)})
+    for W in workers:
+        for E in ENVS_PER_WORKER:
+            for R in ROLLOUTS:
+                for B in BATCH_SIZES:
+                    # SF 要求 batch 由整条轨迹组成；batch 超过一轮采样的数据量时 learner 会空等
+                    if B % R == 0 and B <= W * E * R:
+                        yield {"num_workers": W, "num_envs_per_worker": E, "rollout": R, "batch_size": B}
+
+
+def search(system, env_fps, model_probe, top_k=5):
+    """返回按估计吞吐排序的可行候选（每项含 params / estimate / shm_mb）"""
+    shm_limit = 0.8 * system["shm_free_mb"] if system.get("shm_free_mb") else float("inf")
+    mem_limit = 0.5 * system["mem_available_mb"] if system.get("mem_available_mb") else float("inf")
+    feasible = []
+    for params in candidates(system):
+        need = memory_need_mb(params, model_probe)
+        if need > shm_limit or need > mem_limit:
+            continue
+        feasible.append({"params": params, "estimate": estimate_throughput(params, system, env_fps, model_probe),
+                         "shm_mb": need})
+    if not feasible:
+        return []
+    rate = lambda c: c["estimate"]["env_steps_per_sec"]
+    threshold = max(rate(c) for c in feasible) * (1 - TIE_MARGIN)
+    tied = sorted((c for c in feasible if rate(c) >= threshold),
+                  key=lambda c: (c["estimate"]["worker_bound"] < WORKER_HEADROOM * rate(c),
+                                 c["params"]["batch_size"], c["shm_mb"]))
+    rest = sorted((c for c in feasible if rate(c) < threshold), key=lambda c: -rate(c))
+    feasible = tied + rest
+    return feasible[:top_k]
+
+
+def verify(candidates_list, env_name, env_steps, device):
+    """用 bench_train 实测候选的训练吞吐，返回带 measured 字段的列表（按实测排序）"""
+    import argparse
+    from src.bench_train import run_one
+    from pathlib import Path
+    run_dir = Path("bench") / "autotune" / time.strftime("%Y%m%d-%H%M%S")
+    run_dir.mkdir(parents=True, exist_ok=True)
+    for c in candidates_list:
+        p = c["params"]
+        args = argparse.Namespace(env=env_name, env_steps=env_steps, env_frameskip=TRAIN_DEFAULTS["env_frameskip"],
+                                  device=device, seed=0, timeout=1800,
+                                  train_args=["--rollout", str(p["rollout"]), "--doom_obs_uint8", str(p["doom_obs_uint8"])])
+        grid_params = {"num_workers": p["num_workers"], "num_envs_per_worker": p["num_envs_per_worker"],
+                       "batch_size": p["batch_size"], "frame_stack": TRAIN_DEFAULTS["doom_frame_stack"]}
+        record = run_one(args, grid_params, run_dir)
+        c["measured"] = {k: record[k] for k in ("exit_code", "env_steps_per_sec", "learner_samples_per_sec",
+                                                 "policy_lag_avg", "peak_rss_mb")}
+        print(f"   🔬 {_describe(p)}: measured {record['env_steps_per_sec'] or 0:.1f} env steps/s "
+              f"(estimate {c['estimate']['env_steps_per_sec']:.1f})")
+    ok = [c for c in candidates_list if c["measured"]["exit_code"] == 0 and c["measured"]["env_steps_per_sec"]]
+    return sorted(ok, key=lambda c: -c["measured"]["env_steps_per_sec"])
+
+
+def _describe(params):
+    return " ".join(f"{k}={params[k]}" for k in SF_KEYS)
+
+
+def print_system(system):
+    print(f"   🖥️  Host {system['host']}: {system['usable_cores']} usable cores "
+          f"(logical {system['cpu_count']}, physical {system['physical_cores'] or '?'})")
+    if system["mem_total_mb"]:
+        print(f"   🧮 RAM {system['mem_total_mb'] / 1024:.1f} GB (available {system['mem_available_mb'] / 1024:.1f} GB)")
+    if system["shm_total_mb"] is None:
+        print("   [Warning] /dev/shm not found")
+    else:
+        print(f"   📦 /dev/shm {system['shm_total_mb']:.0f} MB (free {system['shm_free_mb']:.0f} MB)")
+        if system["shm_total_mb"] < 1024:
+            print("   [Warning] /dev/shm is small; Sample Factory may crash with 'Bus error' "
+                  "(docker run --shm-size=2g or --ipc=host)")
+    print(f"   🔥 torch {system['torch']}, CUDA: {system['cuda']}" + (f" ({system['gpu']})" if system["gpu"] else ""))
+
+
+def run_probe(scenarios, env_steps=500, encoder_variant="legacy", device=None, obs_uint8=False):
+    system = probe_system()
+    print("--- 🔍 Hardware probe ---")
+    print_system(system)
+    env_fps, obs_info = probe_env_fps(scenarios, obs_uint8, env_steps)
+    device = device or ("cuda" if system["cuda"] else "cpu")
+    model_probe = probe_model(obs_info, encoder_variant, device)
+    infer = model_probe["infer_sec_per_sample"]
+    print(f"   🧠 Model ({encoder_variant}, {model_probe['params'] / 1e6:.1f}M params, {device}): inference "
+          + ", ".join(f"b{n} {t * 1000:.2f}" for n, t in infer.items())
+          + f" ms/sample; train {model_probe['train_sec_per_sample'] * 1000:.2f} ms/sample")
+    return {"system": system, "env_fps": env_fps, "obs": obs_info, "model": model_probe}
+
+
+def autotune(probe, env_name=None, top_k=5, verify_top=0, verify_steps=100000):
+    """在探测结果上搜索，返回写入配置文件的 dict"""
+    env_fps = probe["env_fps"]
+    # 没指定场景时按最慢的场景调，保证所有场景都不会被 worker 数卡住
+    fps = env_fps[env_name] if env_name else min(env_fps.values())
+    ranked = search(probe["system"], fps, probe["model"], top_k)
+    if not ranked:
+        raise RuntimeError("no feasible configuration (shared memory too small?)")
+    print(f"\n--- ⚙️  Top {len(ranked)} configurations (estimated) ---")
+    for c in ranked:
+        e = c["estimate"]
+        print(f"   {_describe(c['params'])}: {e['env_steps_per_sec']:8.1f} env steps/s "
+              f"(cpu {e['cpu_bound']:.0f}, workers {e['worker_bound']:.0f}, learner {e['learner_bound']:.0f}), "
+              f"buffers {c['shm_mb']:.0f} MB")
+    # 观察 dtype 决定缓冲区大小和模型路径，随调优结果一起交给 train_custom.py
+    obs_uint8 = probe["obs"]["dtype"] == "uint8"
+    for c in ranked:
+        c["params"]["doom_obs_uint8"] = obs_uint8
+    chosen = ranked[0]
+    if verify_top:
+        measured = verify(ranked[:verify_top], env_name or min(env_fps, key=env_fps.get), verify_steps,
+                          probe["model"]["device"])
+        if measured:
+            chosen = measured[0]
+    return {
+        "version": AUTOTUNE_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": probe["system"]["host"],
+        "sf_args": dict(chosen["params"]),
+        "estimate": chosen["estimate"],
+        "measured": chosen.get("measured"),
+        "probe": probe,
+    }
+
+
+def save_autotune_config(config, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2, default=str)
+
+
+def load_autotune_config(path):
+    """读取 autotune 配置，返回要设为解析器默认值的 SF 参数（命令行显式给出的参数仍然优先）"""
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    if config.get("host") and config["host"] != platform.node():
+        print(f"[Warning] {path} was tuned on {config['host']}, this is {platform.node()}")
+    sf_args = {k: v for k, v in config["sf_args"].items() if k in TUNED_KEYS}
+    print(f"[Info] Autotuned rollout settings from {path}: {_describe(sf_args)}"
+          + (f" doom_obs_uint8={sf_args['doom_obs_uint8']}" if "doom_obs_uint8" in sf_args else ""))
+    return sf_args
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+环境栈吞吐基准：看 env 侧的时间花在哪一层。
+
+对每个 (场景, frameskip, 分辨率) 组合，逐层测量随机动作下的 steps/sec 与单步延迟分位数：
+    raw          裸 DoomGame（补丁后的场景 cfg，make_action + 取 screen_buffer）
+    sf           Sample Factory 的 make_doom_env_from_spec 环境
+    image        + ImageCleaningWrapper（裁剪/缩放/转置，或原生渲染直通）
+    frame_stack  + FrameStackWrapper（仅 --frame-stack > 1 时）
+    reward       + RewardShapingWrapper
+    action       + CompositeActionWrapper（= create_vizdoom_env 的完整环境）
+相邻两层的平均单步耗时之差就是该层的开销。episode 结束时的 reset 不计入单步延迟，单独统计。
+
+分辨率写法：WxH 为默认的裁剪+缩放路径（观察尺寸 res_w x res_h），native-WxH 为引擎原生渲染（4:3）。
+观察类型默认与训练默认一致（float32），--obs-uint8 测 --doom_obs_uint8 的 uint8 观察；两者的结果分开对比。
+
+结果写成 JSON，可以作为下次运行的 --baseline：
+    python src/bench_env.py --out bench/env_baseline.json
+    python src/bench_env.py --baseline bench/env_baseline.json --out bench/env_new.json   # 变慢超过容差时退出码为 1
+    python src/bench_env.py --scenarios custom_doom_basic --frameskips 1 4 --resolutions 128x72 native-160x120
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.envs.scenario_cache import SCENARIO_FILES, build_scenario
+from src.envs.vizdoom_env import AttrDict, ENV_LAYERS, create_vizdoom_env
+
+LAYERS = ("raw",) + ENV_LAYERS
+RESULT_KEY = ("scenario", "layer", "frameskip", "resolution", "obs_uint8")
+
+
+def result_key(row):
+    # 加入 obs_uint8 之前的结果文件都是按 uint8 观察测的
+    return tuple(row.get(k, True) if k == "obs_uint8" else row[k] for k in RESULT_KEY)
+
+
+def parse_resolution(text):
+    """"128x72" -> (False, 128, 72)；"native-160x120" -> (True, 160, 120)"""
+    native = text.startswith("native-")
+    if native:
+        text = text[len("native-"):]
+    w, h = (int(v) for v in text.split("x"))
+    return native, w, h
+
+
+def make_cfg(frameskip, resolution, frame_stack, obs_uint8=False):
+    native, w, h = parse_resolution(resolution)
+    cfg = AttrDict(
+        record_to=None, env_frameskip=frameskip, wide_aspect_ratio=False,
+        res_w=w, res_h=h, pixel_format="CHW",
+        doom_native_obs=native, doom_obs_grayscale=False, doom_obs_uint8=obs_uint8,
+        doom_frame_stack=frame_stack,
+    )
+    if native:
+        cfg.doom_native_resolution = f"{w}x{h}"
+    return cfg
+
+
+class RawGame:
+    """裸 DoomGame，接口仿 gym（reset / step / close），给 raw 层做对照"""
+    def __init__(self, env_name, cfg, seed):
+        import vizdoom as vzd
+        native = cfg.doom_native_obs
+        extra = {"render_hud": "false", "screen_format": "CRCGCB"} if native else None
+        self.game = vzd.DoomGame()
+        self.game.load_config(build_scenario(SCENARIO_FILES[env_name], extra))
+        self.game.set_window_visible(False)
+        self.game.set_sound_enabled(False)
+        # 与 SF 的 VizdoomEnv 一致：默认引擎分辨率 160x120，原生模式下为目标分辨率
+        resolution = cfg.doom_native_resolution if native else "160x120"
+        self.game.set_screen_resolution(getattr(vzd.ScreenResolution, f"RES_{resolution.upper()}"))
+        self.game.set_seed(seed)
+        self.game.init()
+        self.frameskip = cfg.env_frameskip
+        self.num_buttons = self.game.get_available_buttons_size()
+        self.rng = np.random.default_rng(seed)
+
+    def reset(self):
+        self.game.new_episode()
+        return self.game.get_state().screen_buffer
+
+    def step(self):
+        action = [0.0] * self.num_buttons
+        action[self.rng.integers(self.num_buttons)] = 1.0
+        reward = self.game.make_action(action, self.frameskip)
+        done = self.game.is_episode_finished()
+        obs = None if done else self.game.get_state().screen_buffer
+        return obs, reward, done
+
+    def close(self):
+        self.game.close()
+
+
+class GymLayer:
+    """create_vizdoom_env 构造到某一层为止的环境，随机动作"""
+    def __init__(self, env_name, cfg, layer, seed):
+        self.env = create_vizdoom_env(env_name, cfg=cfg, stop_after=layer)
+        self.env.action_space.seed(seed)
+        self.seed = seed
+
+    def reset(self):
+        obs, _ = self.env.reset(seed=self.seed)
+        self.seed += 1
+        return obs
+
+    def step(self):
+        obs, reward, terminated, truncated, _ = self.env.step(self.env.action_space.sample())
+        return obs, reward, terminated or truncated
+
+    def close(self):
+        self.env.close()
+
+
+def measure(env, steps, warmup):
+    """跑 warmup + steps 步（episode 结束即 reset），返回单步耗时（毫秒）列表和 reset 耗时列表"""
+    env.reset()
+    step_ms, reset_ms = [], []
+    for i in range(warmup + steps):
+        start = time.perf_counter()
+        _, _, done = env.step()
+        elapsed = (time.perf_counter() - start) * 1000.0
+        if i >= warmup:
+            step_ms.append(elapsed)
+        if done:
+            start = time.perf_counter()
+            env.reset()
+            if i >= warmup:
+                reset_ms.append((time.perf_counter() - start) * 1000.0)
+    return step_ms, reset_ms
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def summarize_timings(step_ms, reset_ms):
+    s = sorted(step_ms)
+    mean_ms = statistics.fmean(s)
+    return {
+        "steps_per_sec": 1000.0 / mean_ms,
+        "mean_ms": mean_ms,
+        "p50_ms": percentile(s, 0.5),
+        "p90_ms": percentile(s, 0.9),
+        "p99_ms": percentile(s, 0.99),
+        "resets": len(reset_ms),
+        "reset_mean_ms": statistics.fmean(reset_ms) if reset_ms else None,
+    }
+
+
+def run_suite(args):
+    results = []
+    layers = [layer for layer in args.layers if layer != "frame_stack" or args.frame_stack > 1]
+    for env_name in args.scenarios:
+        for frameskip in args.frameskips:
+            for resolution in args.resolutions:
+                cfg = make_cfg(frameskip, resolution, args.frame_stack, args.obs_uint8)
+                prev_mean = None
+                for layer in layers:
+                    env = RawGame(env_name, cfg, args.seed) if layer == "raw" else GymLayer(env_name, cfg, layer, args.seed)
+                    try:
+                        step_ms, reset_ms = measure(env, args.steps, args.warmup)
+                    finally:
+                        env.close()
+                    row = {"scenario": env_name, "layer": layer, "frameskip": frameskip, "resolution": resolution,
+                           "obs_uint8": args.obs_uint8}
+                    row.update(summarize_timings(step_ms, reset_ms))
+                    # 与上一层相比多出来的平均单步耗时，即这一层自身的开销
+                    row["layer_overhead_ms"] = None if prev_mean is None else row["mean_ms"] - prev_mean
+                    prev_mean = row["mean_ms"]
+                    results.append(row)
+                    overhead = "" if row["layer_overhead_ms"] is None else f"  (+{row['layer_overhead_ms']:.3f} ms)"
+                    print(f"   {env_name:<30} fs={frameskip} {resolution:<15} {layer:<12} "
+                          f"{row['steps_per_sec']:9.1f} steps/s  p50 {row['p50_ms']:.3f}  "
+                          f"p99 {row['p99_ms']:.3f} ms{overhead}")
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """按 (场景, 层, frameskip, 分辨率, 观察类型) 对齐，steps/sec 下降超过 tolerance 的记为回退，返回回退列表"""
+    base = {result_key(r): r for r in baseline["results"]}
+    regressions = []
+    print(f"\n📊 Compared with baseline ({baseline['meta'].get('timestamp', '?')}):")
+    for row in results:
+        ref = base.get(result_key(row))
+        if ref is None:
+            continue
+        ratio = row["steps_per_sec"] / ref["steps_per_sec"]
+        flag = ""
+        if ratio < 1.0 - tolerance:
+            flag = "  ⚠️  REGRESSION"
+            regressions.append({**{k: row[k] for k in RESULT_KEY}, "ratio": ratio})
+        print(f"   {row['scenario']:<30} fs={row['frameskip']} {row['resolution']:<15} {row['layer']:<12} "
+              f"{ref['steps_per_sec']:9.1f} -> {row['steps_per_sec']:9.1f} steps/s (x{ratio:.2f}){flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark env throughput per wrapper layer")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIO_FILES), choices=list(SCENARIO_FILES))
+    parser.add_argument("--frameskips", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--resolutions", nargs="+", default=["128x72", "native-160x120"],
+                        help="WxH (crop+resize path) or native-WxH (engine-native rendering)")
+    parser.add_argument("--layers", nargs="+", default=list(LAYERS), choices=list(LAYERS))
+    parser.add_argument("--frame-stack", type=int, default=1, help="Also measure FrameStackWrapper with this many frames")
+    parser.add_argument("--obs-uint8", action="store_true",
+                        help="Benchmark uint8 observations (default: float32, like training without --doom_obs_uint8)")
+    parser.add_argument("--steps", type=int, default=2000, help="Measured steps per configuration")
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=str, default=None, help="Write results JSON here")
+    parser.add_argument("--baseline", type=str, default=None, help="Earlier results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Relative steps/sec drop counted as a regression")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('ALSOFT_DRIVERS', 'null')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    import vizdoom as vzd
+
+    print(f"🏁 Env benchmark: {len(args.scenarios)} scenario(s) x frameskip {args.frameskips} x {args.resolutions}, "
+          f"{'uint8' if args.obs_uint8 else 'float32'} obs, {args.steps} steps each")
+    results = run_suite(args)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host": platform.node(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "vizdoom": getattr(vzd, "__version__", "unknown"),
+            "cpu_count": os.cpu_count(),
+            "steps": args.steps,
+            "frame_stack": args.frame_stack,
+            "obs_uint8": args.obs_uint8,
+        },
+        "results": results,
+    }
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        report["regressions"] = regressions
+        if regressions:
+            print(f"\n❌ {len(regressions)} configuration(s) slower than baseline by more than {args.tolerance:.0%}")
+            status = 1
+        else:
+            print("\n✅ No regressions")
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Saved: {args.out}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
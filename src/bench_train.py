@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+端到端训练吞吐基准 + 回退检测：在参数网格上启动 src/train_custom.py，每组跑固定的 env step 预算。
+
+网格：num_workers x num_envs_per_worker x batch_size x doom_frame_stack。
+从 Sample Factory 的周期性日志里抓取：
+    Fps is (10 sec: ..., 60 sec: ..., 300 sec: ...). Total num frames: ...   -> 采样 FPS
+    Throughput: 0: ...                                                       -> learner samples/sec
+    Policy #0 lag: (min: ..., avg: ..., max: ...)                            -> policy lag
+第一条报告（启动阶段）不计入，取其余 10 秒窗口的中位数；
+同时用 psutil 轮询整个进程树（SF 的 worker 都是子进程），记录 RSS 总和的峰值。
+
+每组结果追加到 results 文件（JSONL，一行一次运行）。同一组参数在上一次运行中的结果作为参照，
+env steps/sec 或 samples/sec 下降、峰值 RSS 上涨超过容差时标记为回退，退出码为 1。
+
+用法：
+    python src/bench_train.py --env custom_doom_basic --env-steps 200000
+    python src/bench_train.py --num-workers 4 8 --num-envs-per-worker 4 8 --batch-sizes 1024 2048 --frame-stacks 1 4
+    python src/bench_train.py --env-steps 100000 -- --encoder_variant depthwise   # -- 之后原样传给 train_custom.py
+"""
+import argparse
+import itertools
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+FPS_RE = re.compile(r"Fps is \(10 sec: ([-\w.]+), 60 sec: ([-\w.]+), 300 sec: ([-\w.]+)\)\. Total num frames: (\d+)")
+THROUGHPUT_RE = re.compile(r"Throughput: 0: ([-\w.]+)")
+LAG_RE = re.compile(r"Policy #0 lag: \(min: ([-\w.]+), avg: ([-\w.]+), max: ([-\w.]+)\)")
+GRID_KEYS = ("num_workers", "num_envs_per_worker", "batch_size", "frame_stack")
+# 指标 -> 方向（+1 越大越好，-1 越小越好），用于回退判定
+REGRESSION_METRICS = {"env_steps_per_sec": 1, "learner_samples_per_sec": 1, "peak_rss_mb": -1}
+
+
+def _float(text):
+    try:
+        # 句末的数字会带上句号，例如 "Throughput: 0: 1103.2."
+        return float(text.rstrip("."))
+    except ValueError:
+        return float("nan")
+
+
+def _median(values):
+    values = [v for v in values if v == v]
+    return statistics.median(values) if values else None
+
+
+class LogScraper:
+    """逐行解析 SF 日志，累积 FPS / throughput / lag 样本"""
+    def __init__(self):
+        self.fps = []
+        self.throughput = []
+        self.lag_avg = []
+        self.lag_max = []
+        self.total_frames = 0
+
+    def feed(self, line):
+        m = FPS_RE.search(line)
+        if m:
+            self.fps.append(_float(m.group(1)))
+            self.total_frames = int(m.group(4))
+        m = THROUGHPUT_RE.search(line)
+        if m:
+            self.throughput.append(_float(m.group(1)))
+        m = LAG_RE.search(line)
+        if m:
+            self.lag_avg.append(_float(m.group(2)))
+            self.lag_max.append(_float(m.group(3)))
+
+    def metrics(self, frameskip):
+        # 第一条报告包含启动和预热，不代表稳态
+        fps = _median(self.fps[1:] or self.fps)
+        return {
+            "fps": fps,
+            "env_steps_per_sec": None if fps is None else fps / frameskip,
+            "learner_samples_per_sec": _median(self.throughput[1:] or self.throughput),
+            "policy_lag_avg": _median(self.lag_avg),
+            "policy_lag_max": max((v for v in self.lag_max if v == v), default=None),
+            "total_frames": self.total_frames,
+            "reports": len(self.fps),
+        }
+
+
+class RssMonitor(threading.Thread):
+    """后台轮询进程树的 RSS 总和，记录峰值（MB）；没有 psutil 时不测"""
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_mb = None
+        self._done = threading.Event()
+
+    def run(self):
+        try:
+            import psutil
+        except ImportError:
+            print("[Warning] psutil not installed, peak RSS is not measured")
+            return
+        try:
+            root = psutil.Process(self.pid)
+        except psutil.NoSuchProcess:
+            return
+        peak = 0
+        while not self._done.is_set():
+            try:
+                procs = [root] + root.children(recursive=True)
+            except psutil.NoSuchProcess:
+                break
+            total = 0
+            for p in procs:
+                try:
+                    total += p.memory_info().rss
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    pass
+            peak = max(peak, total)
+            self.peak_mb = peak / 2 ** 20
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def build_command(args, params, experiment, train_dir):
+    cmd = [
+        sys.executable, str(PROJECT_ROOT / "src" / "train_custom.py"),
+        "--env", args.env,
+        "--experiment", experiment,
+        "--train_dir", str(train_dir),
+        "--num_workers", str(params["num_workers"]),
+        "--num_envs_per_worker", str(params["num_envs_per_worker"]),
+        "--batch_size", str(params["batch_size"]),
+        "--doom_frame_stack", str(params["frame_stack"]),
+        "--env_frameskip", str(args.env_frameskip),
+        "--train_for_env_steps", str(args.env_steps),
+        "--device", args.device,
+        "--seed", str(args.seed),
+        "--restart_behavior", "overwrite",
+        "--save_every_sec", "100000",
+        "--keep_checkpoints", "1",
+        "--with_wandb", "False",
+    ]
+    return cmd + args.train_args
+
+
+def run_one(args, params, run_dir):
+    """跑一组参数，返回结果记录（含日志路径）"""
+    name = "_".join(f"{k}{params[k]}" for k in GRID_KEYS)
+    log_path = run_dir / f"{name}.log"
+    cmd = build_command(args, params, name, run_dir / "train_dir")
+    env = dict(os.environ, PYTHONPATH=str(PROJECT_ROOT) + os.pathsep + os.environ.get("PYTHONPATH", ""))
+
+    scraper = LogScraper()
+    start = time.perf_counter()
+    timed_out = False
+    with open(log_path, "w", encoding="utf-8") as log:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                cwd=str(PROJECT_ROOT), env=env, bufsize=1)
+        monitor = RssMonitor(proc.pid)
+        monitor.start()
+        # 超时后杀掉进程，stdout 随之关闭，读循环自然结束
+        timer = threading.Timer(args.timeout, proc.kill) if args.timeout else None
+        if timer:
+            timer.start()
+        for line in proc.stdout:
+            log.write(line)
+            scraper.feed(line)
+        proc.wait()
+        if timer:
+            timed_out = not timer.is_alive() and proc.returncode != 0
+            timer.cancel()
+        monitor.stop()
+
+    record = {"config": params, "exit_code": proc.returncode, "timed_out": timed_out,
+              "wall_sec": time.perf_counter() - start, "peak_rss_mb": monitor.peak_mb, "log": str(log_path)}
+    record.update(scraper.metrics(args.env_frameskip))
+    return record
+
+
+def config_key(env_name, env_steps, train_args, params):
+    return json.dumps({"env": env_name, "env_steps": env_steps, "train_args": train_args,
+                       **{k: params[k] for k in GRID_KEYS}}, sort_keys=True)
+
+
+def load_previous(results_path):
+    """读出历史结果，返回 {config_key: 最近一次的记录}"""
+    previous = {}
+    if not results_path.exists():
+        return previous
+    with open(results_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                r = json.loads(line)
+                previous[r["key"]] = r
+    return previous
+
+
+def find_regressions(record, reference, tolerance):
+    """逐项比较，返回 [(指标, 旧值, 新值, 比值)]"""
+    found = []
+    for metric, direction in REGRESSION_METRICS.items():
+        old, new = reference.get(metric), record.get(metric)
+        if not old or new is None:
+            continue
+        ratio = new / old
+        if (direction > 0 and ratio < 1.0 - tolerance) or (direction < 0 and ratio > 1.0 + tolerance):
+            found.append((metric, old, new, ratio))
+    return found
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=str(PROJECT_ROOT),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _fmt(value, spec=".1f"):
+    return "-" if value is None else format(value, spec)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # "--" 之后的参数原样传给 train_custom.py
+    train_args = argv[argv.index("--") + 1:] if "--" in argv else []
+    argv = argv[:argv.index("--")] if "--" in argv else argv
+
+    parser = argparse.ArgumentParser(description="Training throughput benchmark and regression check around train_custom.py")
+    parser.add_argument("--env", type=str, default="custom_doom_basic")
+    parser.add_argument("--env-steps", type=int, default=200000, help="train_for_env_steps per run")
+    parser.add_argument("--num-workers", type=int, nargs="+", default=[4])
+    parser.add_argument("--num-envs-per-worker", type=int, nargs="+", default=[4])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1024])
+    parser.add_argument("--frame-stacks", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--env-frameskip", type=int, default=1, help="Passed to train_custom.py; env steps/sec = FPS / frameskip")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out-dir", type=str, default="bench/train", help="Logs and throwaway train dirs")
+    parser.add_argument("--results", type=str, default=None, help="JSONL results file (default: <out-dir>/results.jsonl)")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Relative change counted as a regression")
+    parser.add_argument("--timeout", type=float, default=3600, help="Kill a run after this many seconds (0 = never)")
+    args = parser.parse_args(argv)
+    args.train_args = train_args
+
+    out_dir = Path(args.out_dir)
+    run_id = time.strftime("%Y%m%d-%H%M%S")
+    run_dir = out_dir / run_id
+    run_dir.mkdir(parents=True, exist_ok=True)
+    results_path = Path(args.results) if args.results else out_dir / "results.jsonl"
+    previous = load_previous(results_path)
+    revision = git_revision()
+
+    grid = [dict(zip(GRID_KEYS, values)) for values in itertools.product(
+        args.num_workers, args.num_envs_per_worker, args.batch_sizes, args.frame_stacks)]
+    print(f"🏁 Training benchmark {run_id}: {len(grid)} configuration(s) x {args.env_steps} env steps on {args.env}")
+
+    rows, regressions = [], []
+    for i, params in enumerate(grid):
+        print(f"\n🚀 [{i + 1}/{len(grid)}] " + " ".join(f"{k}={v}" for k, v in params.items()))
+        record = run_one(args, params, run_dir)
+        key = config_key(args.env, args.env_steps, train_args, params)
+        record.update(key=key, run_id=run_id, git=revision, env=args.env, env_steps=args.env_steps,
+                      timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"))
+        status = "✅" if record["exit_code"] == 0 else f"❌ exit {record['exit_code']}"
+        print(f"   {status}  env steps/s {_fmt(record['env_steps_per_sec'])}, learner samples/s "
+              f"{_fmt(record['learner_samples_per_sec'])}, lag avg {_fmt(record['policy_lag_avg'], '.2f')}, "
+              f"peak RSS {_fmt(record['peak_rss_mb'], '.0f')} MB, {record['wall_sec']:.0f}s")
+
+        reference = previous.get(key)
+        if record["exit_code"] == 0 and reference is not None and reference.get("exit_code") == 0:
+            found = find_regressions(record, reference, args.tolerance)
+            record["regressions"] = [m for m, *_ in found]
+            for metric, old, new, ratio in found:
+                print(f"   ⚠️  REGRESSION {metric}: {old:.1f} -> {new:.1f} (x{ratio:.2f}) vs run {reference['run_id']}")
+                regressions.append((params, metric, ratio))
+        with open(results_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        rows.append(record)
+
+    print(f"\n📊 Summary ({results_path}):")
+    print(f"   {'workers':>7} {'envs/w':>6} {'batch':>6} {'stack':>5} {'env steps/s':>12} {'samples/s':>10} {'lag':>5} {'RSS MB':>7}")
+    for r in rows:
+        c = r["config"]
+        print(f"   {c['num_workers']:>7} {c['num_envs_per_worker']:>6} {c['batch_size']:>6} {c['frame_stack']:>5} "
+              f"{_fmt(r['env_steps_per_sec']):>12} {_fmt(r['learner_samples_per_sec']):>10} "
+              f"{_fmt(r['policy_lag_avg'], '.2f'):>5} {_fmt(r['peak_rss_mb'], '.0f'):>7}")
+
+    failed = [r for r in rows if r["exit_code"] != 0]
+    if failed:
+        print(f"\n❌ {len(failed)} run(s) failed, see logs in {run_dir}")
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s) beyond {args.tolerance:.0%} against the previous run")
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,345 @@
+"""
+Checkpoint 读取：每个文件只反序列化一次，并附带模型结构的 manifest。
+
+支持两种文件：
+- Sample Factory 保存的 pickle .pth（torch.load，能 mmap 时直接映射）
+- convert_checkpoint.py 导出的 .safetensors（8 字节头长度 + JSON 头 + 原始张量数据），
+  读取时整个文件 mmap，张量用 torch.frombuffer 零拷贝映射，不经过 pickle
+
+manifest 的来源按优先级：
+1. checkpoint 里内嵌的 "manifest"（convert_checkpoint.py 导出的文件）
+2. Sample Factory 实验目录下的 config.json（train_dir/<exp>/checkpoint_p0/xxx.pth 往上两级）
+3. 从权重形状推断（旧文件的兜底：rnn_size / decoder 宽度 / 观察形状 / 叠帧数）
+
+evaluate.py、eval_farm.py、run_enjoy_safe.py 和 convert_checkpoint.py 共用这里的逻辑。
+"""
+import hashlib
+import json
+import mmap
+import struct
+from pathlib import Path
+
+import torch
+
+MANIFEST_KEY = "manifest"
+MANIFEST_VERSION = 1
+
+# 决定模型结构 / 观察预处理、需要与训练时一致的 cfg 键
+MANIFEST_CFG_KEYS = (
+    "use_rnn", "rnn_size", "rnn_type", "decoder_mlp_layers",
+    "encoder_variant", "encoder_frame_cache",
+    "normalize_input", "obs_subtract_mean", "obs_scale",
+    "res_w", "res_h", "env_frameskip",
+    "doom_native_obs", "doom_native_resolution", "doom_obs_grayscale",
+    "doom_obs_uint8", "doom_legacy_obs_scale", "doom_frame_stack",
+)
+
+# safetensors 的 dtype 名
+SAFETENSORS_DTYPES = {
+    torch.float64: "F64", torch.float32: "F32", torch.float16: "F16", torch.bfloat16: "BF16",
+    torch.int64: "I64", torch.int32: "I32", torch.int16: "I16", torch.int8: "I8",
+    torch.uint8: "U8", torch.bool: "BOOL",
+}
+_SAFETENSORS_TORCH_DTYPES = {v: k for k, v in SAFETENSORS_DTYPES.items()}
+
+# 没有 manifest 字段时的模型默认参数（与 evaluate.get_eval_config 一致）
+DEFAULT_POLICY_CFG = dict(
+    use_rnn=True, rnn_size=512, rnn_type="gru", actor_critic_share_weights=True,
+    decoder_mlp_layers=[512], nonlinearity="relu", use_encoder_linear=True,
+    normalize_input=True, normalize_input_keys=None, obs_subtract_mean=0.0, obs_scale=255.0,
+    normalize_returns=True, encoder_variant="legacy", encoder_frame_cache=False,
+    doom_obs_uint8=False, doom_legacy_obs_scale=True, doom_frame_stack=1,
+    # 环境部分（create_vizdoom_env 需要）
+    res_w=128, res_h=72, wide_aspect_ratio=False, env_frameskip=4, pixel_format="CHW",
+    doom_native_obs=False, doom_native_resolution="160x120", doom_obs_grayscale=False,
+)
+
+
+class AttrDict(dict):
+    __getattr__ = dict.__getitem__
+    __setattr__ = dict.__setitem__
+
+# 在 patch 之前保存原始 torch.load（run_enjoy_safe 会把 torch.load 换成 load_torch_file）
+_torch_load = torch.load
+
+
+def load_torch_file(path, map_location="cpu", weights_only=False, **kwargs):
+    """
+    torch.load 的封装：优先用 mmap=True 直接映射 zip 格式文件，张量按需读入。
+    旧版 torch（<2.1 没有 mmap 参数）或旧的非 zip 格式会退回普通加载。
+    """
+    kwargs.pop("mmap", None)
+    try:
+        return _torch_load(path, map_location=map_location, weights_only=weights_only, mmap=True, **kwargs)
+    except TypeError:
+        pass
+    except RuntimeError as e:
+        if "mmap" not in str(e) and "zip" not in str(e):
+            raise
+    return _torch_load(path, map_location=map_location, weights_only=weights_only, **kwargs)
+
+
+def extract_state_dict(checkpoint):
+    """常见存放位置为 checkpoint["model"]，否则找第一个看起来像 state_dict 的值"""
+    if isinstance(checkpoint, dict) and checkpoint.get("model") is not None:
+        return checkpoint["model"]
+    if isinstance(checkpoint, dict):
+        if checkpoint and all(isinstance(v, torch.Tensor) for v in checkpoint.values()):
+            return checkpoint
+        for v in checkpoint.values():
+            if isinstance(v, dict):
+                return v
+    return None
+
+
+def manifest_from_cfg(cfg, env=None, obs_shape=None):
+    """从训练 cfg（AttrDict / Namespace / dict）中摘出 manifest"""
+    if not isinstance(cfg, dict):
+        cfg = vars(cfg)
+    manifest = {"version": MANIFEST_VERSION}
+    for key in MANIFEST_CFG_KEYS:
+        if key in cfg:
+            manifest[key] = cfg[key]
+    env = env or cfg.get("env")
+    if env:
+        manifest["env"] = env
+    if obs_shape is not None:
+        manifest["obs_shape"] = list(obs_shape)
+    return manifest
+
+
+def experiment_config_manifest(checkpoint_path):
+    """Sample Factory 实验目录下的 config.json -> manifest，找不到时返回 None"""
+    config_path = Path(checkpoint_path).resolve().parent.parent / "config.json"
+    if not config_path.is_file():
+        return None
+    try:
+        with open(config_path, "r", encoding="utf-8") as f:
+            return manifest_from_cfg(json.load(f))
+    except (OSError, ValueError):
+        return None
+
+
+def infer_manifest(state_dict, grayscale=False):
+    """旧文件兜底：从权重形状推断结构参数；grayscale 决定每帧的通道数（推断叠帧数用）"""
+    manifest = {"version": MANIFEST_VERSION}
+    # decoder 的 MLP（Sample Factory 的 create_mlp：Linear 与激活交替，Linear 的下标为 0, 2, ...）
+    # 没有任何 decoder.mlp 权重说明是默认的 decoder_mlp_layers=[]
+    decoder_layers = []
+    for k, v in state_dict.items():
+        parts = k.split(".")
+        if len(parts) >= 4 and parts[-4:-2] == ["decoder", "mlp"] and parts[-1] == "weight" and parts[-2].isdigit():
+            decoder_layers.append((int(parts[-2]), int(v.shape[0])))
+    manifest["decoder_mlp_layers"] = [width for _, width in sorted(decoder_layers)]
+    for k, v in state_dict.items():
+        shape = getattr(v, "shape", None)
+        if shape is None:
+            continue
+        # GRU 的 weight_ih_l0 形状为 (3 * hidden_size, input_size)
+        if "rnn_size" not in manifest and ".gru.weight_ih_l0" in k and shape[0] % 3 == 0:
+            manifest["rnn_size"] = shape[0] // 3
+        # 观察归一化的 running_mean 形状就是观察形状
+        elif "obs_shape" not in manifest and k.endswith(".obs.running_mean"):
+            manifest["obs_shape"] = list(shape)
+            # 按通道叠帧时通道数 = 叠帧数 x 每帧通道数（RGB 为 3，灰度为 1）
+            frame_channels = 1 if grayscale else 3
+            if len(shape) == 3 and shape[0] % frame_channels == 0:
+                manifest["doom_frame_stack"] = shape[0] // frame_channels
+    return manifest
+
+
+class LoadedCheckpoint:
+    """一次读取的结果：state_dict、manifest 以及 manifest 的来源（embedded / experiment_config / inferred）"""
+    def __init__(self, path, state_dict, manifest, manifest_source, raw=None):
+        self.path = str(path)
+        self.state_dict = state_dict
+        self.manifest = manifest
+        self.manifest_source = manifest_source
+        self.raw = raw
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def write_safetensors(path, state_dict, metadata=None, dtype=None, keep_dtype=lambda key: False):
+    """
+    逐个张量流式写出 safetensors 文件，不在内存里拼接整个文件。
+
+    dtype: 浮点张量存储时转换成的类型（例如 torch.float16），None 表示保持原样；
+    keep_dtype(key) 为真的张量不转换（例如观察归一化的统计量）。
+    metadata: {str: str}，写进 "__metadata__"。
+    """
+    header = {}
+    offset = 0
+    tensors = []
+    for key, t in state_dict.items():
+        if not isinstance(t, torch.Tensor):
+            continue
+        if dtype is not None and t.is_floating_point() and not keep_dtype(key):
+            t = t.to(dtype)
+        nbytes = t.numel() * t.element_size()
+        header[key] = {"dtype": SAFETENSORS_DTYPES[t.dtype], "shape": list(t.shape),
+                       "data_offsets": [offset, offset + nbytes]}
+        tensors.append(t)
+        offset += nbytes
+    if metadata:
+        header["__metadata__"] = {k: str(v) for k, v in metadata.items()}
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    # 头部补空格到 8 字节对齐，数据区的张量才能按自身 dtype 对齐映射
+    header_bytes += b" " * (-len(header_bytes) % 8)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for t in tensors:
+            if t.numel():
+                f.write(t.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().data)
+
+
+def read_safetensors_header(path):
+    """只读头部：返回 (header, metadata)"""
+    with open(path, "rb") as f:
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_len))
+    return header, header.pop("__metadata__", {})
+
+
+def read_safetensors(path):
+    """
+    mmap 整个文件，按头部描述用 torch.frombuffer 映射出各张量（零拷贝，按需缺页读入）。
+    返回 (state_dict, manifest)，文件里没有 manifest 时 manifest 为 None。
+    """
+    with open(path, "rb") as f:
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_len))
+        # ACCESS_COPY：映射可写（写时复制），torch.frombuffer 不会警告只读缓冲区，文件也不会被改动
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    metadata = header.pop("__metadata__", {})
+    data_start = 8 + header_len
+    state_dict = {}
+    for key, info in header.items():
+        dtype = _SAFETENSORS_TORCH_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        count = (end - begin) // torch.empty((), dtype=dtype).element_size()
+        if count:
+            t = torch.frombuffer(buf, dtype=dtype, count=count, offset=data_start + begin)
+        else:
+            t = torch.empty(0, dtype=dtype)
+        state_dict[key] = t.reshape(info["shape"])
+    manifest = json.loads(metadata[MANIFEST_KEY]) if MANIFEST_KEY in metadata else None
+    return state_dict, manifest
+
+
+def read_checkpoint(path, map_location="cpu"):
+    """只反序列化一次，返回 LoadedCheckpoint"""
+    path = str(path)
+    if path.endswith(".safetensors"):
+        state_dict, manifest = read_safetensors(path)
+        if map_location not in (None, "cpu"):
+            state_dict = {k: v.to(map_location) for k, v in state_dict.items()}
+        if manifest is None:
+            return LoadedCheckpoint(path, state_dict, infer_manifest(state_dict), "inferred")
+        return LoadedCheckpoint(path, state_dict, manifest, "embedded")
+
+    checkpoint = load_torch_file(path, map_location=map_location)
+    state_dict = extract_state_dict(checkpoint)
+    if state_dict is None:
+        raise ValueError(f"Failed to extract model state_dict from checkpoint: {path}")
+
+    manifest = checkpoint.get(MANIFEST_KEY) if isinstance(checkpoint, dict) else None
+    source = "embedded"
+    if manifest is None:
+        manifest = experiment_config_manifest(path)
+        source = "experiment_config"
+    inferred = infer_manifest(state_dict, grayscale=bool((manifest or {}).get("doom_obs_grayscale", False)))
+    if manifest is None:
+        manifest, source = inferred, "inferred"
+    else:
+        # 推断只用来补齐配置里缺的字段，嵌入的 manifest / config.json 优先
+        manifest = {**inferred, **manifest}
+    return LoadedCheckpoint(path, state_dict, manifest, source, raw=checkpoint)
+
+
+def apply_manifest(cfg, manifest, verbose=True):
+    """把 manifest 中的结构参数写进 cfg"""
+    for key in MANIFEST_CFG_KEYS:
+        if key not in manifest:
+            continue
+        value = manifest[key]
+        if key in cfg and cfg[key] == value:
+            continue
+        if verbose:
+            print(f"[Info] Checkpoint manifest sets {key}={value!r} (was {cfg[key] if key in cfg else None!r})")
+        cfg[key] = value
+    return cfg
+
+
+def load_state_dict_filtered(model, state_dict, required_prefixes=()):
+    """
+    加载权重，跳过与当前模型形状不匹配的 key。
+    以 required_prefixes 开头的 key 形状不匹配时抛 ValueError（通常是观察设置与训练时不同）；
+    模型里没有被 checkpoint 覆盖的 key（会停留在随机初始化）逐个警告，返回这些 key 的列表。
+    """
+    model_state = model.state_dict()
+    filtered_state = {}
+    mismatched = []
+    for k, v in state_dict.items():
+        if k in model_state:
+            if getattr(v, "shape", None) == model_state[k].shape:
+                filtered_state[k] = v.to(model_state[k].dtype) if v.dtype != model_state[k].dtype else v
+            else:
+                print(f"[Info] Skipping checkpoint key {k} due to shape mismatch {getattr(v, 'shape', None)} vs {model_state[k].shape}")
+                if k.startswith(tuple(required_prefixes)):
+                    mismatched.append(k)
+        else:
+            print(f"[Info] Skipping checkpoint key {k} (not present in model)")
+    if mismatched:
+        raise ValueError(
+            f"Checkpoint does not fit the model: {', '.join(mismatched)} have different shapes "
+            f"(check doom_frame_stack / doom_obs_grayscale / resolution against the training config)"
+        )
+    missing, _ = model.load_state_dict(filtered_state, strict=False)
+    if missing:
+        print(f"[Warning] {len(missing)} model key(s) not loaded from the checkpoint and left at random init: "
+              f"{', '.join(missing)}")
+    return missing
+
+
+def build_policy(ckpt, cfg, obs_space, action_space, device="cpu"):
+    """用（已 apply_manifest 的）cfg 构造模型并载入 ckpt 的权重，返回 eval 模式的模型"""
+    from src.models.custom_model import make_vizdoom_actor_critic
+    model = make_vizdoom_actor_critic(cfg, obs_space, action_space)
+    # encoder 和观察归一化的形状由观察设置决定，对不上时模型等于部分随机初始化，直接报错
+    load_state_dict_filtered(model, ckpt.state_dict, required_prefixes=("encoder.", "encoders.", "obs_normalizer."))
+    model.to(device)
+    model.eval()
+    return model
+
+
+def policy_cfg_from_manifest(manifest):
+    """不经过 evaluate 的命令行参数时用的 cfg（模型 + 环境）：默认值 + manifest"""
+    return apply_manifest(AttrDict(DEFAULT_POLICY_CFG), manifest, verbose=False)
+
+
+def policy_spaces(ckpt, cfg):
+    """
+    从 manifest 和权重推出 (obs_space, action_space)，导出 / 基准测试时不需要 ViZDoom。
+    manifest 里没有 obs_shape（也推断不出来）时抛 ValueError。
+    """
+    import gymnasium as gym
+    import numpy as np
+    obs_shape = ckpt.manifest.get("obs_shape")
+    if obs_shape is None:
+        raise ValueError(f"{ckpt.path}: manifest has no obs_shape; pass it explicitly")
+    weight = ckpt.state_dict.get("action_heads.linear.weight")
+    if weight is None:
+        raise ValueError(f"{ckpt.path}: no action_heads.linear.weight in state_dict")
+    uint8 = bool(cfg.doom_obs_uint8 if "doom_obs_uint8" in cfg else False)
+    obs_space = gym.spaces.Dict({"obs": gym.spaces.Box(
+        0, 255 if uint8 else 1, tuple(obs_shape), np.uint8 if uint8 else np.float32)})
+    return obs_space, gym.spaces.Discrete(weight.shape[0])
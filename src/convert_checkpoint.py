@@ -1,35 +1,121 @@
 #!/usr/bin/env python3
 # src/convert_checkpoint.py
+"""
+把 Sample Factory 的 pickle checkpoint 转成可 mmap、零拷贝加载的 safetensors 文件（内嵌结构 manifest）。
+
+用法：
+    python src/convert_checkpoint.py train_dir/my_exp/checkpoint_p0/checkpoint_xxx.pth
+    python src/convert_checkpoint.py train_dir                # 批量转换目录下所有 .pth
+    python src/convert_checkpoint.py train_dir --dtype fp16   # 以半精度存储
+    python src/convert_checkpoint.py a.pth out.pth --format pth  # 旧的 weights-only pickle 输出
+
+已转换过的文件（输出的 source_sha256 与源文件一致且 dtype 相同）会被跳过，--force 强制重转。
+"""
+import argparse
+import json
 import sys
+import time
 import torch
 from pathlib import Path
 
-if len(sys.argv) < 2:
-    print("Usage: python src/convert_checkpoint.py <checkpoint.pth> [out.pth]")
-    sys.exit(2)
-
-inp = Path(sys.argv[1])
-out = Path(sys.argv[2]) if len(sys.argv) >= 3 else inp.with_name(inp.stem + ".weights_only.pth")
-
-print("Loading:", inp)
-# 这里显式允许不安全加载旧格式（仅在你信任文件来源时使用）
-checkpoint = torch.load(str(inp), map_location="cpu", weights_only=False)
-
-# 常见存放位置为 checkpoint["model"]
-if isinstance(checkpoint, dict) and "model" in checkpoint and checkpoint["model"] is not None:
-    model_state = checkpoint["model"]
-else:
-    # 尝试从 dict 中找第一个看起来像 state_dict 的值
-    model_state = None
-    if isinstance(checkpoint, dict):
-        for v in checkpoint.values():
-            if isinstance(v, dict):
-                model_state = v
-                break
-
-if model_state is None:
-    print("Failed to extract model state_dict from checkpoint.")
-    sys.exit(1)
-
-torch.save({"model": model_state}, str(out))
-print("Saved weights-only checkpoint:", out)
\ No newline at end of file
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from src.checkpoint_io import (read_checkpoint, MANIFEST_KEY, file_sha256,
+                               write_safetensors, read_safetensors_header)
+
+STORAGE_DTYPES = {"fp32": None, "fp16": torch.float16, "bf16": torch.bfloat16}
+
+
+def keep_fp32(key):
+    # 观察/回报归一化的统计量留在 fp32，半精度下方差会明显失真
+    return "normalizer" in key
+
+
+def default_output(inp, fmt):
+    if fmt == "pth":
+        return inp.with_name(inp.stem + ".weights_only.pth")
+    return inp.with_suffix(".safetensors")
+
+
+def already_converted(out, source_sha256, dtype_name):
+    if not out.exists():
+        return False
+    try:
+        _, metadata = read_safetensors_header(out)
+    except (OSError, ValueError):
+        return False
+    return metadata.get("source_sha256") == source_sha256 and metadata.get("storage_dtype") == dtype_name
+
+
+def convert_one(inp, out, fmt="safetensors", dtype_name="fp32", force=False):
+    """转换单个文件，返回 "converted" 或 "skipped" """
+    if fmt == "pth":
+        print("Loading:", inp)
+        # 这里显式允许不安全加载旧格式（仅在你信任文件来源时使用）
+        ckpt = read_checkpoint(inp)
+        # 结构参数写进 manifest，之后加载时不必再从权重形状推断
+        print(f"Manifest ({ckpt.manifest_source}):", ckpt.manifest)
+        torch.save({"model": ckpt.state_dict, MANIFEST_KEY: ckpt.manifest}, str(out))
+        print("Saved weights-only checkpoint:", out)
+        return "converted"
+
+    source_sha256 = file_sha256(inp)
+    if not force and already_converted(out, source_sha256, dtype_name):
+        print(f"⏭️  {inp} (already converted)")
+        return "skipped"
+
+    start = time.perf_counter()
+    # 源文件能 mmap 时张量按需读入，写出也是逐个张量流式进行
+    ckpt = read_checkpoint(inp)
+    metadata = {
+        MANIFEST_KEY: json.dumps(ckpt.manifest),
+        "manifest_source": ckpt.manifest_source,
+        "source_sha256": source_sha256,
+        "storage_dtype": dtype_name,
+        "format": "pt",
+    }
+    tmp = out.with_name(out.name + ".tmp")
+    write_safetensors(tmp, ckpt.state_dict, metadata, dtype=STORAGE_DTYPES[dtype_name], keep_dtype=keep_fp32)
+    tmp.replace(out)
+    size_mb = out.stat().st_size / 2 ** 20
+    print(f"✅ {inp} -> {out} ({size_mb:.1f} MB, {dtype_name}, manifest: {ckpt.manifest_source}, "
+          f"{time.perf_counter() - start:.1f}s)")
+    return "converted"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert checkpoints to memory-mappable safetensors with a manifest")
+    parser.add_argument("input", help="Checkpoint .pth or a directory (e.g. train_dir) searched for *.pth")
+    parser.add_argument("output", nargs="?", default=None, help="Output file (single-file mode only)")
+    parser.add_argument("--format", choices=["safetensors", "pth"], default="safetensors")
+    parser.add_argument("--dtype", choices=sorted(STORAGE_DTYPES), default="fp32", help="Storage dtype for float weights")
+    parser.add_argument("--force", action="store_true", help="Re-convert even if the output is up to date")
+    args = parser.parse_args(argv)
+
+    inp = Path(args.input)
+    if inp.is_dir():
+        if args.output:
+            parser.error("output path is only supported for a single checkpoint")
+        sources = sorted(p for p in inp.rglob("*.pth") if not p.name.endswith(".weights_only.pth"))
+    elif inp.exists():
+        sources = [inp]
+    else:
+        print(f"❌ Not found: {inp}")
+        return 1
+    if args.format == "pth" and args.dtype != "fp32":
+        parser.error("--dtype only applies to --format safetensors")
+
+    counts = {"converted": 0, "skipped": 0, "failed": 0}
+    for src in sources:
+        out = Path(args.output) if args.output else default_output(src, args.format)
+        try:
+            counts[convert_one(src, out, args.format, args.dtype, args.force)] += 1
+        except Exception as e:
+            counts["failed"] += 1
+            print(f"❌ {src}: {e}")
+    if len(sources) > 1:
+        print(f"\n📊 {counts['converted']} converted, {counts['skipped']} skipped, {counts['failed']} failed")
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
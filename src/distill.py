@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+策略蒸馏：把训练好的 CustomVizdoomActorCritic（teacher）蒸馏成 encoder 注册表里的小模型（student）。
+
+流程（每一轮）：
+    1. 在 VecDoomEnv 上跑 N 个环境，记录观察、teacher 的 logits / value 和 episode 边界
+       第 0 轮由 teacher 决定动作；之后的轮次由当前 student 决定动作、teacher 只打标签（DAgger），
+       让 student 在自己会走到的状态上也学到 teacher 的分布
+    2. 把所有轮次的数据切成长度 seq_len 的片段，student 的 GRU 按片段展开（episode 边界处清零隐状态），
+       损失 = T^2 * KL(teacher || student)（温度 T 下的 logits）+ value_coef * MSE(value)
+观察一律按 uint8 存储（float 观察是 uint8/255，存 round(x*255)，训练时在设备上还原；
+灰度 float 观察不是 1/255 的整数倍，还原误差 < 0.002），所有轮次共用一块预分配的 (T, rounds*N, ...) 缓冲区。
+student 继承 teacher 冻结的观察归一化统计量，最后与 teacher 在同一组 seed 上比较奖励和单步延迟，
+以带 manifest 的 checkpoint 保存，evaluate.py / eval_farm.py 可以直接加载。
+
+用法：
+    python src/distill.py --checkpoint train_dir/exp/checkpoint_p0/checkpoint_xxx.pth --env custom_doom_basic
+    python src/distill.py --checkpoint ckpt.pth --env custom_doom_defend_the_center --student-encoder strided \\
+        --student-rnn-size 256 --rounds 3 --steps 50000 --obs-uint8
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+import gymnasium as gym
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.checkpoint_io import read_checkpoint, apply_manifest, build_policy, manifest_from_cfg, MANIFEST_KEY
+from src.eval_stats import summarize
+from src.export_policy import benchmark
+from src.models.custom_model import make_vizdoom_actor_critic
+from src.models.encoders import ENCODER_REGISTRY
+from src.policy_runtime import PolicyRuntime
+
+
+def make_student(teacher, cfg, encoder_variant, rnn_size, mlp_layers, device):
+    """按 teacher 的观察设置构造 student，并拷贝 teacher 的观察归一化统计量（之后保持冻结）"""
+    # cfg 是 AttrDict（缺键时抛 KeyError，deepcopy 用不了），浅拷贝后只替换结构字段
+    student_cfg = type(cfg)(cfg)
+    student_cfg.encoder_variant = encoder_variant
+    student_cfg.rnn_size = rnn_size
+    student_cfg.decoder_mlp_layers = list(mlp_layers)
+    student = make_vizdoom_actor_critic(student_cfg, teacher.obs_space, teacher.action_space).to(device)
+    student.obs_normalizer.load_state_dict(teacher.obs_normalizer.state_dict())
+    return student, student_cfg
+
+
+def allocate_storage(T, width, obs_shape, num_actions):
+    """全部轮次的数据：(T, width) 排列，width = rounds * num_envs，观察为 uint8"""
+    return {
+        "obs": np.empty((T, width) + tuple(obs_shape), dtype=np.uint8),
+        "logits": np.empty((T, width, num_actions), dtype=np.float32),
+        "values": np.empty((T, width), dtype=np.float32),
+        "resets": np.zeros((T, width), dtype=bool),
+    }
+
+
+def columns(storage, start, stop):
+    """storage 在环境维上的切片（视图，写入直接落到 storage）"""
+    return {k: v[:, start:stop] for k, v in storage.items()}
+
+
+def store_obs(out, obs):
+    """把环境观察写进 uint8 缓冲区：uint8 原样拷贝，float [0,1] 存 round(x*255)"""
+    if obs.dtype == np.uint8:
+        out[...] = obs
+    else:
+        out[...] = np.rint(np.multiply(obs, 255.0))
+
+
+def restore_obs(obs, float_obs):
+    """uint8 缓冲区里取出的 torch 张量还原成环境的 dtype（float 观察在设备上除以 255）"""
+    return obs.float().div_(255.0) if float_obs else obs
+
+
+def collect(env, teacher, actor, data):
+    """
+    在向量化环境上跑 T 步，写入 data（columns() 给出的 (T, num_envs, ...) 视图）：
+    obs、teacher logits / values，以及 resets（该步之前隐状态被清零，即新 episode 的首帧）。
+    actor 为 None 时由 teacher 采样动作，否则由 actor（student 的 runtime）采样。返回完成的 episode 奖励。
+    """
+    n = env.num_envs
+    T = data["resets"].shape[0]
+    obs, _ = env.reset()
+    data["resets"][0] = True
+    teacher.reset()
+    if actor is not None:
+        actor.reset()
+    episode_rewards, ep_rewards = [], np.zeros(n)
+    for t in range(T):
+        store_obs(data["obs"][t], obs)
+        actions = teacher.act(obs)
+        data["logits"][t] = teacher.last_logits.cpu().numpy()
+        data["values"][t] = teacher.last_values.cpu().numpy()
+        if actor is not None:
+            actions = actor.act(obs)
+        obs, r, terminated, truncated, _ = env.step(actions)
+        ep_rewards += r
+        done = terminated | truncated
+        if done.any():
+            teacher.reset(done)
+            if actor is not None:
+                actor.reset(done)
+            episode_rewards.extend(ep_rewards[done].tolist())
+            ep_rewards[done] = 0.0
+            if t + 1 < T:
+                data["resets"][t + 1] = done
+    return episode_rewards
+
+
+def unroll(model, obs, resets):
+    """student 沿 (L, B) 片段展开：encoder 一次批量前向，GRU 逐步推进并在 resets 处清零隐状态"""
+    L, B = resets.shape
+    features = model.forward_head(model.normalize_obs({"obs": obs}))
+    h = torch.zeros(B, model.get_rnn_size(), device=obs.device)
+    outputs = []
+    for t in range(L):
+        h = torch.where(resets[t].unsqueeze(1), torch.zeros_like(h), h)
+        x, h = model.forward_core(features[t], h)
+        outputs.append(x)
+    tail = model.forward_tail(torch.stack(outputs).reshape(L * B, -1), values_only=False, sample_actions=False)
+    return tail["action_logits"].reshape(L, B, -1), tail["values"].reshape(L, B)
+
+
+def distill_loss(student_logits, student_values, teacher_logits, teacher_values, mask, temperature, value_coef):
+    """T^2 * KL(teacher || student) + value_coef * MSE，只在 mask 为真的时间步上平均"""
+    log_p_student = F.log_softmax(student_logits / temperature, dim=-1)
+    log_p_teacher = F.log_softmax(teacher_logits / temperature, dim=-1)
+    kl = (log_p_teacher.exp() * (log_p_teacher - log_p_student)).sum(-1) * temperature ** 2
+    value_loss = (student_values - teacher_values) ** 2
+    weight = mask.float()
+    denom = weight.sum().clamp(min=1.0)
+    kl = (kl * weight).sum() / denom
+    value_loss = (value_loss * weight).sum() / denom
+    agreement = ((student_logits.argmax(-1) == teacher_logits.argmax(-1)).float() * weight).sum() / denom
+    return kl + value_coef * value_loss, kl.item(), value_loss.item(), agreement.item()
+
+
+def train_epoch(student, optimizer, data, args, device, rng, float_obs=False):
+    """把 (T, N) 数据切成长度 seq_len 的片段，打乱后按 batch 训练一遍，返回平均指标"""
+    T, N = data["resets"].shape
+    L = min(args.seq_len, T)
+    starts = np.arange(0, T - L + 1, L)
+    pairs = np.array([(s, e) for s in starts for e in range(N)])
+    rng.shuffle(pairs)
+    offsets = np.arange(L)
+    # 片段开头的隐状态是零而不是真实状态，前 burn_in 步只用来热身 GRU、不计损失（episode 首帧除外）
+    warm = torch.as_tensor(offsets >= min(args.burn_in, L - 1), device=device).unsqueeze(1)
+    totals = np.zeros(3)
+    batches = 0
+    for i in range(0, len(pairs), args.batch_size):
+        s, e = pairs[i:i + args.batch_size].T
+        idx = s[None, :] + offsets[:, None]
+        obs = restore_obs(torch.as_tensor(data["obs"][idx, e[None, :]], device=device), float_obs)
+        resets = torch.as_tensor(data["resets"][idx, e[None, :]], device=device)
+        # 片段内出现过 episode 首帧之后，零隐状态就是真实状态，这些步不需要热身
+        mask = warm | (resets.cumsum(0) > 0)
+        resets[0] = True
+        teacher_logits = torch.as_tensor(data["logits"][idx, e[None, :]], device=device)
+        teacher_values = torch.as_tensor(data["values"][idx, e[None, :]], device=device)
+
+        logits, values = unroll(student, obs, resets)
+        loss, kl, value_loss, agreement = distill_loss(logits, values, teacher_logits, teacher_values, mask,
+                                                       args.temperature, args.value_coef)
+        optimizer.zero_grad()
+        loss.backward()
+        torch.nn.utils.clip_grad_norm_(student.parameters(), args.max_grad_norm)
+        optimizer.step()
+        totals += (kl, value_loss, agreement)
+        batches += 1
+    return totals / max(1, batches)
+
+
+def run_episodes(env, runtime, episodes, seed):
+    rewards = []
+    for episode in range(episodes):
+        obs, _ = env.reset(seed=seed + episode)
+        runtime.reset()
+        runtime.seed(seed + episode)
+        total, done = 0.0, False
+        while not done:
+            obs, r, terminated, truncated, _ = env.step(runtime.act(obs))
+            total += float(r)
+            done = terminated or truncated
+        rewards.append(total)
+    return rewards
+
+
+def default_output(checkpoint, encoder_variant, rnn_size):
+    """放在实验目录下单独的 distilled/ 子目录，不混进 checkpoint_p0（SF 续训会按文件名挑 checkpoint）"""
+    checkpoint = Path(checkpoint).resolve()
+    return checkpoint.parent.parent / "distilled" / f"{checkpoint.stem}_student_{encoder_variant}_{rnn_size}.pth"
+
+
+def main(argv=None):
+    from src.evaluate import get_eval_config, add_eval_model_args
+    from src.envs.vec_env import VecDoomEnv
+    from src.envs.vizdoom_env import create_vizdoom_env
+
+    parser = argparse.ArgumentParser(description="Distill a trained policy into a small student from the encoder registry")
+    parser.add_argument("--checkpoint", type=str, required=True, help="Teacher checkpoint (.pth or .safetensors)")
+    parser.add_argument("--env", type=str, required=True, help="Env to collect teacher data on")
+    parser.add_argument("--student-encoder", choices=sorted(ENCODER_REGISTRY), default="depthwise")
+    parser.add_argument("--student-rnn-size", type=int, default=128)
+    parser.add_argument("--student-mlp", type=int, nargs="+", default=[128], help="Student decoder MLP layer sizes")
+    parser.add_argument("--rounds", type=int, default=2, help="Collection rounds; rounds after the first act with the student (DAgger)")
+    parser.add_argument("--steps", type=int, default=20000, help="Env steps collected per round (over all envs)")
+    parser.add_argument("--num-envs", type=int, default=8)
+    parser.add_argument("--epochs", type=int, default=4, help="Training epochs over all data after each round")
+    parser.add_argument("--seq-len", type=int, default=32, help="GRU unroll length")
+    parser.add_argument("--burn-in", type=int, default=8, help="Steps at the start of each sequence excluded from the loss")
+    parser.add_argument("--batch-size", type=int, default=32, help="Sequences per batch")
+    parser.add_argument("--lr", type=float, default=3e-4)
+    parser.add_argument("--temperature", type=float, default=1.0, help="Softmax temperature of the KL loss")
+    parser.add_argument("--value-coef", type=float, default=0.5, help="Weight of the value regression loss")
+    parser.add_argument("--max-grad-norm", type=float, default=4.0)
+    parser.add_argument("--eval-episodes", type=int, default=10, help="Episodes per policy for the final comparison (0 to skip)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--device", type=str, default="cpu", help="Training device (collection runs on the same device)")
+    parser.add_argument("--out", type=str, default=None, help="Output checkpoint (default: <exp>/distilled/...)")
+    add_eval_model_args(parser)
+    args = parser.parse_args(argv)
+
+    device = torch.device(args.device)
+    torch.manual_seed(args.seed)
+    rng = np.random.default_rng(args.seed)
+
+    print("📥 Loading teacher...")
+    ckpt = read_checkpoint(args.checkpoint)
+    cfg = apply_manifest(get_eval_config(args), ckpt.manifest)
+    env = VecDoomEnv(args.env, args.num_envs, cfg=cfg)
+    obs_space = gym.spaces.Dict({"obs": env.observation_space})
+    teacher = build_policy(ckpt, cfg, obs_space, env.action_space, device)
+    del ckpt
+
+    student, student_cfg = make_student(teacher, cfg, args.student_encoder, args.student_rnn_size,
+                                        args.student_mlp, device)
+    # eval 模式：观察归一化统计量保持 teacher 的值，不随蒸馏数据更新（模型里没有 dropout / BN）
+    student.eval()
+    optimizer = torch.optim.Adam(student.parameters(), lr=args.lr)
+    teacher_params = sum(p.numel() for p in teacher.parameters())
+    student_params = sum(p.numel() for p in student.parameters())
+    print(f"🎓 Teacher {teacher_params / 1e6:.2f}M params -> student {args.student_encoder} "
+          f"rnn {args.student_rnn_size} ({student_params / 1e6:.2f}M params)")
+
+    teacher_runtime = PolicyRuntime(teacher, num_envs=args.num_envs, device=device, seed=args.seed)
+    n = args.num_envs
+    T = max(1, args.steps // n)
+    float_obs = np.dtype(env.observation_space.dtype) != np.uint8
+    storage = allocate_storage(T, args.rounds * n, env.observation_space.shape, env.action_space.n)
+    print(f"📦 Rollout storage: {sum(v.nbytes for v in storage.values()) / 2 ** 30:.2f} GB "
+          f"({args.rounds} rounds x {T * n} steps, uint8 obs)")
+    kl = agreement = float("nan")
+    for round_idx in range(args.rounds):
+        actor = None if round_idx == 0 else PolicyRuntime(student, num_envs=args.num_envs, device=device,
+                                                          seed=args.seed + round_idx)
+        start = time.perf_counter()
+        data = columns(storage, round_idx * n, (round_idx + 1) * n)
+        episode_rewards = collect(env, teacher_runtime, actor, data)
+        who = "teacher" if actor is None else "student"
+        mean_reward = np.mean(episode_rewards) if episode_rewards else float("nan")
+        print(f"\n🎮 Round {round_idx}: {data['resets'].size} steps acted by {who} "
+              f"({time.perf_counter() - start:.1f}s, {len(episode_rewards)} episodes, mean reward {mean_reward:.2f})")
+
+        # 已收集的轮次：storage 的前 (round_idx + 1) * n 列，视图而不是拼接出来的副本
+        all_data = columns(storage, 0, (round_idx + 1) * n)
+        for epoch in range(args.epochs):
+            kl, value_loss, agreement = train_epoch(student, optimizer, all_data, args, device, rng, float_obs)
+            print(f"   epoch {epoch + 1}/{args.epochs}: KL {kl:.4f}, value MSE {value_loss:.4f}, "
+                  f"action agreement {agreement:.1%}")
+    env.close()
+
+    report = {"teacher": str(args.checkpoint), "rounds": args.rounds, "steps_per_round": args.steps,
+              "final_kl": kl, "final_action_agreement": agreement}
+    obs = all_data["obs"][0, 0]
+    if float_obs:
+        obs = obs.astype(np.float32) / 255.0
+    teacher_single = PolicyRuntime(teacher, device=device)
+    student_single = PolicyRuntime(student, device=device)
+    teacher_ms, _ = benchmark(lambda: teacher_single.act(obs), repeats=100, warmup=10)
+    student_ms, _ = benchmark(lambda: student_single.act(obs), repeats=100, warmup=10)
+    report["latency_ms_p50"] = {"teacher": teacher_ms, "student": student_ms}
+    print(f"\n⏱️  Latency/step: teacher {teacher_ms:.3f} ms, student {student_ms:.3f} ms "
+          f"(speedup x{teacher_ms / student_ms:.2f})")
+
+    if args.eval_episodes > 0:
+        eval_env = create_vizdoom_env(args.env, cfg=cfg)
+        for name, runtime in (("teacher", teacher_single), ("student", student_single)):
+            stats = summarize(run_episodes(eval_env, runtime, args.eval_episodes, args.seed))
+            report[f"{name}_reward"] = {k: stats[k] for k in ("mean", "ci_low", "ci_high")}
+            print(f"📊 {name:<8} reward {stats['mean']:8.2f}  95% CI [{stats['ci_low']:.2f}, {stats['ci_high']:.2f}]")
+        eval_env.close()
+
+    out = Path(args.out) if args.out else default_output(args.checkpoint, args.student_encoder, args.student_rnn_size)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    manifest = manifest_from_cfg(student_cfg, env=args.env, obs_shape=obs_space["obs"].shape)
+    torch.save({"model": student.state_dict(), MANIFEST_KEY: manifest, "distill": report}, str(out))
+    print(f"💾 Saved student: {out}")
+    print(f"   python src/evaluate.py --checkpoint {out} --env {args.env}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""
+env 侧逐步计时（--doom_env_timing），训练时不用挂 profiler 也能看到 env 的热点。
+
+计时的各段（单位纳秒，perf_counter_ns）：
+    make_action     引擎 DoomGame.make_action（含 frameskip）
+    screen_fetch    make_action 之后第一次 get_state（screen buffer 拷贝出来）
+    image           ImageCleaningWrapper.observation
+    game_vars       RewardShapingWrapper 读取游戏变量
+    reward_shaping  RewardShapingWrapper 求值奖励 spec（defer_shaping 时在 VecDoomEnv 里批量完成，不计入）
+    action_decode   CompositeActionWrapper 把离散动作展开成按键
+    step            最外层 step 的总耗时
+各段的计时是在构造时把对应方法替换成计时版本（不改 Wrapper 本身），关闭时没有任何额外开销。
+
+每个 env 一组直方图：按 2 的幂分段、每段再分 4 格（相对误差 < 25%），记录一次只是一次
+bit_length 和一次列表自增。episode 结束时把统计写进 info["episode_extra_stats"]，
+Sample Factory 会把它汇总到 TensorBoard（timing_<段>_mean_us / _p50_us / _p99_us / _share），然后清零。
+"""
+import time
+
+import gymnasium as gym
+
+from src.envs.wrappers import RewardShapingWrapper, ImageCleaningWrapper, CompositeActionWrapper
+
+SECTIONS = ("make_action", "screen_fetch", "image", "game_vars", "reward_shaping", "action_decode", "step")
+STATS_PREFIX = "timing_"
+
+# 每个 2 的幂区间再细分的格数（2 bit）
+SUB_BITS = 2
+SUB_BINS = 1 << SUB_BITS
+NUM_BINS = 64 * SUB_BINS
+
+
+def _bin_index(ns):
+    """ns -> 直方图下标：小于 SUB_BINS 的值各占一格，之后每个 [2^k, 2^(k+1)) 分成 SUB_BINS 格"""
+    if ns < SUB_BINS:
+        return ns
+    b = ns.bit_length()
+    return (b - SUB_BITS) * SUB_BINS + ((ns >> (b - SUB_BITS - 1)) & (SUB_BINS - 1))
+
+
+def _bin_bounds(idx):
+    """_bin_index 的逆：下标 -> [lower, upper)"""
+    if idx < SUB_BINS:
+        return idx, idx + 1
+    shift = idx // SUB_BINS - 1
+    sub = idx % SUB_BINS
+    return (SUB_BINS + sub) << shift, (SUB_BINS + sub + 1) << shift
+
+
+class StepHistogram:
+    """单段耗时的对数直方图"""
+    __slots__ = ("counts", "total_ns", "n")
+
+    def __init__(self):
+        self.counts = [0] * NUM_BINS
+        self.total_ns = 0
+        self.n = 0
+
+    def add(self, ns):
+        self.counts[_bin_index(ns)] += 1
+        self.total_ns += ns
+        self.n += 1
+
+    def percentile(self, q):
+        """分位数（纳秒），取所在格的中点"""
+        target = q * self.n
+        seen = 0
+        for idx, c in enumerate(self.counts):
+            seen += c
+            if c and seen >= target:
+                lower, upper = _bin_bounds(idx)
+                return 0.5 * (lower + upper)
+        return 0.0
+
+    def clear(self):
+        self.counts = [0] * NUM_BINS
+        self.total_ns = 0
+        self.n = 0
+
+
+class EnvTimers:
+    """一个 env 的全部计时段"""
+    def __init__(self, sections=SECTIONS):
+        self.hists = {name: StepHistogram() for name in sections}
+
+    def timed(self, section, fn):
+        """把 fn 包成计时版本，耗时记到 section"""
+        hist = self.hists[section]
+        clock = time.perf_counter_ns
+
+        def wrapper(*args, **kwargs):
+            start = clock()
+            result = fn(*args, **kwargs)
+            hist.add(clock() - start)
+            return result
+        return wrapper
+
+    def publish(self):
+        """汇总成 {timing_<段>_<统计>: float}（微秒），然后清零"""
+        stats = {}
+        step_total = self.hists["step"].total_ns if "step" in self.hists else 0
+        for name, hist in self.hists.items():
+            if hist.n == 0:
+                continue
+            key = STATS_PREFIX + name
+            stats[f"{key}_mean_us"] = hist.total_ns / hist.n / 1000.0
+            stats[f"{key}_p50_us"] = hist.percentile(0.5) / 1000.0
+            stats[f"{key}_p99_us"] = hist.percentile(0.99) / 1000.0
+            if step_total and name != "step":
+                stats[f"{key}_share"] = hist.total_ns / step_total
+            hist.clear()
+        return stats
+
+
+class TimedGame:
+    """
+    DoomGame 的代理：给 make_action 和紧随其后的第一次 get_state 计时，其余调用原样转发。
+    之后的 get_state（例如 RewardShapingWrapper 读变量）不算进 screen_fetch。
+    """
+    def __init__(self, game, timers):
+        self._game = game
+        self._action_hist = timers.hists["make_action"]
+        self._fetch_hist = timers.hists["screen_fetch"]
+        self._fetch_pending = False
+
+    def make_action(self, *args):
+        start = time.perf_counter_ns()
+        reward = self._game.make_action(*args)
+        self._action_hist.add(time.perf_counter_ns() - start)
+        self._fetch_pending = True
+        return reward
+
+    def get_state(self):
+        if not self._fetch_pending:
+            return self._game.get_state()
+        start = time.perf_counter_ns()
+        state = self._game.get_state()
+        self._fetch_hist.add(time.perf_counter_ns() - start)
+        self._fetch_pending = False
+        return state
+
+    def __getattr__(self, name):
+        return getattr(self._game, name)
+
+
+class EnvTimingWrapper(gym.Wrapper):
+    """
+    套在 create_vizdoom_env 的最外层：给内层的 Wrapper 装上计时，计整步耗时，
+    episode 结束时把统计发布到 info["episode_extra_stats"]。
+    DoomGame 在 Sample Factory 的 VizdoomEnv 里第一次 reset 时才创建，所以代理在 reset 之后再装。
+    """
+    def __init__(self, env, timers=None):
+        super().__init__(env)
+        self.timers = timers or EnvTimers()
+        self._instrument_wrappers()
+        self._timed_step = self.timers.timed("step", self.env.step)
+
+    def _instrument_wrappers(self):
+        timers = self.timers
+        layer = self.env
+        while isinstance(layer, gym.Wrapper):
+            if isinstance(layer, ImageCleaningWrapper):
+                layer.observation = timers.timed("image", layer.observation)
+            elif isinstance(layer, RewardShapingWrapper):
+                layer._read_game_variables = timers.timed("game_vars", layer._read_game_variables)
+                layer.program.step_scalar = timers.timed("reward_shaping", layer.program.step_scalar)
+            elif isinstance(layer, CompositeActionWrapper):
+                layer.action = timers.timed("action_decode", layer.action)
+            layer = layer.env
+
+    def _instrument_game(self):
+        base = self.env.unwrapped
+        game = getattr(base, 'game', None)
+        if game is not None and not isinstance(game, TimedGame):
+            base.game = TimedGame(game, self.timers)
+
+    def reset(self, **kwargs):
+        obs, info = self.env.reset(**kwargs)
+        self._instrument_game()
+        return obs, info
+
+    def step(self, action):
+        obs, reward, terminated, truncated, info = self._timed_step(action)
+        if terminated or truncated:
+            extra = info.get("episode_extra_stats", {})
+            extra.update(self.timers.publish())
+            info["episode_extra_stats"] = extra
+        return obs, reward, terminated, truncated, info
+
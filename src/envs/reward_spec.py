@@ -0,0 +1,312 @@
+"""
+声明式奖励塑形：把奖励规则写成 spec（dict / YAML / JSON），编译成 numpy 表达式。
+
+spec 结构：
+    variables:    需要跟踪的游戏变量（列顺序）
+    actions:      离散动作名，下标即动作索引
+    coefficients: 具名系数，表达式里直接引用；扫参时用 overrides 覆盖（可以是每个 env 一个值的数组）
+    aliases:      派生量，按顺序求值，后面的表达式可以引用前面的
+    terms:        奖励项列表，每项 {name, value, when?, coef?}，贡献 = coef * value * when
+    info:         写进 info 的日志量 {key: 表达式}
+
+表达式里可用的名字：
+    <VAR> / d_<VAR>      当前值 / 与上一步的差
+    act_<name>           当前动作的 one-hot
+    prev_<name>          上一步动作的 one-hot
+    以及 coefficients 和 aliases 中定义的名字
+
+同一份编译结果既能按标量逐步求值（单环境 Wrapper），也能对 (B, V) 批量数组一次求值（向量化环境）。
+"""
+import ast
+import json
+import operator
+
+import numpy as np
+
+# 与原先 RewardShapingWrapper 中手写分支完全等价的默认规则
+DEFAULT_REWARD_SPEC = {
+    "variables": ["HITCOUNT", "KILLCOUNT", "HEALTH", "AMMO2"],
+    "actions": ["left", "right", "fire", "left_fire", "right_fire"],
+    "coefficients": {
+        "alive_bonus": 0.01,
+        "kill_bonus": 15.0,
+        "hit_bonus": 2.0,
+        "shot_hit_bonus": 0.5,
+        "empty_shot_penalty": 0.5,
+        "damage_coef": 0.2,
+        "pain_turn_bonus": 0.5,
+        "pain_idle_penalty": 1.0,
+        "patrol_turn_bonus": 0.05,
+        "idle_penalty": 0.01,
+        "jitter_penalty": 0.5,
+    },
+    "aliases": {
+        "ammo_used": "-d_AMMO2",
+        "turning": "act_left + act_right + act_left_fire + act_right_fire",
+        "hurt_unseen": "d_HEALTH < 0 and d_HITCOUNT == 0",
+    },
+    "terms": [
+        # A. 基础生存 (活着就好)
+        {"name": "alive", "value": "alive_bonus"},
+        # B. 击杀 (最高优先级)
+        {"name": "kill", "when": "d_KILLCOUNT > 0", "value": "kill_bonus * d_KILLCOUNT"},
+        # C. 命中 (过程奖励)
+        {"name": "hit", "when": "d_HITCOUNT > 0", "value": "hit_bonus * d_HITCOUNT"},
+        # D. 空枪惩罚 (防止乱射)，命中抵消消耗
+        {"name": "shot_hit", "when": "ammo_used > 0 and d_HITCOUNT > 0", "value": "shot_hit_bonus"},
+        {"name": "empty_shot", "when": "ammo_used > 0 and d_HITCOUNT <= 0", "value": "-empty_shot_penalty"},
+        # E. 掉血惩罚 (生存压力)
+        {"name": "damage", "when": "d_HEALTH < 0", "value": "damage_coef * d_HEALTH"},
+        # F. 危机反应 (Pain Reflex)：背后挨打时鼓励转身
+        {"name": "pain_turn", "when": "hurt_unseen and turning > 0", "value": "pain_turn_bonus"},
+        {"name": "pain_idle", "when": "hurt_unseen and turning == 0", "value": "-pain_idle_penalty"},
+        # G. 巡逻奖励 (Patrol Incentive)：没开枪时鼓励转头索敌
+        {"name": "patrol_turn", "when": "ammo_used == 0 and act_left + act_right > 0", "value": "patrol_turn_bonus"},
+        {"name": "idle", "when": "ammo_used == 0 and act_left + act_right == 0", "value": "-idle_penalty"},
+        # H. 动作稳定性惩罚 (Anti-Jitter)：左右来回抖动
+        {
+            "name": "jitter",
+            "when": "(prev_left > 0 and act_right > 0) or (prev_right > 0 and act_left > 0)",
+            "value": "-jitter_penalty",
+        },
+    ],
+    "info": {
+        "HIT_INC": "d_HITCOUNT",
+        "KILL_INC": "d_KILLCOUNT",
+        "AMMO_USED": "ammo_used",
+        "HEALTH_DIFF": "d_HEALTH",
+    },
+}
+
+_BIN_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Pow: operator.pow,
+}
+_CMP_OPS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+_FUNCS = {
+    "abs": np.abs,
+    "minimum": np.minimum,
+    "maximum": np.maximum,
+    "clip": np.clip,
+    "sign": np.sign,
+}
+# 标量版本：单环境逐步求值时避免 numpy 对 Python 标量的调度开销
+_SCALAR_FUNCS = {
+    "abs": abs,
+    "minimum": min,
+    "maximum": max,
+    "clip": lambda x, lo, hi: min(max(x, lo), hi),
+    "sign": lambda x: (x > 0) - (x < 0),
+}
+
+
+def _compile_node(node, known, expr, scalar):
+    """
+    把 AST 节点编译成闭包 fn(ns)。
+    scalar=False 时 ns 中的值是 numpy 数组，布尔运算用 np.logical_*；
+    scalar=True 时 ns 中是 Python 标量，直接用 Python 运算符。
+    """
+    def sub(n):
+        return _compile_node(n, known, expr, scalar)
+
+    if isinstance(node, ast.Expression):
+        return sub(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, bool)):
+        value = node.value
+        return lambda ns: value
+    if isinstance(node, ast.Name):
+        name = node.id
+        if name not in known:
+            raise ValueError(f"Unknown name '{name}' in reward expression: {expr}")
+        return lambda ns: ns[name]
+    if isinstance(node, ast.UnaryOp):
+        operand = sub(node.operand)
+        if isinstance(node.op, ast.USub):
+            return lambda ns: -operand(ns)
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        if isinstance(node.op, ast.Not):
+            if scalar:
+                return lambda ns: not operand(ns)
+            return lambda ns: np.logical_not(operand(ns))
+    if isinstance(node, ast.BinOp) and type(node.op) in _BIN_OPS:
+        op = _BIN_OPS[type(node.op)]
+        left = sub(node.left)
+        right = sub(node.right)
+        return lambda ns: op(left(ns), right(ns))
+    if isinstance(node, ast.BoolOp):
+        parts = [sub(v) for v in node.values]
+        is_and = isinstance(node.op, ast.And)
+        if scalar:
+            if len(parts) == 2:
+                first, second = parts
+                if is_and:
+                    return lambda ns: first(ns) and second(ns)
+                return lambda ns: first(ns) or second(ns)
+            if is_and:
+                return lambda ns: all(part(ns) for part in parts)
+            return lambda ns: any(part(ns) for part in parts)
+        combine = np.logical_and if is_and else np.logical_or
+
+        def bool_op(ns):
+            out = parts[0](ns)
+            for part in parts[1:]:
+                out = combine(out, part(ns))
+            return out
+        return bool_op
+    if isinstance(node, ast.Compare) and all(type(op) in _CMP_OPS for op in node.ops):
+        operands = [sub(node.left)] + [sub(c) for c in node.comparators]
+        ops = [_CMP_OPS[type(op)] for op in node.ops]
+        if len(ops) == 1:
+            op, left, right = ops[0], operands[0], operands[1]
+            return lambda ns: op(left(ns), right(ns))
+        combine = operator.and_ if scalar else np.logical_and
+
+        def compare(ns):
+            values = [fn(ns) for fn in operands]
+            out = ops[0](values[0], values[1])
+            for i in range(1, len(ops)):
+                out = combine(out, ops[i](values[i], values[i + 1]))
+            return out
+        return compare
+    if isinstance(node, ast.IfExp):
+        test = sub(node.test)
+        body = sub(node.body)
+        orelse = sub(node.orelse)
+        if scalar:
+            return lambda ns: body(ns) if test(ns) else orelse(ns)
+        return lambda ns: np.where(test(ns), body(ns), orelse(ns))
+    funcs = _SCALAR_FUNCS if scalar else _FUNCS
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in funcs and not node.keywords:
+        func = funcs[node.func.id]
+        args = [sub(a) for a in node.args]
+        return lambda ns: func(*[a(ns) for a in args])
+    raise ValueError(f"Unsupported syntax '{ast.dump(node)}' in reward expression: {expr}")
+
+
+def _compile_expr(expr, known):
+    """返回 (向量版, 标量版) 两个闭包"""
+    if isinstance(expr, (int, float)):
+        value = float(expr)
+        return (lambda ns: value), (lambda ns: value)
+    tree = ast.parse(str(expr), mode='eval')
+    return _compile_node(tree, known, expr, scalar=False), _compile_node(tree, known, expr, scalar=True)
+
+
+def load_reward_spec(path):
+    """从 YAML / JSON 文件读取 spec"""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    if str(path).endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError as e:
+            raise ImportError("Reading a YAML reward spec requires PyYAML: pip install pyyaml") from e
+        return yaml.safe_load(text)
+    return json.loads(text)
+
+
+class RewardProgram:
+    """编译后的奖励 spec"""
+    def __init__(self, spec, overrides=None):
+        self.spec = spec
+        self.variables = list(spec["variables"])
+        self.actions = list(spec["actions"])
+        self.coefficients = dict(spec.get("coefficients", {}))
+        unknown = set(overrides or {}) - set(self.coefficients)
+        if unknown:
+            raise ValueError(f"Unknown reward coefficients: {sorted(unknown)}")
+        self.coefficients.update(overrides or {})
+
+        known = set(self.coefficients)
+        known.update(self.variables)
+        known.update('d_' + v for v in self.variables)
+        known.update('act_' + a for a in self.actions)
+        known.update('prev_' + a for a in self.actions)
+
+        # 每个条目都编译成 (向量版, 标量版)，下标 0 / 1 对应 scalar=False / True
+        self._aliases = []
+        for name, expr in spec.get("aliases", {}).items():
+            self._aliases.append((name, _compile_expr(expr, known)))
+            known.add(name)
+
+        self.term_names = []
+        self._terms = []
+        for term in spec["terms"]:
+            value = _compile_expr(term["value"], known)
+            when = _compile_expr(term["when"], known) if "when" in term else None
+            coef = float(term.get("coef", 1.0))
+            self.term_names.append(term["name"])
+            self._terms.append((value, when, coef))
+
+        self._info = [(key, _compile_expr(expr, known)) for key, expr in spec.get("info", {}).items()]
+        self._one_hot = np.eye(len(self.actions), dtype=np.float32)
+
+    def _finish(self, ns, return_terms, scalar):
+        k = int(scalar)
+        for name, fns in self._aliases:
+            ns[name] = fns[k](ns)
+        total = 0.0
+        contributions = {}
+        for name, (value, when, coef) in zip(self.term_names, self._terms):
+            if scalar and when is not None and not when[1](ns):
+                contrib = 0.0
+            else:
+                contrib = value[k](ns)
+                if when is not None and not scalar:
+                    contrib = contrib * when[0](ns)
+            if coef != 1.0:
+                contrib = contrib * coef
+            total = total + contrib
+            if return_terms:
+                contributions[name] = contrib
+        info = {key: fns[k](ns) for key, fns in self._info}
+        if return_terms:
+            return total, info, contributions
+        return total, info
+
+    def step_scalar(self, curr, prev, action, prev_action, return_terms=False):
+        """单环境：curr/prev 为按 variables 排列的 float 序列，action 为动作索引"""
+        ns = dict(self.coefficients)
+        for name, c, p in zip(self.variables, curr, prev):
+            ns[name] = c
+            ns['d_' + name] = c - p
+        for k, name in enumerate(self.actions):
+            ns['act_' + name] = 1.0 if action == k else 0.0
+            ns['prev_' + name] = 1.0 if prev_action == k else 0.0
+        return self._finish(ns, return_terms, scalar=True)
+
+    def __call__(self, curr, prev, action, prev_action, return_terms=False):
+        """批量：curr/prev 形状 (B, V)，action/prev_action 形状 (B,)，返回 (B,) 的塑形奖励"""
+        delta = curr - prev
+        ns = dict(self.coefficients)
+        for j, name in enumerate(self.variables):
+            ns[name] = curr[:, j]
+            ns['d_' + name] = delta[:, j]
+        act = self._one_hot[action]
+        prev_act = self._one_hot[prev_action]
+        for k, name in enumerate(self.actions):
+            ns['act_' + name] = act[:, k]
+            ns['prev_' + name] = prev_act[:, k]
+        result = self._finish(ns, return_terms, scalar=False)
+        total = np.broadcast_to(np.asarray(result[0], dtype=np.float32), (curr.shape[0],))
+        return (total,) + result[1:]
+
+
+def compile_reward_spec(spec=None, overrides=None):
+    """spec 可以是 dict、文件路径或 None（默认规则）"""
+    if spec is None:
+        spec = DEFAULT_REWARD_SPEC
+    elif isinstance(spec, str):
+        spec = load_reward_spec(spec)
+    return RewardProgram(spec, overrides)
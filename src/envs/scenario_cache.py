@@ -0,0 +1,193 @@
+"""
+场景缓存：对 (原始 cfg, WAD, 补丁规则) 做内容哈希，每个版本只构建一次。
+
+以前每次 create_vizdoom_env 都会重新读 cfg、跑正则、拷贝 WAD 并覆盖写
+src/_vizdoom/<scenario>.cfg；Sample Factory 同时拉起几十个 worker 时这些写操作会互相踩踏。
+现在补丁结果写进 src/_vizdoom/cache/<stem>-<hash>/ 目录：
+先在临时目录里构建，再用原子 rename 发布，已存在的版本直接复用。
+
+预热（例如 Docker 构建阶段）：
+    python -m src.envs.scenario_cache            # 预热全部场景
+    python -m src.envs.scenario_cache basic.cfg  # 只预热指定场景
+"""
+import argparse
+import hashlib
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+import vizdoom as vzd
+
+# 自定义环境名 -> 场景 cfg
+SCENARIO_FILES = {
+    "custom_doom_basic": "basic.cfg",
+    "custom_doom_defend_the_center": "defend_the_center.cfg",
+    "custom_doom_deadly_corridor": "deadly_corridor.cfg",
+    "custom_doom_health_gathering": "health_gathering_supreme.cfg",
+}
+
+# 补丁规则。修改规则时请同时修改 PATCH_RULES_VERSION，旧缓存会因哈希变化自动失效
+PATCH_RULES_VERSION = 1
+REQUIRED_GAME_VARIABLES = ('KILLCOUNT', 'HITCOUNT', 'AMMO2', 'HEALTH', 'FRAGCOUNT')
+DEFAULT_TURN_SPEED = 300
+
+LOCAL_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '_vizdoom'))
+CACHE_DIR = os.path.join(LOCAL_DIR, 'cache')
+
+# 进程内记忆：同一进程重复创建环境时连文件都不用再读
+_built = {}
+
+
+def _locate_sources(scenario_name):
+    """返回 (cfg 路径, WAD 路径)，cfg 找不到时返回 (None, WAD 路径)"""
+    wad_name = scenario_name.replace('.cfg', '.wad')
+    # 1. 检查本地 _vizdoom  2. 检查系统库路径
+    local_wad_path = os.path.join(LOCAL_DIR, wad_name)
+    sys_wad_path = os.path.join(vzd.scenarios_path, wad_name)
+    if os.path.exists(local_wad_path):
+        wad_path = local_wad_path
+    elif os.path.exists(sys_wad_path):
+        wad_path = sys_wad_path
+    else:
+        # 两个地方都没有，报错并提示
+        raise FileNotFoundError(
+            f"\n\n🛑 CRITICAL ERROR: WAD file '{wad_name}' not found!\n"
+            f"Checked locations:\n  1. {local_wad_path}\n  2. {sys_wad_path}\n\n"
+            f"👉 FIX: Run this command in container:\n"
+            f"   cp /usr/local/lib/python3.10/site-packages/vizdoom/scenarios/{wad_name} src/_vizdoom/\n"
+        )
+
+    # 优先读系统自带的原始 CFG，其次本地
+    cfg_path = os.path.join(vzd.scenarios_path, scenario_name)
+    if not os.path.exists(cfg_path):
+        cfg_path = os.path.join(LOCAL_DIR, scenario_name)
+        if not os.path.exists(cfg_path):
+            cfg_path = None
+    return cfg_path, wad_path
+
+
+def _rules_signature(extra_options):
+    """补丁规则的规范化描述，参与内容哈希"""
+    parts = [
+        f"version={PATCH_RULES_VERSION}",
+        f"vars={' '.join(REQUIRED_GAME_VARIABLES)}",
+        f"turn_speed={DEFAULT_TURN_SPEED}",
+    ]
+    for key in sorted(extra_options):
+        parts.append(f"{key}={extra_options[key]}")
+    return '\n'.join(parts).encode('utf-8')
+
+
+def patch_cfg_content(content, wad_name, extra_options=None):
+    """对 cfg 文本应用补丁规则（纯函数，不碰文件系统）"""
+    # WAD 与 CFG 放在同一目录，直接写文件名以避免引擎把绝对路径当相对路径拼接
+    content = re.sub(r'doom_scenario_path\s*=\s*.*', f'doom_scenario_path = {wad_name}', content)
+
+    # 确保变量存在：如果已有 available_game_variables，保证包含 HITCOUNT 等
+    m = re.search(r'available_game_variables\s*=\s*\{([^}]*)\}', content)
+    if m:
+        vars_set = set(v.strip() for v in m.group(1).split())
+        needed = set(REQUIRED_GAME_VARIABLES)
+        if not needed.issubset(vars_set):
+            merged = ' '.join(sorted(vars_set.union(needed)))
+            content = re.sub(r'available_game_variables\s*=\s*\{[^}]*\}', f'available_game_variables = {{ {merged} }}', content)
+    else:
+        content += f"\navailable_game_variables = {{ {' '.join(REQUIRED_GAME_VARIABLES)} }}\n"
+
+    # 物理外挂：加快转身速度，方便 AI 快速索敌
+    if 'player_turn_speed' not in content:
+        content += f'\nplayer_turn_speed = {DEFAULT_TURN_SPEED}\n'
+
+    # 额外的键值覆盖（已有则替换，没有则追加）
+    for key, value in (extra_options or {}).items():
+        pattern = rf'^\s*{re.escape(key)}\s*=.*$'
+        if re.search(pattern, content, flags=re.MULTILINE):
+            content = re.sub(pattern, f'{key} = {value}', content, flags=re.MULTILINE)
+        else:
+            content += f'\n{key} = {value}\n'
+    return content
+
+
+def _content_hash(cfg_bytes, wad_bytes, extra_options):
+    h = hashlib.sha1()
+    for chunk in (_rules_signature(extra_options), cfg_bytes, wad_bytes):
+        h.update(len(chunk).to_bytes(8, 'little'))
+        h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def read_game_variables(cfg_path):
+    """按 cfg 中的顺序返回 available_game_variables，文件不存在时返回 None"""
+    if not os.path.exists(cfg_path):
+        return None
+    with open(cfg_path, 'r', encoding='utf-8') as f:
+        m = re.search(r'available_game_variables\s*=\s*\{([^}]*)\}', f.read())
+    return m.group(1).split() if m else []
+
+
+def build_scenario(scenario_name, extra_options=None):
+    """
+    返回打过补丁的 cfg 路径。相同内容只构建一次，可被任意多个进程并发调用。
+
+    extra_options: 额外写入 cfg 的键值（例如 render_hud=false），会参与缓存哈希。
+    """
+    extra_options = dict(extra_options or {})
+    memo_key = (scenario_name, tuple(sorted(extra_options.items())))
+    if memo_key in _built:
+        return _built[memo_key]
+
+    cfg_path, wad_path = _locate_sources(scenario_name)
+    if cfg_path is None:
+        return scenario_name  # 放弃治疗，直接返回名字
+
+    with open(cfg_path, 'rb') as f:
+        cfg_bytes = f.read()
+    with open(wad_path, 'rb') as f:
+        wad_bytes = f.read()
+
+    stem = os.path.splitext(scenario_name)[0]
+    wad_name = stem + '.wad'
+    entry_dir = os.path.join(CACHE_DIR, f"{stem}-{_content_hash(cfg_bytes, wad_bytes, extra_options)}")
+    entry_cfg = os.path.join(entry_dir, scenario_name)
+
+    if not os.path.exists(entry_cfg):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=f".{stem}-", dir=CACHE_DIR)
+        try:
+            content = patch_cfg_content(cfg_bytes.decode('utf-8'), wad_name, extra_options)
+            with open(os.path.join(tmp_dir, scenario_name), 'w', encoding='utf-8') as f:
+                f.write(content)
+            with open(os.path.join(tmp_dir, wad_name), 'wb') as f:
+                f.write(wad_bytes)
+            # 原子发布：别的 worker 抢先发布时 rename 会失败，直接用对方的结果
+            os.rename(tmp_dir, entry_dir)
+            print(f"[Info] Built scenario cache: {entry_dir}")
+        except OSError:
+            if not os.path.exists(entry_cfg):
+                raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    _built[memo_key] = entry_cfg
+    return entry_cfg
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-build the patched ViZDoom scenario cache")
+    parser.add_argument("scenarios", nargs="*", help="Scenario cfg names (default: all custom scenarios)")
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for scenario_name in args.scenarios or sorted(set(SCENARIO_FILES.values())):
+        try:
+            print(f"✅ {scenario_name} -> {build_scenario(scenario_name)}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {scenario_name}: {e}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
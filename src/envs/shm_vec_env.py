@@ -0,0 +1,203 @@
+"""
+多进程向量化环境：观察通过 multiprocessing.shared_memory 环形缓冲区传递。
+
+每个 worker 进程持有一个 create_vizdoom_env 实例，把帧直接写进共享的
+(slots, K, C, H, W) 环形缓冲区，管道里只传槽位号、奖励和 info，
+观察本身不再被 pickle，父进程内存也不会随 worker 数增长。
+
+worker 的每条回复都是 ('ok', 数据) 或 ('error', traceback)，worker 里的异常会在父进程里以
+WorkerError 重新抛出（带上 worker 的 traceback），不再只表现为 EOFError。
+
+注意：共享内存位于 /dev/shm，容器里请保证 --shm-size 足够大。
+"""
+import multiprocessing as mp
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def _attach_shm(name):
+    shm = shared_memory.SharedMemory(name=name)
+    # worker 只是借用父进程创建的共享内存，交给父进程负责 unlink，
+    # 避免 resource_tracker 在 worker 退出时误删或刷警告
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+    return shm
+
+
+class WorkerError(RuntimeError):
+    """env worker 进程内的异常（消息里带 worker 的 traceback）"""
+
+
+def _worker_loop(index, pipe, env_name, cfg, env_kwargs):
+    # 在子进程里才导入，spawn 模式下避免父进程的引擎对象被复制
+    from src.envs.vizdoom_env import create_vizdoom_env
+    from src.envs.vec_env import step_with_autoreset
+
+    shm = None
+    env = None
+    try:
+        env = create_vizdoom_env(env_name, cfg=cfg, **env_kwargs)
+        pipe.send(('ok', (env.observation_space, env.action_space)))
+
+        cmd, payload = pipe.recv()
+        assert cmd == 'attach', cmd
+        shm_name, ring_shape, dtype = payload
+        shm = _attach_shm(shm_name)
+        ring = np.ndarray(ring_shape, dtype=dtype, buffer=shm.buf)
+
+        while True:
+            cmd, payload = pipe.recv()
+            if cmd == 'step':
+                slot, action = payload
+                obs, reward, terminated, truncated, info = step_with_autoreset(env, action)
+                ring[slot, index] = obs
+                pipe.send(('ok', (reward, terminated, truncated, info)))
+            elif cmd == 'reset':
+                slot, seed = payload
+                obs, info = env.reset(seed=seed)
+                ring[slot, index] = obs
+                pipe.send(('ok', info))
+            elif cmd == 'render':
+                pipe.send(('ok', env.render()))
+            elif cmd == 'close':
+                break
+            else:
+                raise ValueError(f"Unknown command: {cmd}")
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        try:
+            pipe.send(('error', traceback.format_exc()))
+        except (BrokenPipeError, EOFError, OSError):
+            pass
+    finally:
+        if env is not None:
+            env.close()
+        if shm is not None:
+            shm.close()
+        pipe.close()
+
+
+class ShmVecDoomEnv:
+    """
+    与 VecDoomEnv 接口一致的多进程版本。
+
+    step/reset 返回的观察默认是环形缓冲区某个槽位的零拷贝视图 (K, C, H, W)，
+    在之后 slots - 1 次 step 内保持有效；需要长期持有时请自行 copy，
+    或构造时传 copy_obs=True。
+    """
+    def __init__(self, env_name, num_envs, cfg=None, slots=4, copy_obs=False, start_method='spawn', **env_kwargs):
+        assert slots >= 2, "slots must be >= 2 so the returned view survives the next step"
+        self.num_envs = num_envs
+        self.slots = slots
+        self.copy_obs = copy_obs
+        self._slot = 0
+
+        ctx = mp.get_context(start_method)
+        self.pipes = []
+        self.procs = []
+        for i in range(num_envs):
+            parent_end, child_end = ctx.Pipe()
+            proc = ctx.Process(target=_worker_loop, args=(i, child_end, env_name, cfg, env_kwargs), daemon=True)
+            proc.start()
+            child_end.close()
+            self.pipes.append(parent_end)
+            self.procs.append(proc)
+
+        self._closed = False
+        self._shm = None
+        self._ring = None
+        try:
+            spaces = [self._recv(i) for i in range(num_envs)]
+        except WorkerError:
+            self.close()
+            raise
+        self.observation_space, self.action_space = spaces[0]
+
+        obs_space = self.observation_space
+        ring_shape = (slots, num_envs) + tuple(obs_space.shape)
+        dtype = np.dtype(obs_space.dtype)
+        nbytes = int(np.prod(ring_shape)) * dtype.itemsize
+        self._shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        self._ring = np.ndarray(ring_shape, dtype=dtype, buffer=self._shm.buf)
+        for pipe in self.pipes:
+            pipe.send(('attach', (self._shm.name, ring_shape, dtype.str)))
+
+        self._rewards = np.zeros(num_envs, dtype=np.float32)
+        self._terminated = np.zeros(num_envs, dtype=bool)
+        self._truncated = np.zeros(num_envs, dtype=bool)
+
+    def _recv(self, index):
+        """读取 worker index 的回复；worker 报错或已退出时抛出 WorkerError"""
+        try:
+            status, payload = self.pipes[index].recv()
+        except EOFError:
+            raise WorkerError(f"env worker {index} exited unexpectedly "
+                              f"(exit code {self.procs[index].exitcode})") from None
+        if status == 'error':
+            raise WorkerError(f"env worker {index} failed:\n{payload}")
+        return payload
+
+    def _next_slot(self):
+        self._slot = (self._slot + 1) % self.slots
+        return self._slot
+
+    def _frames(self, slot):
+        obs = self._ring[slot]
+        return obs.copy() if self.copy_obs else obs
+
+    def reset(self, seed=None):
+        slot = self._next_slot()
+        for i, pipe in enumerate(self.pipes):
+            pipe.send(('reset', (slot, None if seed is None else seed + i)))
+        infos = [self._recv(i) for i in range(self.num_envs)]
+        return self._frames(slot), infos
+
+    def step(self, actions):
+        slot = self._next_slot()
+        for pipe, action in zip(self.pipes, actions):
+            pipe.send(('step', (slot, action)))
+        infos = []
+        for i in range(self.num_envs):
+            reward, terminated, truncated, info = self._recv(i)
+            self._rewards[i] = reward
+            self._terminated[i] = terminated
+            self._truncated[i] = truncated
+            infos.append(info)
+        return self._frames(slot), self._rewards.copy(), self._terminated.copy(), self._truncated.copy(), infos
+
+    def render(self, index=0):
+        self.pipes[index].send(('render', None))
+        return self._recv(index)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for pipe in self.pipes:
+            try:
+                pipe.send(('close', None))
+            except (BrokenPipeError, EOFError, OSError):
+                pass
+        for proc in self.procs:
+            proc.join(timeout=10)
+            if proc.is_alive():
+                proc.terminate()
+        if self._shm is None:
+            return
+        # 先 unlink：调用方若还持有 step/reset 返回的零拷贝视图，close 会抛 BufferError，
+        # 此时映射留到视图被回收为止，但 /dev/shm 里的段已经删除，不会泄漏
+        self._ring = None
+        self._shm.unlink()
+        try:
+            self._shm.close()
+        except BufferError:
+            pass
+
+    def __len__(self):
+        return self.num_envs
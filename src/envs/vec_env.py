@@ -0,0 +1,130 @@
+"""
+线程池向量化环境：一个进程里持有 K 个 create_vizdoom_env 实例，批量 step/reset。
+
+ViZDoom 引擎的主要工作在原生代码里完成（会释放 GIL），
+所以用线程就能把多核用起来，不需要跨进程搬运观察。
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.envs.reward_spec import compile_reward_spec
+from src.envs.vizdoom_env import create_vizdoom_env
+
+
+def step_with_autoreset(env, action):
+    """
+    step 一次，episode 结束时立即 reset；最后一帧和结束时的 info 分别放进 info["final_observation"] / info["final_info"]。
+    最后一帧先拷贝一份：FrameStackWrapper 等返回的是内部缓冲区的视图，reset 会把它覆盖成新 episode 的首帧。
+    """
+    obs, reward, terminated, truncated, info = env.step(action)
+    if terminated or truncated:
+        final_observation = np.array(obs, copy=True)
+        final_info = dict(info)
+        obs, info = env.reset()
+        info = dict(info)
+        info["final_observation"] = final_observation
+        info["final_info"] = final_info
+    return obs, reward, terminated, truncated, info
+
+
+class VecDoomEnv:
+    """
+    K 个环境同步步进，返回堆叠后的 (K, C, H, W) 观察、奖励/结束数组和 info 列表。
+
+    episode 结束的环境会在同一次 step 内自动 reset：返回的是新 episode 的首帧，
+    结束时的最后一帧放在 info["final_observation"]，结束时的 info 放在 info["final_info"]。
+
+    batched_shaping=True 时各环境只采集塑形数据，奖励由编译后的 reward spec
+    对整批环境一次性求值；reward_overrides 中的系数可以是长度为 K 的数组（每个环境一组系数）。
+    """
+    def __init__(self, env_name, num_envs, cfg=None, num_threads=None, env_fns=None,
+                 batched_shaping=False, reward_spec=None, reward_overrides=None, **env_kwargs):
+        self.program = None
+        if batched_shaping:
+            assert env_fns is None, "batched_shaping needs to build the envs itself"
+            self.program = compile_reward_spec(reward_spec, reward_overrides)
+            env_kwargs.update(defer_shaping=True, reward_spec=self.program.spec)
+        if env_fns is None:
+            env_fns = [lambda: create_vizdoom_env(env_name, cfg=cfg, **env_kwargs) for _ in range(num_envs)]
+        self.num_envs = len(env_fns)
+        self.pool = ThreadPoolExecutor(max_workers=num_threads or self.num_envs)
+        # 环境的创建（加载引擎）也放到线程池里并行做
+        self.envs = list(self.pool.map(lambda fn: fn(), env_fns))
+
+        self.observation_space = self.envs[0].observation_space
+        self.action_space = self.envs[0].action_space
+
+        # 预分配批量缓冲区，每步只写不分配
+        obs_space = self.observation_space
+        self._obs = np.zeros((self.num_envs,) + obs_space.shape, dtype=obs_space.dtype)
+        self._rewards = np.zeros(self.num_envs, dtype=np.float32)
+        self._terminated = np.zeros(self.num_envs, dtype=bool)
+        self._truncated = np.zeros(self.num_envs, dtype=bool)
+        self._infos = [{} for _ in range(self.num_envs)]
+        if self.program is not None:
+            num_vars = len(self.program.variables)
+            self._shape_curr = np.zeros((self.num_envs, num_vars), dtype=np.float64)
+            self._shape_prev = np.zeros((self.num_envs, num_vars), dtype=np.float64)
+            self._action_idx = np.zeros(self.num_envs, dtype=np.int64)
+            self._prev_action_idx = np.zeros(self.num_envs, dtype=np.int64)
+            self._step_infos = [None] * self.num_envs
+
+    def _reset_one(self, i, seed=None):
+        obs, info = self.envs[i].reset(seed=seed)
+        self._obs[i] = obs
+        self._infos[i] = info
+
+    def _step_one(self, i, action):
+        obs, reward, terminated, truncated, info = step_with_autoreset(self.envs[i], action)
+        if self.program is not None:
+            # 结束时塑形数据在 final_info 里（auto-reset 之后的 info 是新 episode 的）
+            step_info = info.get("final_info", info)
+            self._shape_curr[i] = step_info.pop('SHAPING_CURR')
+            self._shape_prev[i] = step_info.pop('SHAPING_PREV')
+            self._action_idx[i] = step_info.pop('ACTION_IDX')
+            self._prev_action_idx[i] = step_info.pop('PREV_ACTION_IDX')
+            self._step_infos[i] = step_info
+        self._obs[i] = obs
+        self._rewards[i] = reward
+        self._terminated[i] = terminated
+        self._truncated[i] = truncated
+        self._infos[i] = info
+
+    def _apply_batched_shaping(self):
+        shaped, log_info = self.program(self._shape_curr, self._shape_prev, self._action_idx, self._prev_action_idx)
+        self._rewards += shaped
+        for key, values in log_info.items():
+            values = np.broadcast_to(values, (self.num_envs,))
+            for i in range(self.num_envs):
+                self._step_infos[i][key] = float(values[i])
+
+    def reset(self, seed=None):
+        """重置全部环境。seed 为整数时第 i 个环境使用 seed + i"""
+        seeds = [None if seed is None else seed + i for i in range(self.num_envs)]
+        list(self.pool.map(self._reset_one, range(self.num_envs), seeds))
+        return self._obs.copy(), list(self._infos)
+
+    def step(self, actions):
+        actions = np.asarray(actions).reshape(self.num_envs, *np.shape(actions)[1:])
+        list(self.pool.map(self._step_one, range(self.num_envs), actions))
+        if self.program is not None:
+            self._apply_batched_shaping()
+        return (
+            self._obs.copy(),
+            self._rewards.copy(),
+            self._terminated.copy(),
+            self._truncated.copy(),
+            list(self._infos),
+        )
+
+    def render(self, index=0):
+        return self.envs[index].render()
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+        self.pool.shutdown(wait=True)
+
+    def __len__(self):
+        return self.num_envs
@@ -1,17 +1,88 @@
 import os
+import copy
 import vizdoom as vzd
 import gymnasium as gym
 import numpy as np
 from sample_factory.envs.env_utils import register_env
+from sample_factory.utils.utils import str2bool
 from sf_examples.vizdoom.doom.doom_utils import make_doom_env_from_spec, DoomSpec, DOOM_ENVS
 from sf_examples.vizdoom.doom.doom_gym import VizdoomEnv
-from src.envs.wrappers import RewardShapingWrapper, ImageCleaningWrapper, CompositeActionWrapper
+from src.envs.wrappers import RewardShapingWrapper, ImageCleaningWrapper, CompositeActionWrapper, FrameStackWrapper
+from src.envs.scenario_cache import SCENARIO_FILES, build_scenario, read_game_variables
+from src.envs.instrumentation import EnvTimingWrapper
 
 class AttrDict(dict):
     __getattr__ = dict.__getitem__
     __setattr__ = dict.__setitem__
 
 
+# 引擎原生渲染模式下可选的 4:3 分辨率（SetResolutionWrapper 支持的子集）
+NATIVE_RESOLUTIONS = ("160x120", "200x150", "256x192", "320x240")
+
+# create_vizdoom_env 由内到外套上的各层，stop_after 可以在某一层之后停下（基准测试用）
+ENV_LAYERS = ("sf", "image", "frame_stack", "reward", "action")
+
+
+def add_custom_doom_env_args(parser):
+    """custom_doom_* 环境特有的命令行参数"""
+    p = parser
+    p.add_argument(
+        "--doom_native_obs",
+        default=False,
+        type=str2bool,
+        help="Render directly at the target geometry (engine resolution, CRCGCB, HUD off) and skip the crop/resize",
+    )
+    p.add_argument(
+        "--doom_native_resolution",
+        default="160x120",
+        choices=NATIVE_RESOLUTIONS,
+        type=str,
+        help="Engine resolution used when --doom_native_obs is enabled",
+    )
+    p.add_argument("--doom_obs_grayscale", default=False, type=str2bool, help="Single-channel grayscale observations")
+    p.add_argument(
+        "--doom_obs_uint8",
+        default=False,
+        type=str2bool,
+        help="Keep observations uint8 end-to-end; the model scales them on-device",
+    )
+    p.add_argument(
+        "--doom_legacy_obs_scale",
+        default=False,
+        type=str2bool,
+        help="Scale uint8 obs like the old float [0,1] wrapper output (for checkpoints trained on float obs)",
+    )
+    p.add_argument(
+        "--doom_frame_stack",
+        default=1,
+        type=int,
+        help="Number of frames stacked by the ring-buffer FrameStackWrapper (1 = no stacking)",
+    )
+    p.add_argument(
+        "--doom_frame_stack_mode",
+        default="channels",
+        choices=("channels", "time"),
+        type=str,
+        help="Stack frames along channels (k*C, H, W) or a separate time axis (k, C, H, W)",
+    )
+    p.add_argument(
+        "--doom_reward_spec",
+        default=None,
+        type=str,
+        help="YAML/JSON reward shaping spec (see src/envs/reward_spec.py); default is the built-in spec",
+    )
+    p.add_argument(
+        "--doom_env_timing",
+        default=False,
+        type=str2bool,
+        help="Time engine/wrapper sections per step and report them as episode_extra_stats (see src/envs/instrumentation.py)",
+    )
+
+
+def _cfg_get(cfg, key, default=None):
+    """兼容 argparse.Namespace 与 AttrDict 的取值（两者都支持 in）"""
+    return getattr(cfg, key) if key in cfg else default
+
 
 def get_spec_by_scenario(scenario_name):
     for spec in DOOM_ENVS:
@@ -19,7 +90,15 @@ def get_spec_by_scenario(scenario_name):
             return spec
     return None
 
-def create_vizdoom_env(env_name, cfg=None, env_config=None, render_mode=None, **kwargs):
+def create_vizdoom_env(env_name, cfg=None, env_config=None, render_mode=None,
+                       reward_spec=None, reward_overrides=None, defer_shaping=False, stop_after=None, **kwargs):
+    """
+    reward_spec / reward_overrides: 奖励塑形 spec 及系数覆盖（默认取 cfg.doom_reward_spec 或内置规则）
+    defer_shaping: 只采集塑形所需数据，由 VecDoomEnv 批量计算奖励
+    stop_after: ENV_LAYERS 之一，只构造到该层为止（None 为完整的环境）
+    """
+    if stop_after is not None and stop_after not in ENV_LAYERS:
+        raise ValueError(f"Unknown env layer: {stop_after} (expected one of {ENV_LAYERS})")
     if cfg is None:
         # 在创建任何 VizDoom 对象之前设置环境变量以抑制 PipeWire/OpenAL 的噪声
         # 这会让音频驱动使用空驱动，避免 pipewire 的配置加载错误
@@ -34,100 +113,29 @@ def create_vizdoom_env(env_name, cfg=None, env_config=None, render_mode=None, **
             res_h=120
         )
 
-    scenarios = {
-        "custom_doom_basic": "basic.cfg",
-        "custom_doom_defend_the_center": "defend_the_center.cfg",
-        "custom_doom_deadly_corridor": "deadly_corridor.cfg",
-        "custom_doom_health_gathering": "health_gathering_supreme.cfg",
-    }
-    
-    if env_name not in scenarios:
+    if env_name not in SCENARIO_FILES:
         raise ValueError(f"Unknown env name: {env_name}")
     
-    scenario_file = scenarios[env_name]
+    scenario_file = SCENARIO_FILES[env_name]
+
+    native_obs = _cfg_get(cfg, 'doom_native_obs', False)
+    grayscale = _cfg_get(cfg, 'doom_obs_grayscale', False)
+    obs_uint8 = _cfg_get(cfg, 'doom_obs_uint8', False)
 
     # --- 资源检查逻辑 ---
-    def _ensure_game_variables_in_cfg(scenario_name):
-        local_dir = os.path.join(os.path.dirname(__file__), '..', '_vizdoom')
-        local_dir = os.path.abspath(local_dir)
-        os.makedirs(local_dir, exist_ok=True)
-        local_cfg_path = os.path.join(local_dir, scenario_name)
-        
-        # 检查 WAD 是否存在
-        wad_name = scenario_name.replace('.cfg', '.wad')
-        # 1. 检查本地 _vizdoom
-        local_wad_path = os.path.join(local_dir, wad_name)
-        # 2. 检查系统库路径
-        sys_wad_path = os.path.join(vzd.scenarios_path, wad_name)
-        
-        final_wad_path = None
-        if os.path.exists(local_wad_path):
-            final_wad_path = local_wad_path
-        elif os.path.exists(sys_wad_path):
-            # 系统路径存在：尝试把 WAD 拷贝到本地目录，避免在 cfg 中写入绝对路径时被引擎错误拼接
-            try:
-                import shutil
-                shutil.copyfile(sys_wad_path, local_wad_path)
-                final_wad_path = local_wad_path
-                print(f"[Info] Copied WAD from {sys_wad_path} to {local_wad_path}")
-            except Exception as e:
-                # 如果拷贝失败，回退到使用系统路径（并在后续写入时加引号）
-                final_wad_path = sys_wad_path
-                print(f"[Warning] Failed to copy WAD: {e}. Falling back to system path {sys_wad_path}")
-        else:
-            # 两个地方都没有，报错并提示
-            raise FileNotFoundError(
-                f"\n\n🛑 CRITICAL ERROR: WAD file '{wad_name}' not found!\n"
-                f"Checked locations:\n  1. {local_wad_path}\n  2. {sys_wad_path}\n\n"
-                f"👉 FIX: Run this command in container:\n"
-                f"   cp /usr/local/lib/python3.10/site-packages/vizdoom/scenarios/{wad_name} src/_vizdoom/\n"
-            )
-
-        # 读取原始 CFG
-        orig_cfg_path = os.path.join(vzd.scenarios_path, scenario_name)
-        if not os.path.exists(orig_cfg_path):
-             # 尝试从本地读
-             if os.path.exists(local_cfg_path):
-                 with open(local_cfg_path, 'r') as f: content = f.read()
-             else:
-                 return scenario_name # 放弃治疗，直接返回名字
-        else:
-            with open(orig_cfg_path, 'r') as f: content = f.read()
-
-        # 暴力替换 WAD 路径为绝对路径或文件名（防止相对路径解析错误或重复拼接）
-        import re
-        # 如果 WAD 位于 local_dir，则只写入文件名（cfg 与 wad 同目录），避免引擎将 cfg 目录与绝对路径拼接导致重复路径
-        if str(final_wad_path).startswith(str(local_dir)):
-            # WAD 与 CFG 同目录，直接写文件名以避免引擎把绝对路径当相对路径拼接
-            content = re.sub(r'doom_scenario_path\s*=\s*.*', f'doom_scenario_path = {wad_name}', content)
-        else:
-            # 使用引号包裹绝对路径，减少解析歧义
-            content = re.sub(r'doom_scenario_path\s*=\s*.*', f'doom_scenario_path = "{final_wad_path}"', content)
-
-        # 确保变量存在：如果已有 available_game_variables，保证包含 HITCOUNT
-        m = re.search(r'available_game_variables\s*=\s*\{([^}]*)\}', content)
-        if m:
-            vars_inner = m.group(1)
-            vars_set = set(v.strip() for v in vars_inner.split())
-            needed = {'KILLCOUNT', 'HITCOUNT', 'AMMO2', 'HEALTH', 'FRAGCOUNT'}
-            if not needed.issubset(vars_set):
-                merged = ' '.join(sorted(vars_set.union(needed)))
-                content = re.sub(r'available_game_variables\s*=\s*\{[^}]*\}', f'available_game_variables = {{ {merged} }}', content)
-        else:
-            content += '\navailable_game_variables = { KILLCOUNT HITCOUNT AMMO2 HEALTH FRAGCOUNT }\n'
-        
-        # [新增] 物理外挂：加快转身速度，方便 AI 快速索敌
-        if 'player_turn_speed' not in content:
-            content += '\nplayer_turn_speed = 300\n'
-
-        with open(local_cfg_path, 'w', encoding='utf-8') as f:
-            f.write(content)
-            
-        print(f"[Info] Patched config: {local_cfg_path}")
-        print(f"[Info] Using WAD: {final_wad_path}")
-        return local_cfg_path
-
-    scenario_file_path = _ensure_game_variables_in_cfg(scenario_file)
+    # 补丁后的 cfg/WAD 由场景缓存按内容哈希构建一次，所有 worker 共享
+    extra_options = None
+    if native_obs:
+        # 原生模式：关闭 HUD，固定 CRCGCB（引擎直接给出 CHW 缓冲区），免去裁剪/缩放/转置
+        extra_options = {'render_hud': 'false', 'screen_format': 'CRCGCB'}
+        resolution = _cfg_get(cfg, 'doom_native_resolution', NATIVE_RESOLUTIONS[0])
+        res_w, res_h = (int(v) for v in resolution.split('x'))
+        # 复制一份 cfg，避免改动调用方（Sample Factory worker）共享的配置
+        cfg = AttrDict(cfg) if isinstance(cfg, dict) else copy.copy(cfg)
+        cfg.res_w, cfg.res_h = res_w, res_h
+        cfg.pixel_format = 'CHW'
+        kwargs.setdefault('custom_resolution', resolution)
+    scenario_file_path = build_scenario(scenario_file, extra_options)
 
     # 2. 构造 Spec
     base_spec = get_spec_by_scenario(scenario_file)
@@ -167,13 +175,38 @@ def create_vizdoom_env(env_name, cfg=None, env_config=None, render_mode=None, **
             print("[Info] Patched underlying VizdoomEnv to accept list/tuple actions and disabled audio.")
     except Exception as e:
         print(f"[Warning] Could not patch underlying VizdoomEnv: {e}")
+    if stop_after == "sf":
+        return env
 
     # 4. 依次套上 Wrapper (顺序很重要: 内 -> 外)
     # 先处理图像
-    env = ImageCleaningWrapper(env)
+    env = ImageCleaningWrapper(env, native=native_obs, grayscale=grayscale, uint8=obs_uint8)
+    if stop_after == "image":
+        return env
+    # 帧叠加紧跟在图像处理之后
+    frame_stack = _cfg_get(cfg, 'doom_frame_stack', 1)
+    if frame_stack > 1:
+        env = FrameStackWrapper(env, frame_stack, mode=_cfg_get(cfg, 'doom_frame_stack_mode', 'channels'))
+    if stop_after == "frame_stack":
+        return env
     # 再处理奖励
-    env = RewardShapingWrapper(env)
+    if reward_spec is None:
+        reward_spec = _cfg_get(cfg, 'doom_reward_spec', None)
+    env = RewardShapingWrapper(
+        env,
+        game_variables=read_game_variables(scenario_file_path),
+        reward_spec=reward_spec,
+        reward_overrides=reward_overrides,
+        defer_shaping=defer_shaping,
+    )
+    if stop_after == "reward":
+        return env
     # 最后处理动作 (最外层，因为它改变了 Action Space 的形状)
     env = CompositeActionWrapper(env)
+    if stop_after == "action":
+        return env
+    # 可选：逐段计时，套在所有 Wrapper 之外
+    if _cfg_get(cfg, 'doom_env_timing', False):
+        env = EnvTimingWrapper(env)
 
     return env
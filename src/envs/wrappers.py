@@ -3,6 +3,7 @@ import numpy as np
 import cv2
 import vizdoom as vzd
 import types
+from src.envs.reward_spec import compile_reward_spec
 
 class RewardShapingWrapper(gym.Wrapper):
     """
@@ -14,32 +15,62 @@ class RewardShapingWrapper(gym.Wrapper):
 
     兼容性：能接受离散动作索引（0~4）或底层已经展开的 list/tuple/numpy 动作。
     动作映射约定: 0:左, 1:右, 2:开火, 3:左+开火, 4:右+开火
+
+    具体的奖励规则来自 reward_spec（见 src/envs/reward_spec.py，默认即上述规则）。
+    defer_shaping=True 时本 Wrapper 只读取变量、不修改奖励，把原始数据放进 info，
+    交给向量化环境对整批环境一次性求值。
     """
-    def __init__(self, env):
+    def __init__(self, env, game_variables=None, reward_spec=None, reward_overrides=None, defer_shaping=False):
+        """
+        game_variables: 补丁后 cfg 中 available_game_variables 的变量名列表（按 cfg 顺序）。
+        给出时在构造阶段就检查缺失变量，不再在热循环里默默返回 0.0。
+        """
         super().__init__(env)
-        self.prev_vars = {}
+        self.program = compile_reward_spec(reward_spec, reward_overrides)
+        self.defer_shaping = defer_shaping
+        # 奖励塑形需要读取的变量（顺序即内部数组的列顺序）
+        self.tracked_variables = tuple(self.program.variables)
+        for name in self.tracked_variables:
+            if not hasattr(vzd.GameVariable, name):
+                raise ValueError(f"Unknown ViZDoom game variable: {name}")
+        if game_variables is not None:
+            missing = [v for v in self.tracked_variables if v not in game_variables]
+            if missing:
+                raise ValueError(
+                    f"RewardShapingWrapper needs game variables {missing}, "
+                    f"but the scenario only provides {list(game_variables)}"
+                )
+        self._tracked = [getattr(vzd.GameVariable, name) for name in self.tracked_variables]
+        self._game = None
+        self._var_index = None
+        # 预分配：当前/上一步的变量值，reset 之后每步只交换引用
+        self._curr = np.zeros(len(self._tracked), dtype=np.float64)
+        self._prev = np.zeros(len(self._tracked), dtype=np.float64)
         self.last_action_idx = 0 # 记录上一步的离散索引（0~4）
 
-    def _query_game_variable(self, var):
-        """安全查询底层变量"""
-        try:
-            unwrapped = getattr(self.env, 'unwrapped', None)
-            candidates = [unwrapped]
-            if unwrapped is not None:
-                if hasattr(unwrapped, 'game'): candidates.append(unwrapped.game)
-                if hasattr(unwrapped, '_game'): candidates.append(unwrapped._game)
-            for c in candidates:
-                if c and hasattr(c, 'get_game_variable'):
-                    try:
-                        val = c.get_game_variable(var)
-                        if val is None:
-                            return 0.0
-                        return val
-                    except:
-                        continue
-        except:
-            pass
-        return 0.0
+    def _resolve_game(self):
+        """reset 时解析一次底层 DoomGame，并算出被跟踪变量在 state.game_variables 中的下标"""
+        unwrapped = self.env.unwrapped
+        game = getattr(unwrapped, 'game', None) or getattr(unwrapped, '_game', None)
+        if game is None:
+            raise RuntimeError(f"RewardShapingWrapper could not find a DoomGame under {type(unwrapped).__name__}")
+        available = list(game.get_available_game_variables())
+        missing = [v.name for v in self._tracked if v not in available]
+        if missing:
+            raise RuntimeError(f"Game variables {missing} are not enabled in the scenario cfg")
+        self._game = game
+        self._var_index = np.array([available.index(v) for v in self._tracked], dtype=np.intp)
+
+    def _read_game_variables(self, out):
+        """一次性读出全部跟踪变量到 out"""
+        state = self._game.get_state()
+        if state is not None:
+            np.take(state.game_variables, self._var_index, out=out)
+        else:
+            # episode 已结束时没有 state，逐个读取最终值
+            for j, var in enumerate(self._tracked):
+                out[j] = self._game.get_game_variable(var)
+        return out
 
     def _action_to_index(self, action):
         """把可能的 list/tuple 动作映射成离散索引，若已是 int 则直接返回。"""
@@ -71,12 +102,8 @@ class RewardShapingWrapper(gym.Wrapper):
 
     def reset(self, **kwargs):
         obs, info = self.env.reset(**kwargs)
-        self.prev_vars = {
-            'KILLCOUNT': self._query_game_variable(vzd.GameVariable.KILLCOUNT),
-            'HITCOUNT': self._query_game_variable(vzd.GameVariable.HITCOUNT),
-            'HEALTH': self._query_game_variable(vzd.GameVariable.HEALTH),
-            'AMMO2': self._query_game_variable(vzd.GameVariable.AMMO2),
-        }
+        self._resolve_game()
+        self._read_game_variables(self._prev)
         self.last_action_idx = 0
         return obs, info
 
@@ -87,102 +114,81 @@ class RewardShapingWrapper(gym.Wrapper):
         obs, reward, terminated, truncated, info = self.env.step(action)
 
         # --- 1. 获取状态 ---
-        curr_hits = self._query_game_variable(vzd.GameVariable.HITCOUNT)
-        curr_kills = self._query_game_variable(vzd.GameVariable.KILLCOUNT)
-        curr_health = self._query_game_variable(vzd.GameVariable.HEALTH)
-        curr_ammo = self._query_game_variable(vzd.GameVariable.AMMO2)
-
-        diff_hits = curr_hits - self.prev_vars.get('HITCOUNT', 0)
-        diff_kills = curr_kills - self.prev_vars.get('KILLCOUNT', 0)
-        diff_health = curr_health - self.prev_vars.get('HEALTH', 100)  # 负数表示掉血
-        diff_ammo = self.prev_vars.get('AMMO2', 0) - curr_ammo
-
-        # --- 2. 核心奖励逻辑 ---
+        curr = self._read_game_variables(self._curr)
 
-        # A. 基础生存 (活着就好)
-        reward += 0.01 
-
-        # B. 击杀 (最高优先级)
-        if diff_kills > 0:
-            reward += 15.0 * diff_kills 
-
-        # C. 命中 (过程奖励)
-        if diff_hits > 0:
-            reward += 2.0 * diff_hits
-
-        # D. 空枪惩罚 (防止乱射)
-        if diff_ammo > 0:
-            if diff_hits > 0:
-                reward += 0.5  # 命中抵消消耗
-            else:
-                reward -= 0.5  # 空枪微罚，保留试错勇气
-
-        # E. 掉血惩罚 (生存压力)
-        if diff_health < 0:
-            # 掉血是负数，乘以正系数 = 扣分
-            # 加大惩罚力度，让它怕死
-            reward += 0.2 * diff_health 
-
-        # === ✨ 新增逻辑开始 ===
-        # F. 危机反应 (Pain Reflex)
-        if diff_health < 0:
-            # 且当前没有在开火/命中 (说明面前可能没怪，是被背后偷袭)
-            if diff_hits == 0:
-                # 此时，如果它选择转头 (action 0,1,3,4)，我们减轻一点掉血惩罚，或者给予补偿
-                if action_idx in [0, 1, 3, 4]: 
-                    reward += 0.5 # 鼓励挨打时转身
-                else:
-                    reward -= 1.0 # 挨打还不动？重罚！
-
-        # G. 巡逻奖励 (Patrol Incentive)
-        # 如果当前没开枪 (diff_ammo == 0)，说明处于索敌阶段
-        if diff_ammo == 0:
-            # 鼓励它转头寻找敌人，而不是发呆
-            if action_idx in [0, 1]: 
-                reward += 0.05 
-            else:
-                # 没开枪又没转头 (发呆)，给予微小惩罚
-                reward -= 0.01
-        # === ✨ 新增逻辑结束 ===
-
-        # D. 动作稳定性惩罚 (Anti-Jitter)
-        if (self.last_action_idx == 0 and action_idx == 1) or \
-           (self.last_action_idx == 1 and action_idx == 0):
-            reward -= 0.5 # 抖动惩罚
+        if self.defer_shaping:
+            # 交给向量化环境批量求值
+            info['SHAPING_CURR'] = curr.copy()
+            info['SHAPING_PREV'] = self._prev.copy()
+            info['ACTION_IDX'] = action_idx
+            info['PREV_ACTION_IDX'] = self.last_action_idx
+        else:
+            # --- 2. 核心奖励逻辑（由 reward spec 编译而来）---
+            shaped, log_info = self.program.step_scalar(curr.tolist(), self._prev.tolist(), action_idx, self.last_action_idx)
+            reward += float(shaped)
+            # Log info
+            info.update(log_info)
 
         # 记录当前动作为下一步做参考
         self.last_action_idx = action_idx
 
         # --- 3. 更新状态 ---
-        self.prev_vars = {
-            'KILLCOUNT': curr_kills,
-            'HITCOUNT': curr_hits,
-            'HEALTH': curr_health,
-            'AMMO2': curr_ammo,
-        }
-        
-        # Log info
-        info['HIT_INC'] = diff_hits
-        info['KILL_INC'] = diff_kills
-        info['AMMO_USED'] = diff_ammo
-        info['HEALTH_DIFF'] = diff_health
+        self._prev, self._curr = self._curr, self._prev
 
         return obs, reward, terminated, truncated, info
 
 class ImageCleaningWrapper(gym.ObservationWrapper):
     """
     修复视觉畸变：保持 4:3 比例，不强行拉伸
+
+    native=True 时引擎已经按目标分辨率、CHW 格式且关闭 HUD 渲染（见 create_vizdoom_env），
+    这里不再裁剪/缩放/转置，只做归一化；grayscale=True 时输出单通道灰度图。
+    uint8=True 时保持 0~255 的 uint8 输出（字节数是 float32 的 1/4），归一化交给模型在设备上完成。
     """
-    def __init__(self, env):
+    # ITU-R BT.601 亮度权重，预先除以 255，灰度化与归一化一步完成
+    GRAY_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32) / 255.0
+    # 同一组权重的定点版本（和为 256），uint8 模式下整数运算后右移 8 位
+    GRAY_WEIGHTS_U16 = np.array([77, 150, 29], dtype=np.uint16)
+
+    def __init__(self, env, native=False, grayscale=False, uint8=False):
         super().__init__(env)
-        # 使用 128x96 (4:3)，这样 Agent 看到的画面几何比例是正常的
-        # 有助于它判断角速度
-        self.w, self.h = 128, 96
-        self.observation_space = gym.spaces.Box(
-            low=0, high=1, shape=(3, self.h, self.w), dtype=np.float32
-        )
-        
+        self.native = native
+        self.grayscale = grayscale
+        self.uint8 = uint8
+        if native:
+            # 几何尺寸由引擎分辨率决定
+            shape = env.observation_space.shape
+            self.h, self.w = (shape[1], shape[2]) if shape[0] == 3 else (shape[0], shape[1])
+        else:
+            # 使用 128x96 (4:3)，这样 Agent 看到的画面几何比例是正常的
+            # 有助于它判断角速度
+            self.w, self.h = 128, 96
+        channels = 1 if grayscale else 3
+        if uint8:
+            self.observation_space = gym.spaces.Box(
+                low=0, high=255, shape=(channels, self.h, self.w), dtype=np.uint8
+            )
+        else:
+            self.observation_space = gym.spaces.Box(
+                low=0, high=1, shape=(channels, self.h, self.w), dtype=np.float32
+            )
+
+    def _native_observation(self, obs):
+        if obs.shape[-1] == 3:
+            obs = np.transpose(obs, (2, 0, 1))
+        if self.uint8:
+            if self.grayscale:
+                gray = np.tensordot(self.GRAY_WEIGHTS_U16, obs, axes=1) >> 8
+                return gray.astype(np.uint8)[None]
+            return np.ascontiguousarray(obs)
+        if self.grayscale:
+            return np.einsum('chw,c->hw', obs, self.GRAY_WEIGHTS)[None]
+        return np.multiply(obs, 1.0 / 255.0, dtype=np.float32)
+
     def observation(self, obs):
+        if self.native:
+            return self._native_observation(obs)
+
         if obs.shape[0] == 3:
             obs = np.transpose(obs, (1, 2, 0))
         h, w, c = obs.shape
@@ -194,11 +200,66 @@ class ImageCleaningWrapper(gym.ObservationWrapper):
         
         # 缩放 (保持比例)
         obs = cv2.resize(obs, (self.w, self.h), interpolation=cv2.INTER_AREA)
-        
-        obs = np.transpose(obs, (2, 0, 1))
+
+        if self.grayscale:
+            obs = cv2.cvtColor(obs, cv2.COLOR_RGB2GRAY)[None]
+        else:
+            obs = np.transpose(obs, (2, 0, 1))
+        if self.uint8:
+            return np.ascontiguousarray(obs)
         obs = obs.astype(np.float32) / 255.0
         return obs
 
+class FrameStackWrapper(gym.Wrapper):
+    """
+    零拷贝帧叠加：预分配 2k 帧的环形缓冲区，每帧写两次（位置 i 与 i+k），
+    最近 k 帧因此总是一段连续内存，叠加后的观察直接是缓冲区的视图，不再每步拼接。
+
+    mode='channels': (k*C, H, W)，与 CustomVizdoomEncoder 兼容
+    mode='time':     (k, C, H, W)
+    copy=False 时返回的视图会在下一次 step 时被覆盖，需要长期持有请传 copy=True（只拷贝一次）。
+    """
+    def __init__(self, env, num_frames=4, mode='channels', copy=False):
+        super().__init__(env)
+        assert mode in ('channels', 'time'), f"Unknown frame stack mode: {mode}"
+        self.num_frames = num_frames
+        self.mode = mode
+        self.copy = copy
+
+        space = env.observation_space
+        frame_shape = space.shape
+        if mode == 'channels':
+            stacked_shape = (num_frames * frame_shape[0],) + tuple(frame_shape[1:])
+        else:
+            stacked_shape = (num_frames,) + tuple(frame_shape)
+        self.observation_space = gym.spaces.Box(
+            low=np.min(space.low), high=np.max(space.high), shape=stacked_shape, dtype=space.dtype
+        )
+        self._buffer = np.zeros((2 * num_frames,) + tuple(frame_shape), dtype=space.dtype)
+        self._pos = num_frames - 1
+
+    def _push(self, frame):
+        self._pos = (self._pos + 1) % self.num_frames
+        self._buffer[self._pos] = frame
+        self._buffer[self._pos + self.num_frames] = frame
+
+    def _stacked(self):
+        start = self._pos + 1
+        view = self._buffer[start:start + self.num_frames].reshape(self.observation_space.shape)
+        return view.copy() if self.copy else view
+
+    def reset(self, **kwargs):
+        obs, info = self.env.reset(**kwargs)
+        # episode 开始时用首帧填满整个缓冲区（一次广播写入）
+        self._buffer[:] = obs
+        self._pos = self.num_frames - 1
+        return self._stacked(), info
+
+    def step(self, action):
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        self._push(obs)
+        return self._stacked(), reward, terminated, truncated, info
+
 class CompositeActionWrapper(gym.ActionWrapper):
     """
     [0:左, 1:右, 2:开火, 3:左+开火, 4:右+开火]
@@ -207,14 +268,12 @@ class CompositeActionWrapper(gym.ActionWrapper):
         super().__init__(env)
         self.action_space = gym.spaces.Discrete(5) 
 
-    def action(self, act):
-        return act 
-
-    def step(self, action):
+    def action(self, action):
+        # gym.ActionWrapper.step 会用这里展开后的按键调用内层 step
         real_action = [0, 0, 0] 
         if action == 0: real_action = [1, 0, 0]   # 左
         elif action == 1: real_action = [0, 1, 0] # 右
         elif action == 2: real_action = [0, 0, 1] # 开火
         elif action == 3: real_action = [1, 0, 1] # 左+开火
         elif action == 4: real_action = [0, 1, 1] # 右+开火
-        return self.env.step(real_action)
\ No newline at end of file
+        return real_action
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+评估农场：把 (checkpoint, 场景, seed, episode 批) 任务分发到进程池。
+
+每个 worker 进程只加载一次模型、复用同一个环境跑多个任务；
+每个 episode 的结果实时追加到 episodes.jsonl / episodes.csv，
+全部结束后按 checkpoint（以及 checkpoint x 场景）汇总均值和置信区间到 summary.csv。
+
+用法：
+    python src/eval_farm.py train_dir/my_exp/checkpoint_p0 --episodes 20
+    python src/eval_farm.py a.pth b.pth --envs custom_doom_basic custom_doom_defend_the_center --seeds 0 1
+"""
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.eval_stats import summarize
+
+EPISODE_FIELDS = ["checkpoint", "env", "seed", "episode", "reward", "steps", "kills", "hits", "ammo_used", "worker"]
+# 从 RewardShapingWrapper 的逐步 info 累加出的统计量
+INFO_STATS = {"kills": "KILL_INC", "hits": "HIT_INC", "ammo_used": "AMMO_USED"}
+MAX_CACHED_MODELS = 4
+# 影响环境构造的 cfg 键
+ENV_CFG_KEYS = ("res_w", "res_h", "env_frameskip", "doom_native_obs", "doom_native_resolution",
+                "doom_obs_grayscale", "doom_obs_uint8", "doom_frame_stack")
+
+# worker 进程内的状态：评估参数、环境缓存（按场景 x 观察设置）、模型缓存（按 checkpoint，LRU）
+_worker = {}
+
+
+def _init_worker(eval_args):
+    import torch
+    torch.set_num_threads(1)
+    _worker["args"] = argparse.Namespace(**eval_args)
+    _worker["envs"] = {}
+    _worker["models"] = OrderedDict()
+
+
+def _get_env(env_name, cfg):
+    from src.envs.vizdoom_env import create_vizdoom_env
+    # 不同 checkpoint 的 manifest 可能要求不同的观察设置，按这些设置分别缓存环境
+    key = (env_name,) + tuple(cfg.get(k) for k in ENV_CFG_KEYS)
+    envs = _worker["envs"]
+    if key not in envs:
+        envs[key] = create_vizdoom_env(env_name, cfg=cfg)
+    return envs[key]
+
+
+def _get_model(checkpoint, env_name):
+    """
+    返回 (PolicyRuntime, cfg, env)。模型只按 checkpoint 缓存，checkpoint 只在第一次用到时读取；
+    观察设置由 manifest 决定，同一 checkpoint 在各场景下的观察空间相同，环境另由 _get_env 按场景缓存。
+    """
+    import gymnasium as gym
+    from src.evaluate import get_eval_config
+    from src.checkpoint_io import read_checkpoint, apply_manifest, build_policy
+    from src.policy_runtime import PolicyRuntime
+    models = _worker["models"]
+    if checkpoint in models:
+        models.move_to_end(checkpoint)
+        runtime, cfg = models[checkpoint]
+        env = _get_env(env_name, cfg)
+    else:
+        ckpt = read_checkpoint(checkpoint)
+        cfg = apply_manifest(get_eval_config(_worker["args"]), ckpt.manifest, verbose=False)
+        env = _get_env(env_name, cfg)
+        model = build_policy(ckpt, cfg, gym.spaces.Dict({"obs": env.observation_space}), env.action_space)
+        runtime = PolicyRuntime(model, num_envs=1)
+        models[checkpoint] = (runtime, cfg)
+        if len(models) > MAX_CACHED_MODELS:
+            models.popitem(last=False)
+
+    if runtime.model.action_space.n != env.action_space.n:
+        raise ValueError(f"{checkpoint} has {runtime.model.action_space.n} actions but {env_name} has {env.action_space.n}")
+    return runtime, cfg, env
+
+
+def _run_job(job):
+    """跑一个 (checkpoint, env, seed, 起始 episode, episode 数) 任务，返回逐 episode 记录"""
+    checkpoint, env_name, seed, first_episode, num_episodes = job
+    runtime, cfg, env = _get_model(checkpoint, env_name)
+
+    records = []
+    for episode in range(first_episode, first_episode + num_episodes):
+        # 每个 episode 单独播种，结果与任务如何切分无关
+        episode_seed = seed * 100003 + episode
+        obs, _ = env.reset(seed=episode_seed)
+        runtime.reset()
+        runtime.seed(episode_seed)
+        record = {"checkpoint": checkpoint, "env": env_name, "seed": seed, "episode": episode,
+                  "reward": 0.0, "steps": 0, "worker": os.getpid()}
+        record.update({name: 0.0 for name in INFO_STATS})
+        done = False
+        while not done:
+            obs, r, terminated, truncated, info = env.step(runtime.act(obs))
+            record["reward"] += float(r)
+            record["steps"] += 1
+            for name, key in INFO_STATS.items():
+                record[name] += float(info.get(key, 0.0))
+            done = terminated or truncated
+        records.append(record)
+    return records
+
+
+def find_checkpoints(paths):
+    """文件原样返回；目录则递归查找其中的 .pth（已有转换好的 .safetensors 时优先用它，加载更快）"""
+    found = []
+    for p in map(Path, paths):
+        if p.is_dir():
+            for c in sorted(p.rglob("*.pth")):
+                if c.name.endswith(".weights_only.pth"):
+                    continue
+                converted = c.with_suffix(".safetensors")
+                found.append(str(converted if converted.exists() else c))
+        elif p.exists():
+            found.append(str(p))
+        else:
+            print(f"[Warning] Checkpoint path not found: {p}")
+    return found
+
+
+def make_jobs(checkpoints, env_names, seeds, episodes, batch_episodes):
+    # 同一 checkpoint x 场景的任务排在一起，worker 的模型缓存命中率更高
+    jobs = []
+    for checkpoint in checkpoints:
+        for env_name in env_names:
+            for seed in seeds:
+                for first in range(0, episodes, batch_episodes):
+                    jobs.append((checkpoint, env_name, seed, first, min(batch_episodes, episodes - first)))
+    return jobs
+
+
+def summarize_records(records, confidence):
+    """按 (checkpoint, env) 和 (checkpoint, 全部场景) 分组汇总"""
+    groups = OrderedDict()
+    for r in records:
+        groups.setdefault((r["checkpoint"], r["env"]), []).append(r)
+        groups.setdefault((r["checkpoint"], "ALL"), []).append(r)
+
+    rows = []
+    for (checkpoint, env_name), group in groups.items():
+        stats = summarize([r["reward"] for r in group], confidence)
+        row = {"checkpoint": checkpoint, "env": env_name, "episodes": stats["n"],
+               "reward_mean": stats["mean"], "reward_std": stats["std"],
+               "reward_ci_low": stats["ci_low"], "reward_ci_high": stats["ci_high"]}
+        for name in ("steps",) + tuple(INFO_STATS):
+            row[f"{name}_mean"] = sum(r[name] for r in group) / len(group)
+        rows.append(row)
+    return rows
+
+
+def main(argv=None):
+    from src.envs.scenario_cache import SCENARIO_FILES
+    from src.evaluate import add_eval_model_args
+
+    parser = argparse.ArgumentParser(description="Evaluate many checkpoints across scenarios on a process pool")
+    parser.add_argument("checkpoints", nargs="+", help="Checkpoint files or directories (searched for *.pth, preferring converted .safetensors)")
+    parser.add_argument("--envs", nargs="+", default=list(SCENARIO_FILES), help="Env names (default: all custom scenarios)")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0], help="Base seeds")
+    parser.add_argument("--episodes", type=int, default=10, help="Episodes per (checkpoint, env, seed)")
+    parser.add_argument("--batch-episodes", type=int, default=5, help="Episodes per job sent to a worker")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Process pool size")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the reported intervals")
+    parser.add_argument("--out-dir", type=str, default="dist/eval_farm", help="Where episodes.jsonl/csv and summary.csv go")
+    add_eval_model_args(parser)
+    args = parser.parse_args(argv)
+    if args.episodes < 1:
+        parser.error("--episodes must be >= 1")
+
+    checkpoints = find_checkpoints(args.checkpoints)
+    if not checkpoints:
+        print("❌ No checkpoints found")
+        return 1
+    jobs = make_jobs(checkpoints, args.envs, args.seeds, args.episodes, max(1, args.batch_episodes))
+    workers = max(1, min(args.workers, len(jobs)))
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    jsonl_path = os.path.join(args.out_dir, "episodes.jsonl")
+    csv_path = os.path.join(args.out_dir, "episodes.csv")
+    summary_path = os.path.join(args.out_dir, "summary.csv")
+
+    print(f"🚜 {len(checkpoints)} checkpoints x {len(args.envs)} envs x {len(args.seeds)} seeds x {args.episodes} episodes "
+          f"= {len(jobs)} jobs on {workers} workers")
+
+    eval_args = {k: v for k, v in vars(args).items()
+                 if k in ("native_obs", "native_resolution", "grayscale", "frame_stack",
+                          "obs_uint8", "encoder_variant", "legacy_obs_scale")}
+    records = []
+    start = time.perf_counter()
+    ctx = mp.get_context("spawn")
+    with open(jsonl_path, "w") as jf, open(csv_path, "w", newline="") as cf, \
+            ctx.Pool(workers, initializer=_init_worker, initargs=(eval_args,)) as pool:
+        writer = csv.DictWriter(cf, fieldnames=EPISODE_FIELDS)
+        writer.writeheader()
+        for done, job_records in enumerate(pool.imap_unordered(_run_job, jobs), 1):
+            for r in job_records:
+                jf.write(json.dumps(r) + "\n")
+                writer.writerow(r)
+            jf.flush()
+            cf.flush()
+            records.extend(job_records)
+            first = job_records[0]
+            rewards = ", ".join(f"{r['reward']:.1f}" for r in job_records)
+            print(f"   [{done}/{len(jobs)}] {first['env']} {os.path.basename(first['checkpoint'])}: {rewards}")
+
+    if not records:
+        print("❌ No episodes were run")
+        return 1
+    rows = summarize_records(records, args.confidence)
+    with open(summary_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print(f"\n📊 Summary ({args.confidence:.0%} CI), {len(records)} episodes in {time.perf_counter() - start:.1f}s")
+    for row in rows:
+        print(f"   {os.path.basename(row['checkpoint']):<32}{row['env']:<34}n={row['episodes']:<4}"
+              f"reward={row['reward_mean']:8.2f}  [{row['reward_ci_low']:.2f}, {row['reward_ci_high']:.2f}]")
+    print(f"💾 Results saved at: {args.out_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""
+评估结果的统计工具：均值、标准差和基于 Student-t 的置信区间。
+
+只依赖标准库（不引入 scipy）。t 分位数在 df = 1、2 时用精确的闭式解，
+df >= 3 用 Cornish-Fisher 展开近似，0.90~0.99 的置信水平下与精确值相差不到 1%。
+"""
+import math
+from statistics import NormalDist
+
+
+def t_quantile(p, df):
+    """Student-t 分布的 p 分位数（df = 1、2 为闭式解，其余为 Abramowitz & Stegun 26.7.5）"""
+    # 展开在小自由度下明显偏小（df=1 时 0.975 分位数为 11.30，精确值 12.71），置信区间会过窄
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+    z = NormalDist().inv_cdf(p)
+    if df is None or df <= 0 or math.isinf(df):
+        return z
+    z2 = z * z
+    g1 = (z2 + 1) * z / 4
+    g2 = ((5 * z2 + 16) * z2 + 3) * z / 96
+    g3 = (((3 * z2 + 19) * z2 + 17) * z2 - 15) * z / 384
+    g4 = ((((79 * z2 + 776) * z2 + 1482) * z2 - 1920) * z2 - 945) * z / 92160
+    return z + g1 / df + g2 / df ** 2 + g3 / df ** 3 + g4 / df ** 4
+
+
+def mean_std(values):
+    n = len(values)
+    if n == 0:
+        return float('nan'), float('nan')
+    mean = sum(values) / n
+    if n < 2:
+        return mean, float('nan')
+    var = sum((v - mean) ** 2 for v in values) / (n - 1)
+    return mean, math.sqrt(var)
+
+
+def ci_half_width(std, n, confidence=0.95):
+    """均值置信区间的半宽；样本不足两个时返回 inf"""
+    if n < 2 or math.isnan(std):
+        return float('inf')
+    return t_quantile(0.5 + confidence / 2, n - 1) * std / math.sqrt(n)
+
+
+def summarize(values, confidence=0.95):
+    """返回 {n, mean, std, ci_low, ci_high}"""
+    n = len(values)
+    mean, std = mean_std(values)
+    half = ci_half_width(std, n, confidence)
+    return {
+        "n": n,
+        "mean": mean,
+        "std": std,
+        "ci_low": mean - half,
+        "ci_high": mean + half,
+    }
+
+
+def sequential_stop(values, ci_width=None, min_episodes=5, max_episodes=100, reference_score=None, confidence=0.95):
+    """
+    序贯评估的停止判据，每完成一个 episode 调用一次。返回停止原因，继续评估时返回 None：
+    - "ci_width"：均值置信区间的全宽已不超过 ci_width
+    - "worse_than_reference"：置信区间上界低于 reference_score，统计上已确定比参考分数差
+    - "max_episodes"：达到上限
+    注意每步都检查区间会略微放大一类错误率，min_episodes 不宜设得太小。
+    """
+    n = len(values)
+    if n >= max_episodes:
+        return "max_episodes"
+    if n < max(2, min_episodes):
+        return None
+    mean, std = mean_std(values)
+    half = ci_half_width(std, n, confidence)
+    if ci_width is not None and 2 * half <= ci_width:
+        return "ci_width"
+    if reference_score is not None and mean + half < reference_score:
+        return "worse_than_reference"
+    return None
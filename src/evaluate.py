@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import sys
 import os
+import time
 import argparse
 import numpy as np
 import torch
@@ -14,8 +15,12 @@ sys.path.insert(0, str(PROJECT_ROOT))
 
 # --- 2. 导入自定义模块 ---
 import src.envs
-from src.models.custom_model import make_vizdoom_actor_critic
+from src.checkpoint_io import read_checkpoint, apply_manifest, build_policy
+from src.policy_runtime import PolicyRuntime
+from src.export_policy import InferenceStep, StepModulePolicy
 from src.envs.vizdoom_env import create_vizdoom_env
+from src.envs.vec_env import VecDoomEnv
+from src.eval_stats import sequential_stop, summarize
 
 # --- 3. PyTorch 安全补丁 ---
 import numpy.dtypes
@@ -64,6 +69,13 @@ def get_eval_config(args):
         wide_aspect_ratio=False,
         env_frameskip=4,
         pixel_format='CHW',
+        doom_native_obs=args.native_obs,
+        doom_native_resolution=args.native_resolution,
+        doom_obs_grayscale=args.grayscale,
+        doom_obs_uint8=args.obs_uint8,
+        doom_frame_stack=args.frame_stack,
+        # 现有 checkpoint 都是在 float [0,1] 观察上训练的，uint8 评估时需要 legacy 缩放才能得到相同输入
+        doom_legacy_obs_scale=args.legacy_obs_scale,
         
         # 归一化参数 (Sample Factory ActorCritic 初始化必需)
         normalize_input=True,
@@ -75,8 +87,107 @@ def get_eval_config(args):
         # 补全其他可能需要的默认参数
         nonlinearity='relu',
         use_encoder_linear=True,
+        encoder_variant=args.encoder_variant,
     )
 
+def add_eval_model_args(parser):
+    """观察/模型结构相关的参数（必须与训练时一致），evaluate 与 eval_farm 共用"""
+    parser.add_argument("--native-obs", action="store_true", help="Render at target geometry (must match training)")
+    parser.add_argument("--native-resolution", type=str, default="160x120", help="Engine resolution for --native-obs")
+    parser.add_argument("--grayscale", action="store_true", help="Single-channel observations (must match training)")
+    parser.add_argument("--frame-stack", type=int, default=1, help="Frames stacked during training (must match training)")
+    parser.add_argument("--obs-uint8", action="store_true", help="Feed uint8 observations and normalize inside the model")
+    parser.add_argument("--encoder-variant", type=str, default="legacy", help="Encoder architecture (must match training)")
+    parser.add_argument("--legacy-obs-scale", action=argparse.BooleanOptionalAction, default=True,
+                        help="Scale uint8 obs like the old float wrapper (keep on for checkpoints trained on float obs)")
+
+def make_runtime(args, model, num_envs, device):
+    """
+    按 --backend 构造逐步推理的 runtime（接口都与 PolicyRuntime 相同）：
+    eager 直接跑模型；torchscript 加载导出的 .step.pt；
+    int8 加载 quantize_policy 的产物，没有时现场做动态量化（仅 CPU）；
+    onnxruntime 用 ORT 的 CPU execution provider 跑导出的 .onnx。
+    """
+    if args.backend == "eager":
+        return PolicyRuntime(model, num_envs=num_envs, device=device)
+    if device.type != "cpu":
+        print(f"[Warning] --backend {args.backend} runs on CPU only, ignoring --device {device}")
+    artifact = Path(args.artifact) if args.artifact else None
+    if args.backend in ("torchscript", "onnxruntime"):
+        suffix = ".onnx" if args.backend == "onnxruntime" else ".step.pt"
+        artifact = artifact or Path(args.checkpoint).with_suffix(suffix)
+        if not artifact.exists():
+            method = "onnx" if args.backend == "onnxruntime" else "trace"
+            print(f"❌ {artifact} not found; run src/export_policy.py --method {method} first")
+            sys.exit(1)
+        if args.backend == "onnxruntime":
+            from src.ort_policy import OrtPolicy
+            print(f"   ONNX model: {artifact} (intra-op {args.intra_op_threads}, inter-op {args.inter_op_threads})")
+            return OrtPolicy(artifact, num_envs=num_envs, intra_op_threads=args.intra_op_threads,
+                             inter_op_threads=args.inter_op_threads)
+    elif artifact is None:
+        from src.quantize_policy import default_artifact
+        artifact = default_artifact(args.checkpoint)
+        if not artifact.exists():
+            from src.quantize_policy import quantize_step
+            print("   No int8 artifact found, quantizing Linear/GRU layers dynamically...")
+            step = quantize_step(InferenceStep(model.cpu()).eval(), "dynamic")
+            return StepModulePolicy(step, num_envs=num_envs, manifest=step.manifest())
+    print(f"   Step module: {artifact}")
+    return StepModulePolicy(artifact, num_envs=num_envs)
+
+def run_batched_episodes(env, runtime, num_episodes, stop_fn=None):
+    """
+    在 VecDoomEnv 上同步推进 N 个环境，每步只做一次批量前向。
+
+    每个环境的 GRU 隐状态是 (N, rnn_size) 中的一行，episode 结束时按掩码清零。
+    最多开始 num_episodes 个 episode：额度用完后结束的环境不再计数（仍随批步进），
+    这样不会偏向短 episode。返回按完成顺序排列的 (rewards, lengths)。
+
+    stop_fn(rewards) 在每个 episode 完成后调用，返回真值后不再开始新的 episode，
+    但已经开始的 episode 照常跑完并计入结果（直接丢弃它们会再次偏向短 episode）。
+    """
+    n = env.num_envs
+    obs, _ = env.reset()
+    ep_rewards = np.zeros(n, dtype=np.float64)
+    ep_lengths = np.zeros(n, dtype=np.int64)
+    active = np.ones(n, dtype=bool)
+    started = n
+    stopping = False
+    rewards, lengths = [], []
+
+    while active.any():
+        actions = runtime.act(obs)
+
+        obs, r, terminated, truncated, _ = env.step(actions)
+        ep_rewards += r
+        ep_lengths += 1
+
+        done = terminated | truncated
+        if done.any():
+            # 结束的环境已被 VecDoomEnv 自动 reset，对应的隐状态清零
+            runtime.reset(done)
+            for i in np.flatnonzero(done & active):
+                rewards.append(float(ep_rewards[i]))
+                lengths.append(int(ep_lengths[i]))
+                if not stopping and stop_fn is not None and stop_fn(rewards):
+                    stopping = True
+                if not stopping and started < num_episodes:
+                    started += 1
+                else:
+                    active[i] = False
+            ep_rewards[done] = 0.0
+            ep_lengths[done] = 0
+    return rewards, lengths
+
+def report_episodes_used(rewards, args, stop_reason=None):
+    stats = summarize(rewards, args.confidence)
+    print(f"   {args.confidence:.0%} CI: [{stats['ci_low']:.2f}, {stats['ci_high']:.2f}]")
+    if args.adaptive:
+        print(f"   Episodes used: {stats['n']} / {args.max_episodes} (stopped by: {stop_reason or 'max_episodes'})")
+    else:
+        print(f"   Episodes used: {stats['n']}")
+
 def main():
     parser = argparse.ArgumentParser(description="VizDoom Evaluation Script (Whitebox)")
     parser.add_argument("--checkpoint", type=str, required=True, help="Path to .pth file")
@@ -84,111 +195,108 @@ def main():
     parser.add_argument("--episodes", type=int, default=3, help="Number of episodes")
     parser.add_argument("--video-dir", type=str, default="dist/final_videos", help="Output folder")
     parser.add_argument("--device", type=str, default="cpu", help="cpu or cuda")
+    parser.add_argument("--num-envs", type=int, default=1, help="Step N envs in lockstep with one batched forward per step (no video)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Sequential testing: run episodes until the CI is narrow enough, the cap is hit or the checkpoint is worse than --reference-score")
+    parser.add_argument("--ci-width", type=float, default=None, help="Adaptive: stop once the full CI width of mean reward is below this")
+    parser.add_argument("--min-episodes", type=int, default=5, help="Adaptive: never stop before this many episodes")
+    parser.add_argument("--max-episodes", type=int, default=100, help="Adaptive: hard cap on episodes")
+    parser.add_argument("--reference-score", type=float, default=None, help="Adaptive: stop once the CI upper bound is below this")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the reported interval")
+    parser.add_argument("--backend", choices=["eager", "torchscript", "int8", "onnxruntime"], default="eager",
+                        help="Inference backend: eager model, exported .step.pt, int8-quantized step module, or ONNX Runtime (CPU)")
+    parser.add_argument("--artifact", type=str, default=None,
+                        help="Step module / .onnx for the non-eager backends (default: next to the checkpoint)")
+    parser.add_argument("--intra-op-threads", type=int, default=1, help="onnxruntime: threads inside one operator (0 = ORT default)")
+    parser.add_argument("--inter-op-threads", type=int, default=1, help="onnxruntime: threads across independent operators (0 = ORT default)")
+    add_eval_model_args(parser)
     
     args = parser.parse_args()
     device = torch.device(args.device)
 
-    # 🔍 尝试从 checkpoint 自动推断 rnn_size，以确保评估时模型结构与训练时一致
-    inferred_rnn_size = None
-    try:
-        tmp_ckpt = torch.load(args.checkpoint, map_location='cpu', weights_only=False)
-        tmp_state = tmp_ckpt['model'] if 'model' in tmp_ckpt else tmp_ckpt
-        for k, v in tmp_state.items():
-            # GRU 的 weight_ih_l0 形状为 (3 * hidden_size, input_size)
-            if k.endswith('.gru.weight_ih_l0') or '.gru.weight_ih_l0' in k:
-                size = v.shape[0]
-                if size % 3 == 0:
-                    inferred_rnn_size = size // 3
-                    break
-    except Exception:
-        inferred_rnn_size = None
-
-    # 🔍 尝试从 checkpoint 自动推断 decoder 输出大小（action/value head 的输入维度）
-    inferred_decoder_out = None
+    # 只读一次 checkpoint：结构参数来自 manifest（旧文件从权重形状推断）
+    print("📥 Loading checkpoint...")
     try:
-        tmp_ckpt = torch.load(args.checkpoint, map_location='cpu', weights_only=False)
-        tmp_state = tmp_ckpt['model'] if 'model' in tmp_ckpt else tmp_ckpt
-        for k, v in tmp_state.items():
-            if k.endswith('action_heads.linear.weight') or '.action_heads.linear.weight' in k:
-                inferred_decoder_out = v.shape[1]
-                break
-            if k.endswith('value_head.weight') or '.value_head.weight' in k:
-                inferred_decoder_out = v.shape[1]
-                break
-    except Exception:
-        inferred_decoder_out = None
-
+        ckpt = read_checkpoint(args.checkpoint)
+    except Exception as e:
+        print(f"❌ Error loading checkpoint: {e}")
+        sys.exit(1)
+    print(f"   Manifest source: {ckpt.manifest_source}")
     cfg = get_eval_config(args)
-    if inferred_rnn_size is not None and cfg.rnn_size != inferred_rnn_size:
-        print(f"[Info] Inferred rnn_size={inferred_rnn_size} from checkpoint; overriding cfg.rnn_size (was {cfg.rnn_size})")
-        cfg.rnn_size = inferred_rnn_size
-    if inferred_decoder_out is not None:
-        if not isinstance(cfg.decoder_mlp_layers, list) or cfg.decoder_mlp_layers[-1] != inferred_decoder_out:
-            print(f"[Info] Inferred decoder_out_size={inferred_decoder_out} from checkpoint; overriding cfg.decoder_mlp_layers (was {cfg.decoder_mlp_layers})")
-            cfg.decoder_mlp_layers = [inferred_decoder_out]
+    apply_manifest(cfg, ckpt.manifest)
+
+    stop_fn = None
+    stop_reason = None
+    if args.adaptive:
+        args.episodes = args.max_episodes
+        def stop_fn(rewards):
+            nonlocal stop_reason
+            stop_reason = sequential_stop(rewards, args.ci_width, args.min_episodes, args.max_episodes,
+                                          args.reference_score, args.confidence)
+            return stop_reason is not None
 
     print(f"\n🎬 === Starting Evaluation ===")
     print(f"   Env:        {args.env}")
     print(f"   Checkpoint: {args.checkpoint}")
     print(f"   Device:     {device}")
+    print(f"   Backend:    {args.backend}")
     
-    # 1. 创建环境
-    print("   Creating environment...")
-    try:
-        raw_env = create_vizdoom_env(args.env, cfg=cfg, render_mode='rgb_array')
-    except Exception as e:
-        print(f"⚠️  Env creation fallback: {e}")
-        raw_env = create_vizdoom_env(args.env, render_mode='rgb_array')
+    num_envs = max(1, min(args.num_envs, args.episodes))
+    if num_envs > 1:
+        # 批量模式：N 个环境同步步进，不录视频
+        print(f"   Creating {num_envs} environments (batched, no video)...")
+        env = VecDoomEnv(args.env, num_envs, cfg=cfg)
+        obs_space = gym.spaces.Dict({"obs": env.observation_space})
+    else:
+        # 1. 创建环境
+        print("   Creating environment...")
+        try:
+            raw_env = create_vizdoom_env(args.env, cfg=cfg, render_mode='rgb_array')
+        except Exception as e:
+            print(f"⚠️  Env creation fallback: {e}")
+            raw_env = create_vizdoom_env(args.env, render_mode='rgb_array')
 
-    # 2. 包装 Dict 空间
-    if not isinstance(raw_env.observation_space, gym.spaces.Dict):
-        print("   Wrapping environment in DictObservationWrapper...")
-        raw_env = DictObservationWrapper(raw_env)
+        # 2. 包装 Dict 空间
+        if not isinstance(raw_env.observation_space, gym.spaces.Dict):
+            print("   Wrapping environment in DictObservationWrapper...")
+            raw_env = DictObservationWrapper(raw_env)
 
-    # 3. 准备视频保存路径
-    env = raw_env
-    video_path = os.path.abspath(args.video_dir)
-    os.makedirs(video_path, exist_ok=True)
+        # 3. 准备视频保存路径
+        env = raw_env
+        obs_space = env.observation_space
+        video_path = os.path.abspath(args.video_dir)
+        os.makedirs(video_path, exist_ok=True)
     
-    print(f"   Obs Space: {env.observation_space}")
+    print(f"   Obs Space: {obs_space}")
     print(f"   Act Space: {env.action_space}")
 
-    # 4. 初始化模型
+    # 4. 初始化模型并加载权重
     print("🧠 Initializing model architecture...")
-    model = make_vizdoom_actor_critic(cfg, env.observation_space, env.action_space)
-    model.to(device)
-    model.eval()
-
-    # 5. 加载权重
-    print("📥 Loading weights...")
     try:
-        checkpoint = torch.load(args.checkpoint, map_location=device, weights_only=False)
-        state_dict = checkpoint['model'] if 'model' in checkpoint else checkpoint
-
-        # --- 过滤掉与当前模型 shape 不匹配的 key ---
-        model_state = model.state_dict()
-        filtered_state = {}
-        for k, v in state_dict.items():
-            if k in model_state:
-                try:
-                    if getattr(v, 'shape', None) == model_state[k].shape:
-                        filtered_state[k] = v
-                    else:
-                        print(f"[Info] Skipping checkpoint key {k} due to shape mismatch {getattr(v,'shape',None)} vs {model_state[k].shape}")
-                except Exception:
-                    print(f"[Info] Skipping checkpoint key {k} (couldn't compare shapes)")
-            else:
-                print(f"[Info] Skipping checkpoint key {k} (not present in model)")
-
-        model.load_state_dict(filtered_state, strict=False)
+        model = build_policy(ckpt, cfg, obs_space, env.action_space, device)
         print("✅ Weights loaded.")
     except Exception as e:
         print(f"❌ Error loading weights: {e}")
         sys.exit(1)
+    del ckpt
+
+    # 5. 评估循环
+    if num_envs > 1:
+        print(f"\n🚀 Starting Batched Run Loop ({num_envs} envs)...")
+        start = time.perf_counter()
+        rewards, lengths = run_batched_episodes(env, make_runtime(args, model, num_envs, device), args.episodes, stop_fn)
+        elapsed = time.perf_counter() - start
+        env.close()
+        for i, (ep_reward, step) in enumerate(zip(rewards, lengths)):
+            print(f"   Episode {i+1}: Reward = {ep_reward:.2f}, Steps = {step}")
+        print(f"\n📊 Result: Average Reward = {np.mean(rewards):.2f} over {len(rewards)} episodes "
+              f"({elapsed:.1f}s, {sum(lengths) / elapsed:.0f} env steps/s)")
+        report_episodes_used(rewards, args, stop_reason)
+        return
 
-    # 6. 评估循环
     print("\n🚀 Starting Run Loop...")
     rewards = []
+    runtime = make_runtime(args, model, 1, device)
     
     for i in range(args.episodes):
         obs, info = env.reset()
@@ -202,7 +310,7 @@ def main():
         video_writer = None
 
         # 初始化 RNN (Batch=1)
-        rnn_states = torch.zeros(1, cfg.rnn_size, device=device)
+        runtime.reset()
 
         while not done:
             # 捕获当前画面
@@ -222,21 +330,8 @@ def main():
             else:
                 obs_data = obs
             
-            # 转为 Tensor [1, 1, 84, 84]
-            obs_tensor = torch.from_numpy(obs_data).float().to(device).unsqueeze(0)
-            obs_dict = {'obs': obs_tensor}
-
-            # 推理
-            with torch.no_grad():
-                result = model(obs_dict, rnn_states, values_only=False)
-            
-            # 兼容不同的 Key 返回
-            action_logits = result.get('action_logits', result.get('logits'))
-            rnn_states = result['new_rnn_states']
-            
-            # 动作采样
-            dist = torch.distributions.Categorical(logits=action_logits)
-            action = dist.sample().item()
+            # 推理 + 动作采样：PolicyRuntime 用预分配的缓冲区，保留 uint8，在设备上归一化
+            action = runtime.act(obs_data)
             
             # 步进
             obs, r, terminated, truncated, info = env.step(action)
@@ -247,9 +342,12 @@ def main():
             video_writer.release()
         rewards.append(ep_reward)
         print(f"   Episode {i+1}: Reward = {ep_reward:.2f}, Steps = {step}")
+        if stop_fn is not None and stop_fn(rewards):
+            break
 
     env.close()
     print(f"\n📊 Result: Average Reward = {np.mean(rewards):.2f}")
+    report_episodes_used(rewards, args, stop_reason)
     print(f"💾 Videos saved at: {video_path}")
 
 if __name__ == "__main__":
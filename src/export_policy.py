@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+把 CustomVizdoomActorCritic 导出成单步推理模块（CPU 部署用）。
+
+部署时只需要 forward_head -> forward_core -> forward_tail 走一步，
+InferenceStep 把这条路径拆成纯张量运算：
+    融合后的观察归一化 (obs * scale + shift, clamp) -> encoder -> GRUCell -> decoder -> action/value head
+去掉了 SF 的 normalize_obs、PackedSequence 分支和 Python 分布对象，可以 TorchScript trace/freeze，
+也可以 torch.compile。导出时自动做与 eager 模型的数值一致性检查和延迟测试。
+
+用法：
+    python src/export_policy.py --checkpoint train_dir/exp/checkpoint_p0/checkpoint_xxx.pth
+    python src/export_policy.py --checkpoint ckpt.safetensors --method compile   # 只测 torch.compile，不落盘
+    python src/export_policy.py --checkpoint ckpt.pth --method onnx              # ONNX 图，给 onnxruntime 后端用
+产物 <checkpoint>.step.pt 用 StepModulePolicy 加载（接口与 PolicyRuntime 相同）；
+<checkpoint>.onnx 用 src/ort_policy.py 的 OrtPolicy 加载（不需要 torch）。
+"""
+import argparse
+import inspect
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Final
+
+import numpy as np
+import torch
+from torch import nn
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.checkpoint_io import read_checkpoint, policy_cfg_from_manifest, policy_spaces, build_policy
+from src.policy_runtime import PolicyRuntime, fold_obs_normalizer
+
+MANIFEST_FILE = "manifest.json"
+
+
+class InferenceStep(nn.Module):
+    """
+    forward(obs (B, C, H, W) uint8/float, h (B, rnn_size)) -> (logits, values, new_h)
+
+    观察的缩放与冻结的 running mean/std 融合成一次乘加：
+        x = clamp(obs * scale + shift, -clip, clip)
+    use_rnn / frame_stack 标成 Final，torch.jit.script 只编译实际走到的分支（不带 RNN 时没有 cell）。
+    """
+    use_rnn: Final[bool]
+    frame_stack: Final[int]
+    frame_channels: Final[int]
+
+    def __init__(self, model):
+        super().__init__()
+        space = model.obs_space["obs"] if hasattr(model.obs_space, "spaces") else model.obs_space
+        self.obs_shape = tuple(space.shape)
+        self.obs_uint8 = np.dtype(space.dtype) == np.uint8
+        gain, bias, mean, inv_std, clip = fold_obs_normalizer(model, torch.uint8 if self.obs_uint8 else torch.float32)
+        if mean is None:
+            scale = torch.full(self.obs_shape, gain)
+            shift = torch.full(self.obs_shape, bias)
+            clip = float("inf")
+        else:
+            # (obs * gain + bias - mean) * inv_std = obs * (gain * inv_std) + (bias - mean) * inv_std
+            scale = (gain * inv_std).expand(self.obs_shape).clone()
+            shift = ((bias - mean) * inv_std).expand(self.obs_shape).clone()
+        self.register_buffer("scale", scale)
+        self.register_buffer("shift", shift)
+        self.clip = clip
+
+        encoder = model.encoder
+        self.cnn = encoder.cnn
+        self.fc = encoder.fc
+        # 帧缓存模式的 encoder 按单帧过卷积，导出时走无状态的整帧路径
+        self.frame_stack = encoder.frame_stack if getattr(encoder, "use_frame_cache", False) else 1
+        self.frame_channels = encoder.frame_channels
+
+        self.use_rnn = bool(model.cfg.use_rnn)
+        self.rnn_size = int(model.get_rnn_size())
+        if self.use_rnn:
+            gru = model.core.gru
+            self.cell = nn.GRUCell(gru.input_size, gru.hidden_size)
+            with torch.no_grad():
+                self.cell.weight_ih.copy_(gru.weight_ih_l0)
+                self.cell.weight_hh.copy_(gru.weight_hh_l0)
+                self.cell.bias_ih.copy_(gru.bias_ih_l0)
+                self.cell.bias_hh.copy_(gru.bias_hh_l0)
+        self.decoder = model.decoder
+        self.action_head = model.action_heads.linear
+        self.value_head = model.value_head
+        self.num_actions = int(self.action_head.out_features)
+
+    def forward(self, obs, h):
+        x = torch.clamp(obs.float() * self.scale + self.shift, -self.clip, self.clip)
+        if self.frame_stack > 1:
+            b = x.shape[0]
+            x = self.cnn(x.reshape(b * self.frame_stack, self.frame_channels, x.shape[2], x.shape[3])).reshape(b, -1)
+        else:
+            x = self.cnn(x)
+        x = self.fc(x)
+        if self.use_rnn:
+            h = self.cell(x, h)
+            x = h
+        x = self.decoder(x)
+        return self.action_head(x), self.value_head(x).squeeze(-1), h
+
+    def manifest(self, extra=None):
+        info = {
+            "obs_shape": list(self.obs_shape),
+            "obs_dtype": "uint8" if self.obs_uint8 else "float32",
+            "rnn_size": self.rnn_size,
+            "num_actions": self.num_actions,
+        }
+        info.update(extra or {})
+        return info
+
+
+def example_inputs(step, batch_size=1):
+    if step.obs_uint8:
+        obs = torch.randint(0, 256, (batch_size,) + step.obs_shape, dtype=torch.uint8)
+    else:
+        obs = torch.rand((batch_size,) + step.obs_shape)
+    return obs, torch.zeros(batch_size, step.rnn_size)
+
+
+def export_step(step, method="trace", optimize=False):
+    """返回可调用的单步模块：trace/script 得到冻结的 TorchScript，compile 得到 torch.compile 包装"""
+    step = step.eval()
+    if method == "compile":
+        return torch.compile(step, mode="max-autotune-no-cudagraphs", dynamic=False)
+    with torch.no_grad():
+        if method == "script":
+            scripted = torch.jit.script(step)
+        else:
+            scripted = torch.jit.trace(step, example_inputs(step))
+        scripted = torch.jit.freeze(scripted)
+        if optimize:
+            # 额外的图优化（conv/bn 折叠、MKLDNN 布局等），数值可能有 1e-6 量级差异
+            scripted = torch.jit.optimize_for_inference(scripted)
+    return scripted
+
+
+def check_parity(model, exported, steps=20, batch_size=2, atol=1e-4, seed=0):
+    """
+    与 eager 模型逐步对比 logits / values / 隐状态，返回最大绝对误差 dict，超过 atol 时抛 AssertionError。
+    """
+    torch.manual_seed(seed)
+    space = model.obs_space["obs"]
+    uint8 = np.dtype(space.dtype) == np.uint8
+    h_ref = torch.zeros(batch_size, model.get_rnn_size())
+    h_exp = h_ref.clone()
+    worst = {"logits": 0.0, "values": 0.0, "rnn_states": 0.0}
+    with torch.no_grad():
+        for _ in range(steps):
+            if uint8:
+                obs = torch.randint(0, 256, (batch_size,) + tuple(space.shape), dtype=torch.uint8)
+            else:
+                obs = torch.rand((batch_size,) + tuple(space.shape))
+            ref = model(model.normalize_obs({"obs": obs}), h_ref, values_only=False)
+            h_ref = ref["new_rnn_states"]
+            logits, values, h_exp = exported(obs, h_exp)
+            worst["logits"] = max(worst["logits"], (logits - ref["action_logits"]).abs().max().item())
+            worst["values"] = max(worst["values"], (values - ref["values"]).abs().max().item())
+            worst["rnn_states"] = max(worst["rnn_states"], (h_exp - h_ref).abs().max().item())
+    bad = {k: v for k, v in worst.items() if v > atol}
+    assert not bad, f"exported module diverges from eager model: {bad} (atol={atol})"
+    return worst
+
+
+def benchmark(fn, repeats=200, warmup=20):
+    """单步延迟（毫秒）：返回 (p50, p90)"""
+    timings = []
+    with torch.inference_mode():
+        for i in range(warmup + repeats):
+            start = time.perf_counter()
+            fn()
+            if i >= warmup:
+                timings.append((time.perf_counter() - start) * 1000.0)
+    timings.sort()
+    return statistics.median(timings), timings[int(0.9 * (len(timings) - 1))]
+
+
+def save_step_module(scripted, path, manifest):
+    torch.jit.save(scripted, str(path), _extra_files={MANIFEST_FILE: json.dumps(manifest)})
+
+
+def export_onnx(step, path, manifest, opset=17):
+    """
+    导出 ONNX 图：输入 (obs, rnn_states)，输出 (logits, values, new_rnn_states)，batch 维是动态的。
+    manifest 写进模型的 metadata，OrtPolicy 据此分配缓冲区。
+    """
+    import onnx
+    from src.ort_policy import INPUT_NAMES, OUTPUT_NAMES, MANIFEST_KEY
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # 新版默认走 dynamo 导出器；这里的图很简单，沿用 TorchScript 导出器，与 torch 2.0 行为一致
+        kwargs["dynamo"] = False
+    with torch.no_grad():
+        torch.onnx.export(step.eval(), example_inputs(step, batch_size=2), str(path),
+                          input_names=list(INPUT_NAMES), output_names=list(OUTPUT_NAMES),
+                          dynamic_axes={name: {0: "batch"} for name in INPUT_NAMES + OUTPUT_NAMES},
+                          opset_version=opset, **kwargs)
+    graph = onnx.load(str(path))
+    onnx.checker.check_model(graph)
+    entry = graph.metadata_props.add()
+    entry.key, entry.value = MANIFEST_KEY, json.dumps(manifest)
+    onnx.save(graph, str(path))
+
+
+def onnx_step(path, intra_op_threads=1, inter_op_threads=1):
+    """把 ONNX 图包装成与单步模块相同的调用方式（torch 张量进出），给 check_parity 用"""
+    from src.ort_policy import make_session
+    session = make_session(path, intra_op_threads, inter_op_threads)
+
+    def step(obs, h):
+        outputs = session.run(None, {"obs": obs.numpy(), "rnn_states": h.numpy()})
+        return tuple(torch.from_numpy(o) for o in outputs)
+    return step
+
+
+class StepModulePolicy(PolicyRuntime):
+    """
+    加载导出的 .step.pt（或直接给一个单步模块），接口与 PolicyRuntime 相同：
+    act(obs) / reset(env_ids) / seed(seed) / last_logits / last_values。
+    """
+    def __init__(self, step_module, num_envs=1, device="cpu", num_threads=None, deterministic=False, seed=None,
+                 manifest=None, flush_denormal=False):
+        self._setup(num_envs, device, num_threads, deterministic, seed, flush_denormal)
+        if isinstance(step_module, (str, Path)):
+            extra = {MANIFEST_FILE: ""}
+            step_module = torch.jit.load(str(step_module), map_location=self.device, _extra_files=extra)
+            manifest = json.loads(extra[MANIFEST_FILE])
+        if manifest is None:
+            manifest = step_module.manifest()
+        self.module = step_module
+        self.manifest = manifest
+        self.use_rnn = True
+        obs_dtype = torch.uint8 if manifest["obs_dtype"] == "uint8" else torch.float32
+        self._allocate(manifest["obs_shape"], obs_dtype, manifest["rnn_size"], manifest["num_actions"])
+
+    def _step(self):
+        logits, values, h = self.module(self._obs, self._rnn)
+        self._logits.copy_(logits)
+        self._values.copy_(values)
+        self._rnn.copy_(h)
+        self._sample()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a single-step CPU inference module for a checkpoint")
+    parser.add_argument("--checkpoint", type=str, required=True, help=".pth or .safetensors checkpoint")
+    parser.add_argument("--method", choices=["trace", "script", "compile", "onnx"], default="trace")
+    parser.add_argument("--optimize", action="store_true", help="Also run torch.jit.optimize_for_inference")
+    parser.add_argument("--out", type=str, default=None, help="Output path (default: <checkpoint>.step.pt / .onnx)")
+    parser.add_argument("--obs-shape", type=int, nargs=3, default=None, help="C H W, if the checkpoint has no manifest obs_shape")
+    parser.add_argument("--threads", type=int, default=1, help="torch.set_num_threads for the benchmark")
+    parser.add_argument("--atol", type=float, default=1e-4, help="Parity tolerance against the eager model")
+    parser.add_argument("--repeats", type=int, default=200, help="Benchmark iterations")
+    parser.add_argument("--batch-size", type=int, default=16, help="Batch size of the batched benchmark (besides batch 1)")
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset version")
+    args = parser.parse_args(argv)
+
+    torch.set_num_threads(args.threads)
+    ckpt = read_checkpoint(args.checkpoint)
+    if args.obs_shape:
+        ckpt.manifest["obs_shape"] = args.obs_shape
+    cfg = policy_cfg_from_manifest(ckpt.manifest)
+    obs_space, action_space = policy_spaces(ckpt, cfg)
+    model = build_policy(ckpt, cfg, obs_space, action_space)
+
+    print(f"📦 Exporting {args.checkpoint} ({args.method}, obs {tuple(obs_space['obs'].shape)} {obs_space['obs'].dtype})")
+    step = InferenceStep(model).eval()
+    if args.method == "onnx":
+        # ONNX 先落盘，再用 onnxruntime 加载做一致性检查和基准测试
+        from src.ort_policy import OrtPolicy
+        out = Path(args.out) if args.out else Path(args.checkpoint).with_suffix(".onnx")
+        export_onnx(step, out, step.manifest({"source": str(args.checkpoint), "method": "onnx"}), args.opset)
+        exported = onnx_step(out, args.threads)
+        make_policy = lambda n: OrtPolicy(out, num_envs=n, intra_op_threads=args.threads)
+    else:
+        exported = export_step(step, args.method, args.optimize)
+        make_policy = lambda n: StepModulePolicy(exported, num_envs=n, manifest=step.manifest())
+
+    worst = check_parity(model, exported, atol=args.atol)
+    print(f"✅ Parity vs eager: " + ", ".join(f"{k} {v:.2e}" for k, v in worst.items()))
+
+    latency = {}
+    for batch_size in sorted({1, args.batch_size}):
+        eager = PolicyRuntime(model, num_envs=batch_size)
+        exported_policy = make_policy(batch_size)
+        obs = example_inputs(step, batch_size)[0].numpy()
+        eager_p50, eager_p90 = benchmark(lambda: eager.act(obs), args.repeats)
+        exp_p50, exp_p90 = benchmark(lambda: exported_policy.act(obs), args.repeats)
+        latency[batch_size] = exp_p50
+        print(f"⏱️  Latency/step (batch {batch_size}, {args.threads} thread(s)): eager {eager_p50:.3f} ms (p90 {eager_p90:.3f}), "
+              f"{args.method} {exp_p50:.3f} ms (p90 {exp_p90:.3f}), speedup x{eager_p50 / exp_p50:.2f}")
+
+    if args.method == "compile":
+        print("[Info] torch.compile artifacts are not serializable; use --method trace to save a .step.pt")
+        return 0
+    if args.method == "onnx":
+        print(f"💾 Saved: {out}")
+        return 0
+    out = Path(args.out) if args.out else Path(args.checkpoint).with_suffix(".step.pt")
+    save_step_module(exported, out, step.manifest({"source": str(args.checkpoint), "method": args.method,
+                                                   "parity": worst, "latency_ms_p50": latency[1]}))
+    print(f"💾 Saved: {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
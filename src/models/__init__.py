@@ -1,3 +1,3 @@
-from src.models.custom_model import register_models
+from src.models.custom_model import register_models, add_custom_model_args
 
-__all__ = ["register_models"]
+__all__ = ["register_models", "add_custom_model_args"]
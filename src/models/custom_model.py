@@ -4,11 +4,11 @@ from torch.nn.utils.rnn import PackedSequence
 import gymnasium as gym
 from sample_factory.model.actor_critic import ActorCritic
 from sample_factory.algo.utils.context import global_model_factory
-from sample_factory.model.encoder import Encoder
 from sample_factory.model.core import ModelCore, ModelCoreRNN
 from sample_factory.model.decoder import MlpDecoder
 from sample_factory.utils.utils import log
 import torch.distributions as torch_d
+from src.models.encoders import CustomVizdoomEncoder, ENCODER_REGISTRY, make_encoder
 
 # === 🚨 关键修复：通用型 Categorical ===
 class CustomCategorical(torch_d.Categorical):
@@ -46,7 +46,7 @@ class CustomCategorical(torch_d.Categorical):
 class CustomActionHead(nn.Module):
     def __init__(self, input_size, action_space):
         super().__init__()
-        self.num_actions = action_space.n
+        self.num_actions = int(action_space.n)
         self.linear = nn.Linear(input_size, self.num_actions)
 
     def forward(self, x):
@@ -55,48 +55,6 @@ class CustomActionHead(nn.Module):
     def get_action_distribution(self, logits):
         return CustomCategorical(logits=logits)
 
-class CustomVizdoomEncoder(Encoder):
-    """手写 CNN Encoder"""
-    def __init__(self, cfg, obs_space):
-        super().__init__(cfg)
-        if isinstance(obs_space, gym.spaces.Dict):
-            self.obs_shape = obs_space["obs"].shape
-        else:
-            self.obs_shape = obs_space.shape
-        input_channels = self.obs_shape[0]
-        # 修改 CNN 架构：更细腻的感受野，捕捉远处的敌人
-        self.cnn = nn.Sequential(
-            # 更细腻的第一层感受野：kernel=3, stride=1，帮助捕捉远处小目标
-            nn.Conv2d(input_channels, 32, kernel_size=3, stride=1, padding=1), 
-            nn.ReLU(),
-            nn.Conv2d(32, 64, kernel_size=4, stride=2, padding=1), 
-            nn.ReLU(),
-            nn.Conv2d(64, 128, kernel_size=3, stride=2, padding=1), 
-            nn.ReLU(),
-            nn.Conv2d(128, 256, kernel_size=3, stride=1, padding=1), 
-            nn.ReLU(),
-            nn.Flatten(),
-        )
-        with torch.no_grad():
-            dummy_input = torch.zeros(1, *self.obs_shape)
-            n_flatten = self.cnn(dummy_input).shape[1]
-        self.fc = nn.Sequential(nn.Linear(n_flatten, 512), nn.ReLU())
-        self.encoder_out_size = 512
-
-    def forward(self, obs_dict):
-        obs = obs_dict["obs"]
-        if obs.dim() == 5:
-            T, B, C, H, W = obs.shape
-            obs = obs.reshape(T * B, C, H, W)
-            features = self.cnn(obs)
-            out = self.fc(features)
-            return out.reshape(T, B, -1)
-        features = self.cnn(obs)
-        return self.fc(features)
-
-    def get_out_size(self) -> int:
-        return self.encoder_out_size
-
 class CustomGRUCore(ModelCoreRNN):
     """手写 GRU Core"""
     def __init__(self, cfg, input_size):
@@ -121,7 +79,7 @@ class CustomVizdoomActorCritic(ActorCritic):
         self.obs_space = obs_space
         self.action_space = action_space
         
-        self.encoder = CustomVizdoomEncoder(cfg, obs_space)
+        self.encoder = make_encoder(cfg, obs_space)
         self.encoders = nn.ModuleList([self.encoder])
         
         if cfg.use_rnn:
@@ -137,8 +95,39 @@ class CustomVizdoomActorCritic(ActorCritic):
         
         self.last_action_logits = None
 
-    def forward_head(self, obs_dict):
-        normalized_obs = self.normalize_obs(obs_dict)
+        # uint8 观察的缩放系数：把 SF 的 (x - obs_subtract_mean) / obs_scale 折叠成 x * gain + bias
+        # legacy 模式额外除以 255，复现旧 Wrapper 输出 float [0,1] 再被 SF 缩放的数值，旧 checkpoint 评估结果不变
+        obs_scale = cfg.obs_scale if 'obs_scale' in cfg else 1.0
+        obs_mean = cfg.obs_subtract_mean if 'obs_subtract_mean' in cfg else 0.0
+        legacy = cfg.doom_legacy_obs_scale if 'doom_legacy_obs_scale' in cfg else False
+        self.obs_gain = (1.0 / 255.0 if legacy else 1.0) / obs_scale
+        self.obs_bias = -obs_mean / obs_scale
+
+    def _normalize_uint8_obs(self, obs_dict):
+        """uint8 -> float 的转换和缩放在设备上一次完成，随后只做 running mean/std 归一化"""
+        with torch.no_grad():
+            x = torch.mul(obs_dict["obs"], self.obs_gain)
+            if self.obs_bias != 0.0:
+                x.add_(self.obs_bias)
+            normalized = dict(obs_dict)
+            normalized["obs"] = x
+            running_mean_std = getattr(self.obs_normalizer, "running_mean_std", None)
+            if running_mean_std is not None:
+                running_mean_std(normalized)
+        return normalized
+
+    def normalize_obs(self, obs_dict):
+        """SF 的 learner / inference worker 在 forward_head 之前调用这里；uint8 观察走融合路径"""
+        if obs_dict["obs"].dtype == torch.uint8:
+            return self._normalize_uint8_obs(obs_dict)
+        return super().normalize_obs(obs_dict)
+
+    def type_for_input_tensor(self, input_tensor_name):
+        """SF 的 prepare_and_normalize_obs 按这里的类型转换输入；uint8 模式下保持 uint8 交给 normalize_obs"""
+        return self.encoder.type_for_input_tensor(input_tensor_name)
+
+    def forward_head(self, normalized_obs):
+        """与 SF 的约定一致，输入是 normalize_obs 的输出；SF 之外的调用方需要先自己调用 normalize_obs"""
         return self.encoder(normalized_obs)
 
     def forward_core(self, head_output, rnn_states):
@@ -177,8 +166,8 @@ class CustomVizdoomActorCritic(ActorCritic):
         
         return result
 
-    def forward(self, obs_dict, rnn_states, values_only=False):
-        x = self.forward_head(obs_dict)
+    def forward(self, normalized_obs, rnn_states, values_only=False):
+        x = self.forward_head(normalized_obs)
         x, new_rnn_states = self.forward_core(x, rnn_states)
         result = self.forward_tail(x, values_only=values_only, sample_actions=not values_only)
         result["new_rnn_states"] = new_rnn_states
@@ -192,6 +181,24 @@ class CustomVizdoomActorCritic(ActorCritic):
             action_logits = self.last_action_logits
         return self.action_heads.get_action_distribution(action_logits)
 
+def add_custom_model_args(parser):
+    """custom_vizdoom_model 特有的命令行参数"""
+    from sample_factory.utils.utils import str2bool
+    p = parser
+    p.add_argument(
+        "--encoder_variant",
+        default="legacy",
+        choices=sorted(ENCODER_REGISTRY),
+        type=str,
+        help="Encoder architecture from src/models/encoders.py (python -m src.models.encoders compares them)",
+    )
+    p.add_argument(
+        "--encoder_frame_cache",
+        default=False,
+        type=str2bool,
+        help="Run the conv trunk per frame and reuse features of already-seen stacked frames (pooled encoder variants only)",
+    )
+
 def make_vizdoom_actor_critic(cfg, obs_space, action_space):
     cfg.rnn_type = 'gru'
     return CustomVizdoomActorCritic(cfg, obs_space, action_space)
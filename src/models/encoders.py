@@ -0,0 +1,333 @@
+"""
+Encoder 家族：按 cfg.encoder_variant 选择卷积主干。
+
+原始的 CustomVizdoomEncoder（"legacy"）在 3x96x128 输入上最后得到 256x24x32 = 196,608 维特征，
+后面的 nn.Linear(n_flatten, 512) 一层就有约 1 亿参数，主导了 checkpoint 大小、learner 显存和 CPU 推理延迟。
+这里提供几种更轻的变体，都保留 self.cnn / self.fc 两个子模块（state_dict 键名不变），
+并共享单帧特征缓存模式（encoder_frame_cache）。
+
+对比各变体的参数量、FLOPs 和 CPU 延迟：
+    python -m src.models.encoders --obs-shape 3 96 128
+"""
+import argparse
+import json
+import statistics
+import time
+
+import gymnasium as gym
+import torch
+from torch import nn
+from sample_factory.model.encoder import Encoder
+
+ENCODER_REGISTRY = {}
+
+
+def register_encoder(name):
+    """把 Encoder 类注册到 ENCODER_REGISTRY，供 cfg.encoder_variant 选择"""
+    def decorator(cls):
+        ENCODER_REGISTRY[name] = cls
+        cls.variant_name = name
+        return cls
+    return decorator
+
+
+def make_encoder(cfg, obs_space):
+    variant = cfg.encoder_variant if 'encoder_variant' in cfg else 'legacy'
+    if variant not in ENCODER_REGISTRY:
+        raise ValueError(f"Unknown encoder_variant '{variant}', available: {sorted(ENCODER_REGISTRY)}")
+    return ENCODER_REGISTRY[variant](cfg, obs_space)
+
+
+class FrameStackedConvEncoder(Encoder):
+    """
+    卷积主干 self.cnn（以 Flatten 结尾）+ 全连接 self.fc 的通用骨架，子类只需实现 build_trunk。
+
+    encoder_frame_cache=True 且 doom_frame_stack=k>1 时，卷积主干按单帧运行（输入 C/k 通道），
+    k 帧的特征拼接后再进 fc：
+    - 推理时缓存上一步各帧的特征，新的叠加观察若只是上一步左移一帧，就只编码最新一帧（卷积 FLOPs 约为 1/k）
+    - 训练时按行去重：Sample Factory 的 minibatch 是按轨迹连续排列的 (N, k*c, H, W)，
+      某一行若只是上一行左移一帧，就只编码它的最新一帧；episode 边界和轨迹开头的行完整编码
+    该模式下 fc 输入是单帧特征的 k 倍，只允许末端带池化的主干（pooled_trunk=True）。
+    """
+    fc_size = 512
+    # 主干末端是否池化到很小的特征；不池化的主干开启帧缓存会让 fc 输入再放大 k 倍
+    pooled_trunk = False
+
+    def __init__(self, cfg, obs_space):
+        super().__init__(cfg)
+        if isinstance(obs_space, gym.spaces.Dict):
+            self.obs_shape = obs_space["obs"].shape
+        else:
+            self.obs_shape = obs_space.shape
+        input_channels = self.obs_shape[0]
+        self.obs_uint8 = bool(cfg.doom_obs_uint8 if 'doom_obs_uint8' in cfg else False)
+
+        self.frame_stack = cfg.doom_frame_stack if 'doom_frame_stack' in cfg else 1
+        self.use_frame_cache = bool(cfg.encoder_frame_cache if 'encoder_frame_cache' in cfg else False) and self.frame_stack > 1
+        if self.use_frame_cache:
+            if not self.pooled_trunk:
+                raise ValueError(
+                    f"encoder_frame_cache needs a pooled trunk (spatial_pool / global_pool / depthwise); "
+                    f"'{self.variant_name}' would multiply the fc input by doom_frame_stack={self.frame_stack}"
+                )
+            assert input_channels % self.frame_stack == 0, "obs channels must be divisible by doom_frame_stack"
+            input_channels //= self.frame_stack
+        self.frame_channels = input_channels
+        self._frame_cache = None
+
+        self.cnn = self.build_trunk(input_channels)
+        with torch.no_grad():
+            dummy_input = torch.zeros(1, input_channels, *self.obs_shape[1:])
+            n_flatten = self.cnn(dummy_input).shape[1]
+        if self.use_frame_cache:
+            n_flatten *= self.frame_stack
+        self.fc = nn.Sequential(nn.Linear(n_flatten, self.fc_size), nn.ReLU())
+        self.encoder_out_size = self.fc_size
+
+    def build_trunk(self, in_channels):
+        raise NotImplementedError
+
+    def reset_frame_cache(self):
+        self._frame_cache = None
+
+    def _frame_features(self, obs):
+        """(B, k*c, H, W) -> (B, k, F)，每帧单独过卷积主干"""
+        B, _, H, W = obs.shape
+        frames = obs.reshape(B * self.frame_stack, self.frame_channels, H, W)
+        return self.cnn(frames).reshape(B, self.frame_stack, -1)
+
+    def _forward_cached(self, obs):
+        c = self.frame_channels
+        cache = self._frame_cache
+        if cache is None or cache[0].shape[0] != obs.shape[0]:
+            feats = self._frame_features(obs)
+        else:
+            prev_tail, prev_feats = cache
+            # 新观察的前 k-1 帧与上一步的后 k-1 帧一致，说明是同一条轨迹的下一步
+            continuing = (obs[:, :-c] == prev_tail).flatten(1).all(1)
+            newest = self.cnn(obs[:, -c:])
+            feats = torch.cat([prev_feats[:, 1:], newest.unsqueeze(1)], dim=1)
+            if not bool(continuing.all()):
+                # episode 重置或换了环境的行，完整编码
+                idx = (~continuing).nonzero().squeeze(1)
+                feats[idx] = self._frame_features(obs[idx])
+        self._frame_cache = (obs[:, c:].clone(), feats)
+        return feats
+
+    def _dedup_features(self, obs):
+        """
+        (N, k*c, H, W)，行按时间顺序排列 -> (N, k, F)。
+        把所有行的帧排成一条不重复的帧流：与上一行重叠的行只贡献最新一帧，其余行贡献全部 k 帧，
+        第 i 行的 k 帧就是帧流中以该行结尾的 k 个位置，只对帧流做一次批量卷积。
+        """
+        N, _, H, W = obs.shape
+        c, k = self.frame_channels, self.frame_stack
+        continuing = torch.zeros(N, dtype=torch.bool, device=obs.device)
+        if N > 1:
+            continuing[1:] = (obs[1:, :-c] == obs[:-1, c:]).flatten(1).all(1)
+        counts = torch.where(continuing, 1, k)
+        end = torch.cumsum(counts, 0)
+        # 帧流中每个位置来自哪一行、该行的第几帧
+        rows = torch.repeat_interleave(torch.arange(N, device=obs.device), counts)
+        pos = torch.arange(rows.shape[0], device=obs.device)
+        frame_idx = pos - (end - counts)[rows] + (k - counts)[rows]
+        stream = obs.reshape(N, k, c, H, W)[rows, frame_idx]
+        feats = self.cnn(stream)
+        window = end.unsqueeze(1) - k + torch.arange(k, device=obs.device)
+        return feats[window]
+
+    def forward(self, obs_dict):
+        obs = obs_dict["obs"]
+        if self.use_frame_cache:
+            if obs.dim() == 5:
+                # (T, B, ...)：转成 (B, T, ...) 使每个环境的时间步相邻，再按行去重
+                T, B = obs.shape[:2]
+                rows = obs.transpose(0, 1).reshape(B * T, *obs.shape[2:])
+                feats = self._dedup_features(rows).reshape(B, T, -1).transpose(0, 1)
+                return self.fc(feats.reshape(T * B, -1)).reshape(T, B, -1)
+            if not self.training:
+                feats = self._forward_cached(obs)
+            else:
+                feats = self._dedup_features(obs)
+            return self.fc(feats.reshape(obs.shape[0], -1))
+
+        if obs.dim() == 5:
+            T, B, C, H, W = obs.shape
+            obs = obs.reshape(T * B, C, H, W)
+            features = self.cnn(obs)
+            out = self.fc(features)
+            return out.reshape(T, B, -1)
+        features = self.cnn(obs)
+        return self.fc(features)
+
+    def type_for_input_tensor(self, input_tensor_name):
+        if input_tensor_name == "obs" and self.obs_uint8:
+            return torch.uint8
+        return torch.float32
+
+    def get_out_size(self) -> int:
+        return self.encoder_out_size
+
+
+@register_encoder("legacy")
+class CustomVizdoomEncoder(FrameStackedConvEncoder):
+    """手写 CNN Encoder（原始结构，兼容已有 checkpoint）"""
+    def build_trunk(self, in_channels):
+        # 修改 CNN 架构：更细腻的感受野，捕捉远处的敌人
+        return nn.Sequential(
+            # 更细腻的第一层感受野：kernel=3, stride=1，帮助捕捉远处小目标
+            nn.Conv2d(in_channels, 32, kernel_size=3, stride=1, padding=1),
+            nn.ReLU(),
+            nn.Conv2d(32, 64, kernel_size=4, stride=2, padding=1),
+            nn.ReLU(),
+            nn.Conv2d(64, 128, kernel_size=3, stride=2, padding=1),
+            nn.ReLU(),
+            nn.Conv2d(128, 256, kernel_size=3, stride=1, padding=1),
+            nn.ReLU(),
+            nn.Flatten(),
+        )
+
+
+@register_encoder("strided")
+class StridedStemEncoder(FrameStackedConvEncoder):
+    """大步长 stem（Nature-DQN 式），一开始就把分辨率降下来，卷积和 fc 都便宜"""
+    def build_trunk(self, in_channels):
+        return nn.Sequential(
+            nn.Conv2d(in_channels, 32, kernel_size=8, stride=4),
+            nn.ReLU(),
+            nn.Conv2d(32, 64, kernel_size=4, stride=2),
+            nn.ReLU(),
+            nn.Conv2d(64, 64, kernel_size=3, stride=1),
+            nn.ReLU(),
+            nn.Flatten(),
+        )
+
+
+@register_encoder("spatial_pool")
+class SpatialPoolEncoder(CustomVizdoomEncoder):
+    """保留原始主干的感受野，末端自适应平均池化到 4x4，fc 参数量缩小约 50 倍"""
+    pool_size = (4, 4)
+    pooled_trunk = True
+
+    def build_trunk(self, in_channels):
+        trunk = super().build_trunk(in_channels)
+        # 在 Flatten 之前插入池化
+        return nn.Sequential(*list(trunk)[:-1], nn.AdaptiveAvgPool2d(self.pool_size), nn.Flatten())
+
+
+@register_encoder("global_pool")
+class GlobalPoolEncoder(SpatialPoolEncoder):
+    """原始主干 + 全局平均池化，fc 只剩 256x512"""
+    pool_size = (1, 1)
+
+
+def _dw_separable(in_channels, out_channels, stride):
+    return [
+        nn.Conv2d(in_channels, in_channels, kernel_size=3, stride=stride, padding=1, groups=in_channels),
+        nn.ReLU(),
+        nn.Conv2d(in_channels, out_channels, kernel_size=1),
+        nn.ReLU(),
+    ]
+
+
+@register_encoder("depthwise")
+class DepthwiseEncoder(FrameStackedConvEncoder):
+    """MobileNet 式深度可分离卷积 + 全局池化，CPU 延迟最低"""
+    pooled_trunk = True
+    def build_trunk(self, in_channels):
+        return nn.Sequential(
+            nn.Conv2d(in_channels, 32, kernel_size=3, stride=2, padding=1),
+            nn.ReLU(),
+            *_dw_separable(32, 64, stride=2),
+            *_dw_separable(64, 128, stride=2),
+            *_dw_separable(128, 256, stride=1),
+            nn.AdaptiveAvgPool2d((1, 1)),
+            nn.Flatten(),
+        )
+
+
+def count_flops(module, example_input):
+    """用 forward hook 统计 Conv2d / Linear 的乘加次数，返回 FLOPs（= 2 * MACs）"""
+    macs = [0]
+
+    def conv_hook(m, inputs, output):
+        kh, kw = m.kernel_size
+        macs[0] += output.numel() * (m.in_channels // m.groups) * kh * kw
+
+    def linear_hook(m, inputs, output):
+        macs[0] += output.numel() * m.in_features
+
+    handles = []
+    for m in module.modules():
+        if isinstance(m, nn.Conv2d):
+            handles.append(m.register_forward_hook(conv_hook))
+        elif isinstance(m, nn.Linear):
+            handles.append(m.register_forward_hook(linear_hook))
+    try:
+        with torch.no_grad():
+            module(example_input)
+    finally:
+        for h in handles:
+            h.remove()
+    return 2 * macs[0]
+
+
+def encoder_report(variant, obs_shape, frame_stack=1, frame_cache=False, batch_size=1, repeats=50, warmup=5):
+    """构造一个 encoder 并测量参数量、FLOPs（单样本）和 CPU 延迟（毫秒，中位数/p90）"""
+    cfg = argparse.Namespace(encoder_variant=variant, doom_frame_stack=frame_stack, encoder_frame_cache=frame_cache)
+    obs_shape = (obs_shape[0] * frame_stack,) + tuple(obs_shape[1:])
+    obs_space = gym.spaces.Dict({"obs": gym.spaces.Box(0, 1, obs_shape)})
+    encoder = make_encoder(cfg, obs_space).eval()
+
+    params = sum(p.numel() for p in encoder.parameters())
+    fc_params = sum(p.numel() for p in encoder.fc.parameters())
+    flops = count_flops(encoder, {"obs": torch.zeros(1, *obs_shape)})
+
+    x = {"obs": torch.rand(batch_size, *obs_shape)}
+    timings = []
+    with torch.inference_mode():
+        for i in range(warmup + repeats):
+            start = time.perf_counter()
+            encoder(x)
+            if i >= warmup:
+                timings.append((time.perf_counter() - start) * 1000.0)
+    timings.sort()
+    return {
+        "variant": variant,
+        "params": params,
+        "fc_params": fc_params,
+        "flops": flops,
+        "batch_size": batch_size,
+        "latency_ms_p50": statistics.median(timings),
+        "latency_ms_p90": timings[int(0.9 * (len(timings) - 1))],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare encoder variants: params, FLOPs and CPU latency")
+    parser.add_argument("--obs-shape", type=int, nargs=3, default=[3, 96, 128], help="Single-frame C H W")
+    parser.add_argument("--variants", nargs="*", default=None, help="Subset of variants (default: all)")
+    parser.add_argument("--frame-stack", type=int, default=1)
+    parser.add_argument("--frame-cache", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads")
+    parser.add_argument("--json", action="store_true", help="Print JSON lines instead of a table")
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    if not args.json:
+        print(f"{'variant':<14}{'params':>14}{'fc params':>14}{'GFLOPs':>10}{'p50 ms':>10}{'p90 ms':>10}")
+    for variant in args.variants or list(ENCODER_REGISTRY):
+        r = encoder_report(variant, args.obs_shape, args.frame_stack, args.frame_cache, args.batch_size, args.repeats)
+        if args.json:
+            print(json.dumps(r))
+        else:
+            print(f"{variant:<14}{r['params']:>14,}{r['fc_params']:>14,}{r['flops'] / 1e9:>10.3f}"
+                  f"{r['latency_ms_p50']:>10.2f}{r['latency_ms_p90']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
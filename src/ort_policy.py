@@ -0,0 +1,118 @@
+"""
+ONNX Runtime 上的逐步推理（CPU execution provider），不依赖 torch。
+
+图由 export_policy.py --method onnx 导出：
+    (obs (B, C, H, W), rnn_states (B, rnn_size)) -> (logits, values, new_rnn_states)
+隐状态是显式的输入/输出，由 OrtPolicy 在两次调用之间保存。结构信息（obs_shape / obs_dtype /
+rnn_size / num_actions）存在模型的 metadata "manifest" 里。
+
+OrtPolicy 的接口与 PolicyRuntime 相同：act(obs) / reset(env_ids) / seed(seed) / last_logits / last_values。
+输入输出都通过 IOBinding 绑定到预分配的 numpy 缓冲区，每步不再分配内存。
+
+用法：
+    policy = OrtPolicy("checkpoint_xxx.onnx", num_envs=1, intra_op_threads=1)
+    action = policy.act(obs)
+"""
+import json
+
+import numpy as np
+
+MANIFEST_KEY = "manifest"
+INPUT_NAMES = ("obs", "rnn_states")
+OUTPUT_NAMES = ("logits", "values", "new_rnn_states")
+
+
+def make_session(path, intra_op_threads=1, inter_op_threads=1):
+    """CPU execution provider 的 InferenceSession，线程数为 0 时交给 ORT 自己决定"""
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise ImportError("onnxruntime is not installed: pip install onnxruntime") from e
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(str(path), sess_options=options, providers=["CPUExecutionProvider"])
+
+
+def read_manifest(session):
+    meta = session.get_modelmeta().custom_metadata_map
+    if MANIFEST_KEY not in meta:
+        raise ValueError("ONNX model has no manifest metadata; re-export it with src/export_policy.py --method onnx")
+    return json.loads(meta[MANIFEST_KEY])
+
+
+class OrtPolicy:
+    """
+    num_envs 个 agent 共用一个 session，隐状态为 (num_envs, rnn_size)。
+    返回的动作数组是内部缓冲区，下一次 act 时会被覆盖。
+    """
+    def __init__(self, path, num_envs=1, intra_op_threads=1, inter_op_threads=1, deterministic=False, seed=None):
+        self.session = make_session(path, intra_op_threads, inter_op_threads)
+        self.manifest = read_manifest(self.session)
+        self.num_envs = num_envs
+        self.deterministic = deterministic
+        self._rng = np.random.default_rng(seed)
+
+        m = self.manifest
+        obs_dtype = np.uint8 if m["obs_dtype"] == "uint8" else np.float32
+        self._obs = np.zeros((num_envs,) + tuple(m["obs_shape"]), dtype=obs_dtype)
+        self._rnn = np.zeros((num_envs, m["rnn_size"]), dtype=np.float32)
+        self._new_rnn = np.zeros_like(self._rnn)
+        self._logits = np.zeros((num_envs, m["num_actions"]), dtype=np.float32)
+        self._values = np.zeros(num_envs, dtype=np.float32)
+        self._noise = np.empty_like(self._logits)
+        self._actions = np.zeros(num_envs, dtype=np.intp)
+
+        # 缓冲区按指针绑定，ORT 直接读写这些 numpy 数组
+        self._binding = self.session.io_binding()
+        for name, buf in zip(INPUT_NAMES, (self._obs, self._rnn)):
+            self._binding.bind_input(name, "cpu", 0, buf.dtype, list(buf.shape), buf.ctypes.data)
+        for name, buf in zip(OUTPUT_NAMES, (self._logits, self._values, self._new_rnn)):
+            self._binding.bind_output(name, "cpu", 0, buf.dtype, list(buf.shape), buf.ctypes.data)
+
+    def seed(self, seed):
+        """重设采样用的随机数发生器"""
+        self._rng = np.random.default_rng(seed)
+
+    def reset(self, env_ids=None):
+        """清零隐状态：env_ids 为 None 时全部，否则只清对应的行（bool 掩码或下标）"""
+        if env_ids is None:
+            self._rnn.fill(0.0)
+        else:
+            self._rnn[np.asarray(env_ids)] = 0.0
+
+    @property
+    def last_logits(self):
+        return self._logits
+
+    @property
+    def last_values(self):
+        return self._values
+
+    @property
+    def rnn_states(self):
+        return self._rnn
+
+    def _sample(self):
+        if self.deterministic:
+            np.argmax(self._logits, axis=1, out=self._actions)
+        else:
+            # Gumbel-max：argmax(logits - log(-log(U))) 与按 softmax 采样同分布
+            noise = self._noise
+            self._rng.random(out=noise, dtype=np.float32)
+            np.log(noise, out=noise)
+            np.negative(noise, out=noise)
+            np.log(noise, out=noise)
+            np.subtract(self._logits, noise, out=noise)
+            np.argmax(noise, axis=1, out=self._actions)
+
+    def act(self, obs):
+        single = np.ndim(obs) == self._obs.ndim - 1
+        self._obs[...] = obs
+        self.session.run_with_iobinding(self._binding)
+        # 输出的隐状态写在另一块缓冲区，输入输出不共用内存
+        self._rnn[...] = self._new_rnn
+        self._sample()
+        return int(self._actions[0]) if single else self._actions
@@ -0,0 +1,179 @@
+"""
+逐步推理的运行时：包装 CustomVizdoomActorCritic，给实时对局 / 评估用。
+
+模型的 forward 每步都会新建 dict、Categorical 分布对象和中间张量，
+单个 agent 时 Python 开销比卷积本身还显眼。PolicyRuntime 在构造时就分配好
+输入 / 隐状态 / 输出缓冲区，冻结观察归一化的统计量，每步只做：
+    拷入观察 -> 缩放+归一化(原地) -> encoder -> GRU 一步 -> decoder -> 两个 head -> Gumbel-max 采样(原地)
+
+用法：
+    runtime = PolicyRuntime(model, num_envs=1, num_threads=1)
+    runtime.reset()
+    action = runtime.act(obs)          # num_envs=1 时返回 int
+    runtime.last_logits, runtime.last_values
+"""
+import numpy as np
+import torch
+
+
+def _input_shape_dtype(model):
+    space = model.obs_space
+    if hasattr(space, "spaces"):
+        space = space["obs"]
+    dtype = torch.uint8 if np.dtype(space.dtype) == np.uint8 else torch.float32
+    return tuple(space.shape), dtype
+
+
+def fold_obs_normalizer(model, obs_dtype, device="cpu"):
+    """
+    把 SF 的 (x - obs_subtract_mean) / obs_scale 和冻结的 running mean/std 折叠成常量。
+    返回 (gain, bias, mean, inv_std, clip)：x = clamp((obs * gain + bias - mean) * inv_std, -clip, clip)，
+    模型没有 running mean/std 时后三项为 None。
+    """
+    cfg = model.cfg
+    if obs_dtype == torch.uint8:
+        gain, bias = model.obs_gain, model.obs_bias
+    else:
+        obs_scale = cfg.obs_scale if "obs_scale" in cfg else 1.0
+        obs_mean = cfg.obs_subtract_mean if "obs_subtract_mean" in cfg else 0.0
+        gain, bias = 1.0 / obs_scale, -obs_mean / obs_scale
+
+    mean = inv_std = clip = None
+    rms = getattr(model.obs_normalizer, "running_mean_std", None)
+    if rms is not None:
+        m = rms.running_mean_std["obs"]
+        eps = getattr(m, "eps", getattr(m, "epsilon", 1e-5))
+        mean = m.running_mean.float().to(device)
+        inv_std = torch.rsqrt(m.running_var.float() + eps).to(device)
+        clip = float(getattr(m, "clip", 5.0))
+        if getattr(m, "norm_only", False):
+            mean.zero_()
+    return gain, bias, mean, inv_std, clip
+
+
+class PolicyRuntime:
+    """
+    num_envs 个 agent 共用一个模型，隐状态为 (num_envs, rnn_size)。
+
+    act(obs) 接受 (num_envs, C, H, W) 或单个 agent 的 (C, H, W) 观察；
+    返回的动作数组是内部缓冲区的视图，下一次 act 时会被覆盖。
+    deterministic=True 时取 argmax，否则按 softmax(logits) 采样。
+    num_threads / flush_denormal 修改的是整个进程的 torch 设置，默认都不动；
+    flush_denormal=True 把非规格化浮点数按 0 处理（CPU 上 GRU 隐状态衰减到极小值时避免变慢）。
+    """
+    def __init__(self, model, num_envs=1, device="cpu", num_threads=None, deterministic=False, seed=None,
+                 flush_denormal=False):
+        self.model = model.eval()
+        cfg = model.cfg
+        self.use_rnn = bool(cfg.use_rnn)
+        self._setup(num_envs, device, num_threads, deterministic, seed, flush_denormal)
+
+        obs_shape, obs_dtype = _input_shape_dtype(model)
+        self._allocate(obs_shape, obs_dtype, model.get_rnn_size(), model.action_heads.num_actions)
+        with torch.inference_mode():
+            self._x = torch.zeros((num_envs,) + obs_shape, dtype=torch.float32, device=self.device)
+            self._obs_dict = {"obs": self._x}
+            self._gain, self._bias, self._mean, self._inv_std, self._clip = fold_obs_normalizer(model, obs_dtype, self.device)
+
+    def _setup(self, num_envs, device, num_threads, deterministic, seed, flush_denormal=False):
+        self.device = torch.device(device)
+        self.num_envs = num_envs
+        self.deterministic = deterministic
+        if num_threads:
+            torch.set_num_threads(num_threads)
+            try:
+                # 只能在第一次并行计算之前设置，之后设置会抛 RuntimeError
+                torch.set_num_interop_threads(1)
+            except RuntimeError:
+                pass
+        if flush_denormal:
+            torch.set_flush_denormal(True)
+        self._generator = torch.Generator(device=self.device)
+        if seed is not None:
+            self.seed(seed)
+
+    def _allocate(self, obs_shape, obs_dtype, rnn_size, num_actions):
+        num_envs = self.num_envs
+        with torch.inference_mode():
+            self._obs = torch.zeros((num_envs,) + tuple(obs_shape), dtype=obs_dtype, device=self.device)
+            self._rnn = torch.zeros(num_envs, rnn_size, device=self.device)
+            self._logits = torch.zeros(num_envs, num_actions, device=self.device)
+            self._values = torch.zeros(num_envs, device=self.device)
+            self._noise = torch.empty(num_envs, num_actions, device=self.device)
+            self._best = torch.empty(num_envs, device=self.device)
+            self._actions = torch.zeros(num_envs, dtype=torch.int64, device=self.device)
+        self._actions_np = self._actions.numpy() if self.device.type == "cpu" else None
+
+    def seed(self, seed):
+        """重设采样用的随机数发生器（只影响本 runtime，不动全局 RNG）"""
+        self._generator.manual_seed(seed)
+
+    def reset(self, env_ids=None):
+        """清零隐状态：env_ids 为 None 时全部，否则只清对应的行（bool 掩码或下标）"""
+        with torch.inference_mode():
+            if env_ids is None:
+                self._rnn.zero_()
+                reset_cache = getattr(getattr(self, "model", None), "encoder", None)
+                reset_cache = getattr(reset_cache, "reset_frame_cache", None)
+                if reset_cache is not None:
+                    reset_cache()
+            else:
+                env_ids = np.asarray(env_ids)
+                if env_ids.dtype == bool:
+                    env_ids = np.flatnonzero(env_ids)
+                if len(env_ids):
+                    self._rnn[torch.from_numpy(env_ids).to(self.device)] = 0.0
+
+    @property
+    def last_logits(self):
+        return self._logits
+
+    @property
+    def last_values(self):
+        return self._values
+
+    @property
+    def rnn_states(self):
+        return self._rnn
+
+    def _step(self):
+        x = self._x
+        torch.mul(self._obs, self._gain, out=x)
+        if self._bias != 0.0:
+            x.add_(self._bias)
+        if self._mean is not None:
+            x.sub_(self._mean).mul_(self._inv_std).clamp_(-self._clip, self._clip)
+
+        model = self.model
+        features = model.encoder(self._obs_dict)
+        if self.use_rnn:
+            out, h = model.core(features.unsqueeze(0), self._rnn)
+            core_out = out.squeeze(0)
+            self._rnn.copy_(h)
+        else:
+            core_out = features
+        decoder_out = model.decoder(core_out)
+        self._logits.copy_(model.action_heads(decoder_out))
+        self._values.copy_(model.value_head(decoder_out).squeeze(-1))
+        self._sample()
+
+    def _sample(self):
+        if self.deterministic:
+            torch.max(self._logits, 1, out=(self._best, self._actions))
+        else:
+            # Gumbel-max：argmax(logits - log(-log(U))) 与按 softmax 采样同分布，全程原地
+            noise = self._noise
+            noise.uniform_(generator=self._generator).log_().neg_().log_().neg_().add_(self._logits)
+            torch.max(noise, 1, out=(self._best, self._actions))
+
+    def act(self, obs):
+        single = np.ndim(obs) == len(self._obs.shape) - 1
+        with torch.inference_mode():
+            src = torch.as_tensor(obs)
+            self._obs.copy_(src.view(self._obs.shape) if single else src)
+            self._step()
+        if self._actions_np is None:
+            actions = self._actions.cpu().numpy()
+        else:
+            actions = self._actions_np
+        return int(actions[0]) if single else actions
@@ -0,0 +1,263 @@
+"""
+训练中的性能采样窗口（train_custom.py --profile_iters M）。
+
+learner 先正常跑 --profile_warmup N 次训练迭代（Learner.train 的调用次数），之后的 M 次迭代用
+torch.profiler 记录（CPU 算子，可选 CUDA / 内存 / Python 调用栈），结束后写出 trace 并继续训练：
+    <train_dir>/<experiment>/profile/
+        learner.<时间戳>.pt.trace.json   Chrome trace（chrome://tracing、Perfetto、TensorBoard profiler 插件都能打开）
+        learner_ops.txt                   按 self CPU 时间排序的算子表（开启内存时附带按内存排序的表）
+        learner_modules.txt               按模块汇总的 forward 耗时（actor_critic 的每个子模块一个 record_function 标签，
+                                          例如 encoder.fc、core.gru）
+        learner_stacks.txt                --profile_stack 时的调用栈（flamegraph.pl 的输入格式）
+        worker_<pid>.speedscope.json      --profile_workers 时 py-spy 对各 worker 进程的采样（speedscope.app 打开）
+
+learner 跑在 Sample Factory 的子进程里，配置通过环境变量 PROFILE_ENV（JSON）传过去：
+train_custom.py 在模块顶层调用 install_learner_profiler()，spawn 出来的子进程重新导入主模块时也会执行，
+fork 出来的子进程则直接继承补丁。没有设置环境变量时什么都不做。
+"""
+import json
+import os
+import shutil
+import signal
+import subprocess
+import time
+from pathlib import Path
+
+import torch
+from sample_factory.utils.utils import str2bool
+
+PROFILE_ENV = "DOOM_TRAIN_PROFILE"
+# py-spy 在窗口结束时收到 SIGINT 后写出结果，等待的上限（秒）
+PY_SPY_STOP_TIMEOUT = 30
+
+
+def add_profiling_args(parser):
+    """train_custom.py 的性能采样参数"""
+    p = parser
+    p.add_argument("--profile_iters", default=0, type=int,
+                   help="Record this many learner iterations with torch.profiler (0 = no profiling)")
+    p.add_argument("--profile_warmup", default=20, type=int,
+                   help="Learner iterations to run before the profiling window starts")
+    p.add_argument("--profile_memory", default=False, type=str2bool, help="Also record tensor allocations")
+    p.add_argument("--profile_stack", default=False, type=str2bool,
+                   help="Record Python stacks (bigger traces, more overhead) and write learner_stacks.txt")
+    p.add_argument("--profile_workers", default=False, type=str2bool,
+                   help="Sample the rollout/inference worker processes with py-spy during the window")
+    p.add_argument("--profile_dir", default=None, type=str,
+                   help="Output directory (default: <train_dir>/<experiment>/profile)")
+
+
+def export_profile_env(cfg):
+    """把 cfg 里的采样设置写进环境变量，之后启动的子进程都能读到；未开启时返回 None"""
+    if cfg.profile_iters <= 0:
+        os.environ.pop(PROFILE_ENV, None)
+        return None
+    out_dir = cfg.profile_dir or os.path.join(cfg.train_dir, cfg.experiment, "profile")
+    settings = {
+        "warmup": cfg.profile_warmup,
+        "iters": cfg.profile_iters,
+        "memory": cfg.profile_memory,
+        "stack": cfg.profile_stack,
+        "workers": cfg.profile_workers,
+        "out_dir": os.path.abspath(out_dir),
+        "main_pid": os.getpid(),
+    }
+    os.environ[PROFILE_ENV] = json.dumps(settings)
+    print(f"[Info] Profiling learner iterations {settings['warmup']}..{settings['warmup'] + settings['iters']} "
+          f"into {settings['out_dir']}")
+    return settings
+
+
+def _child_pids(parent_pid):
+    """parent_pid 的直接子进程（读 /proc，仅 Linux）"""
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                # comm 可能含空格，ppid 在最后一个 ')' 之后的第二个字段
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == parent_pid:
+            pids.append(int(entry))
+    return pids
+
+
+class WorkerSampler:
+    """窗口期间用 py-spy 采样训练主进程的其它子进程（rollout / inference worker）"""
+    def __init__(self, main_pid, out_dir):
+        self.main_pid = main_pid
+        self.out_dir = Path(out_dir)
+        self.procs = []
+
+    def start(self):
+        py_spy = shutil.which("py-spy")
+        if py_spy is None:
+            print("[Warning] py-spy not found (pip install py-spy); skipping worker sampling")
+            return
+        pids = [pid for pid in _child_pids(self.main_pid) if pid != os.getpid()]
+        if self.main_pid == os.getpid() or not pids:
+            print("[Warning] No worker processes to sample (serial mode?); skipping worker sampling")
+            return
+        for pid in pids:
+            out = self.out_dir / f"worker_{pid}.speedscope.json"
+            cmd = [py_spy, "record", "--pid", str(pid), "--rate", "100", "--format", "speedscope",
+                   "--output", str(out), "--nonblocking"]
+            self.procs.append(subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE))
+        print(f"[Info] Sampling {len(pids)} worker process(es) with py-spy")
+
+    def stop(self):
+        for proc in self.procs:
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGINT)
+        for proc in self.procs:
+            try:
+                _, err = proc.communicate(timeout=PY_SPY_STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                _, err = proc.communicate()
+            if proc.returncode not in (0, -signal.SIGINT) and err:
+                # 常见原因是没有 ptrace 权限（容器里需要 --cap-add SYS_PTRACE）
+                print(f"[Warning] py-spy exited with {proc.returncode}: {err.decode(errors='replace').strip()}")
+        self.procs = []
+
+
+class ModuleLabels:
+    """给模型的每个子模块的 forward 套上同名的 record_function，trace 里能直接看到 encoder.fc / core.gru"""
+    def __init__(self, model):
+        self.names = set()
+        self.handles = []
+        self._open = []
+        for name, module in model.named_modules():
+            if not name:
+                continue
+            self.names.add(name)
+            self.handles.append(module.register_forward_pre_hook(self._enter(name, torch.profiler.record_function)))
+            self.handles.append(module.register_forward_hook(self._exit))
+
+    def _enter(self, name, record_function):
+        def hook(module, inputs):
+            rf = record_function(name)
+            rf.__enter__()
+            self._open.append(rf)
+        return hook
+
+    def _exit(self, module, inputs, output):
+        self._open.pop().__exit__(None, None, None)
+
+    def remove(self):
+        for h in self.handles:
+            h.remove()
+        self.handles = []
+
+
+class LearnerProfiler:
+    """在第 warmup 次 Learner.train 时开始记录，记满 iters 次后写出结果，之后不再有任何开销"""
+    def __init__(self, settings):
+        self.settings = settings
+        self.out_dir = Path(settings["out_dir"])
+        self.iteration = 0
+        self.done = False
+        self.prof = None
+        self.labels = None
+        self.sampler = None
+        self.started_at = None
+
+    def before_train(self, learner):
+        if self.iteration == self.settings["warmup"]:
+            self._start(learner)
+
+    def after_train(self):
+        self.iteration += 1
+        if self.prof is None:
+            return
+        self.prof.step()
+        if self.iteration >= self.settings["warmup"] + self.settings["iters"]:
+            self._stop()
+
+    def _start(self, learner):
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        model = getattr(learner, "actor_critic", None)
+        if model is not None:
+            self.labels = ModuleLabels(model)
+        if self.settings["workers"]:
+            self.sampler = WorkerSampler(self.settings["main_pid"], self.out_dir)
+            self.sampler.start()
+        self.prof = torch.profiler.profile(
+            activities=activities,
+            record_shapes=True,
+            profile_memory=self.settings["memory"],
+            with_stack=self.settings["stack"],
+        )
+        self.prof.start()
+        self.started_at = time.perf_counter()
+        print(f"[Info] 🔬 Profiling learner iterations {self.iteration}..{self.iteration + self.settings['iters']}")
+
+    def _stop(self):
+        self.prof.stop()
+        elapsed = time.perf_counter() - self.started_at
+        if self.sampler is not None:
+            self.sampler.stop()
+        if self.labels is not None:
+            self.labels.remove()
+
+        prof = self.prof
+        torch.profiler.tensorboard_trace_handler(str(self.out_dir), worker_name="learner")(prof)
+        averages = prof.key_averages()
+        sort_by = "self_cuda_time_total" if torch.cuda.is_available() else "self_cpu_time_total"
+        with open(self.out_dir / "learner_ops.txt", "w", encoding="utf-8") as f:
+            f.write(f"{self.settings['iters']} learner iterations, {elapsed:.2f} s\n\n")
+            f.write(averages.table(sort_by=sort_by, row_limit=50))
+            if self.settings["memory"]:
+                f.write("\n\n")
+                f.write(averages.table(sort_by="self_cpu_memory_usage", row_limit=30))
+        if self.labels is not None:
+            modules = [e for e in averages if e.key in self.labels.names]
+            modules.sort(key=lambda e: e.cpu_time_total, reverse=True)
+            with open(self.out_dir / "learner_modules.txt", "w", encoding="utf-8") as f:
+                f.write(f"{'module':<40} {'calls':>8} {'cpu total ms':>14} {'cpu ms/iter':>12}\n")
+                for e in modules:
+                    f.write(f"{e.key:<40} {e.count:>8} {e.cpu_time_total / 1000.0:>14.2f} "
+                            f"{e.cpu_time_total / 1000.0 / self.settings['iters']:>12.3f}\n")
+        if self.settings["stack"]:
+            prof.export_stacks(str(self.out_dir / "learner_stacks.txt"), "self_cpu_time_total")
+
+        self.prof = None
+        self.done = True
+        print(f"[Info] 💾 Profile written to {self.out_dir} ({elapsed:.2f} s); training continues")
+
+
+def install_learner_profiler():
+    """环境变量 PROFILE_ENV 存在时给 Sample Factory 的 Learner.train 装上采样窗口；可重复调用"""
+    raw = os.environ.get(PROFILE_ENV)
+    if not raw:
+        return False
+    try:
+        from sample_factory.algo.learning.learner import Learner
+    except ImportError as e:
+        print(f"[Warning] Learner profiling disabled, cannot import the Sample Factory learner: {e}")
+        return False
+    if getattr(Learner.train, "_profiled", False):
+        return True
+
+    settings = json.loads(raw)
+    original_train = Learner.train
+    # 每个进程一个实例，只有真正调用 train 的 learner 进程会用到
+    profiler = LearnerProfiler(settings)
+
+    def train(self, *args, **kwargs):
+        if profiler.done:
+            return original_train(self, *args, **kwargs)
+        profiler.before_train(self)
+        result = original_train(self, *args, **kwargs)
+        profiler.after_train()
+        return result
+
+    train._profiled = True
+    Learner.train = train
+    return True
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+CPU 评估用的 int8 量化：在 export_policy.InferenceStep 上做量化，产物与 .step.pt 一样用 StepModulePolicy 加载。
+
+两种模式：
+    dynamic  Linear（encoder fc / decoder / 两个 head）和 GRUCell 的权重存成 int8，激活在运行时按批量化，
+             不需要校准数据。legacy encoder 的 fc 占了绝大部分参数，收益最明显。
+    static   在 dynamic 的基础上，把卷积主干（Conv+ReLU 融合）静态量化成 int8；
+             激活的量化范围来自一轮校准：用浮点策略在环境里跑出来的观察（或 --calib-obs 给的 .npy）。
+
+量化后报告：与浮点模型的 logits / value 误差、动作一致率、单步延迟加速比，
+以及（环境可用时）同一组 seed 下的评估奖励差值和配对置信区间。
+产物默认存到 checkpoint 旁边：<checkpoint>.int8.step.pt / <checkpoint>.int8-static.step.pt
+
+用法：
+    python src/quantize_policy.py --checkpoint train_dir/exp/checkpoint_p0/checkpoint_xxx.pth --episodes 20
+    python src/quantize_policy.py --checkpoint ckpt.safetensors --mode static --calib-obs calib.npy
+    python src/evaluate.py --checkpoint ckpt.pth --backend int8     # 评估时直接用量化模型
+"""
+import argparse
+import copy
+import sys
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch import nn
+from torch.ao import quantization as tq
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.checkpoint_io import read_checkpoint, policy_cfg_from_manifest, policy_spaces, build_policy
+from src.eval_stats import summarize
+from src.export_policy import (InferenceStep, StepModulePolicy, example_inputs, export_step,
+                               benchmark, save_step_module)
+from src.policy_runtime import PolicyRuntime
+
+QUANT_MODES = ("dynamic", "static")
+ARTIFACT_SUFFIX = {"dynamic": ".int8.step.pt", "static": ".int8-static.step.pt"}
+# 动态量化的模块类型（GRUCell 来自 InferenceStep 把 nn.GRU 拆成单步）
+DYNAMIC_MODULES = {nn.Linear, nn.GRU, nn.GRUCell}
+
+
+def pick_engine():
+    """选一个可用的量化后端：x86 / fbgemm 面向服务器 CPU，qnnpack 面向 ARM"""
+    supported = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in supported:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise RuntimeError(f"no quantized engine available (supported: {supported})")
+
+
+def default_artifact(checkpoint, mode="dynamic"):
+    return Path(checkpoint).with_suffix(ARTIFACT_SUFFIX[mode])
+
+
+class QuantizedTrunk(nn.Module):
+    """QuantStub -> 融合后的卷积主干 -> DeQuantStub，只有这一段走静态量化"""
+    def __init__(self, cnn):
+        super().__init__()
+        self.quant = tq.QuantStub()
+        self.body = fuse_conv_relu(cnn)
+        self.dequant = tq.DeQuantStub()
+
+    def forward(self, x):
+        return self.dequant(self.body(self.quant(x)))
+
+
+def fuse_conv_relu(seq):
+    """复制一份 nn.Sequential 主干，把相邻的 Conv2d + ReLU 融合成一个模块"""
+    seq = copy.deepcopy(seq).eval()
+    children = list(seq.named_children())
+    pairs = [[name, children[i + 1][0]] for i, (name, m) in enumerate(children[:-1])
+             if isinstance(m, nn.Conv2d) and isinstance(children[i + 1][1], nn.ReLU)]
+    return tq.fuse_modules(seq, pairs) if pairs else seq
+
+
+def _batches(obs, batch_size):
+    for i in range(0, len(obs), batch_size):
+        yield torch.as_tensor(obs[i:i + batch_size])
+
+
+def quantize_step(step, mode="dynamic", calib_obs=None, batch_size=64):
+    """
+    返回量化后的 InferenceStep 副本（原模块不变）。
+    mode="static" 需要 calib_obs：(N, C, H, W) 的观察数组，用来统计卷积主干各层激活的范围。
+    """
+    if mode not in QUANT_MODES:
+        raise ValueError(f"unknown quantization mode: {mode} (expected one of {QUANT_MODES})")
+    engine = pick_engine()
+    qstep = copy.deepcopy(step).eval()
+
+    if mode == "static":
+        if calib_obs is None or len(calib_obs) == 0:
+            raise ValueError("static quantization needs calibration observations")
+        trunk = QuantizedTrunk(qstep.cnn).eval()
+        trunk.qconfig = tq.get_default_qconfig(engine)
+        qstep.cnn = tq.prepare(trunk)
+        # 校准：整步前向，观察器看到的是归一化之后、真正进入卷积的输入
+        with torch.no_grad():
+            for obs in _batches(calib_obs, batch_size):
+                qstep(obs, torch.zeros(obs.shape[0], qstep.rnn_size))
+        qstep.cnn = tq.convert(qstep.cnn)
+
+    # 卷积主干之外的 Linear / GRUCell 两种模式都做动态量化（QuantizedTrunk 里已没有浮点 Linear）
+    return tq.quantize_dynamic(qstep, DYNAMIC_MODULES, dtype=torch.qint8)
+
+
+def record_observations(env, runtime, num_obs, seed=0):
+    """用浮点策略在环境里跑，收集 num_obs 个观察作为校准集（多个 episode 接续）"""
+    frames = []
+    episode = 0
+    while len(frames) < num_obs:
+        obs, _ = env.reset(seed=seed + episode)
+        runtime.reset()
+        runtime.seed(seed + episode)
+        done = False
+        while not done and len(frames) < num_obs:
+            frames.append(np.array(obs, copy=True))
+            obs, _, terminated, truncated, _ = env.step(runtime.act(obs))
+            done = terminated or truncated
+        episode += 1
+    return np.stack(frames)
+
+
+def compare_steps(ref, quantized, obs_seq):
+    """
+    把一段观察当作一条轨迹逐步喂给两个单步模块（各自维护隐状态），
+    返回 logits / value 的最大误差和 argmax 动作一致率。
+    """
+    h_ref = torch.zeros(1, ref.rnn_size)
+    h_q = h_ref.clone()
+    worst_logits = worst_values = 0.0
+    agree = 0
+    with torch.no_grad():
+        for obs in _batches(obs_seq, 1):
+            logits_ref, values_ref, h_ref = ref(obs, h_ref)
+            logits_q, values_q, h_q = quantized(obs, h_q)
+            worst_logits = max(worst_logits, (logits_q - logits_ref).abs().max().item())
+            worst_values = max(worst_values, (values_q - values_ref).abs().max().item())
+            agree += int(logits_q.argmax(-1).item() == logits_ref.argmax(-1).item())
+    return {"logits": worst_logits, "values": worst_values, "action_agreement": agree / max(1, len(obs_seq))}
+
+
+def run_episodes(env, policy, episodes, seed=0):
+    """每个 episode 用固定 seed（环境和采样都播种），两个策略跑同一组 seed 时奖励可以配对比较"""
+    rewards = []
+    for episode in range(episodes):
+        obs, _ = env.reset(seed=seed + episode)
+        policy.reset()
+        policy.seed(seed + episode)
+        total, done = 0.0, False
+        while not done:
+            obs, r, terminated, truncated, _ = env.step(policy.act(obs))
+            total += float(r)
+            done = terminated or truncated
+        rewards.append(total)
+    return rewards
+
+
+def reward_delta(float_rewards, quant_rewards, confidence=0.95):
+    """量化前后的奖励汇总，以及逐 episode 配对差值（量化 - 浮点）的置信区间"""
+    return {
+        "float": summarize(float_rewards, confidence),
+        "int8": summarize(quant_rewards, confidence),
+        "delta": summarize([q - f for f, q in zip(float_rewards, quant_rewards)], confidence),
+    }
+
+
+def _make_env(env_name, cfg):
+    try:
+        from src.envs.vizdoom_env import create_vizdoom_env
+        return create_vizdoom_env(env_name, cfg=cfg)
+    except Exception as e:
+        print(f"[Warning] Could not create env {env_name}: {e}")
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Quantize a checkpoint to int8 for CPU evaluation")
+    parser.add_argument("--checkpoint", type=str, required=True, help=".pth or .safetensors checkpoint")
+    parser.add_argument("--mode", choices=QUANT_MODES, default="dynamic",
+                        help="dynamic: int8 Linear/GRU; static: also int8 conv trunk (needs calibration)")
+    parser.add_argument("--env", type=str, default=None, help="Env for calibration / reward delta (default: manifest env)")
+    parser.add_argument("--episodes", type=int, default=10, help="Episodes per model for the reward delta (0 to skip)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the first evaluation episode")
+    parser.add_argument("--calib-obs", type=str, default=None,
+                        help="Calibration observations .npy: loaded if it exists, otherwise recorded there")
+    parser.add_argument("--calib-size", type=int, default=512, help="Observations to record for calibration")
+    parser.add_argument("--obs-shape", type=int, nargs=3, default=None, help="C H W, if the checkpoint has no manifest obs_shape")
+    parser.add_argument("--threads", type=int, default=1, help="torch.set_num_threads for benchmark and evaluation")
+    parser.add_argument("--repeats", type=int, default=200, help="Benchmark iterations")
+    parser.add_argument("--out", type=str, default=None, help="Output path (default: next to the checkpoint)")
+    args = parser.parse_args(argv)
+
+    torch.set_num_threads(args.threads)
+    ckpt = read_checkpoint(args.checkpoint)
+    if args.obs_shape:
+        ckpt.manifest["obs_shape"] = args.obs_shape
+    cfg = policy_cfg_from_manifest(ckpt.manifest)
+    obs_space, action_space = policy_spaces(ckpt, cfg)
+    model = build_policy(ckpt, cfg, obs_space, action_space)
+    step = InferenceStep(model).eval()
+    float_policy = PolicyRuntime(model, num_envs=1)
+
+    env_name = args.env or ckpt.manifest.get("env")
+    env = _make_env(env_name, cfg) if env_name else None
+    if env is None:
+        print("[Info] No env: skipping recorded calibration and the reward delta")
+
+    # 校准 / 对比用的观察：优先用文件，其次在环境里录制，最后退回随机输入（只够做误差检查）
+    calib = None
+    if args.calib_obs and Path(args.calib_obs).exists():
+        calib = np.load(args.calib_obs)
+        print(f"📂 Loaded {len(calib)} calibration observations from {args.calib_obs}")
+    elif env is not None:
+        calib = record_observations(env, float_policy, args.calib_size, args.seed)
+        print(f"🎥 Recorded {len(calib)} observations on {env_name}")
+        if args.calib_obs:
+            np.save(args.calib_obs, calib)
+    if calib is None:
+        if args.mode == "static":
+            parser.error("--mode static needs --calib-obs or an env (--env) to record observations")
+        calib = torch.cat([example_inputs(step)[0] for _ in range(64)]).numpy()
+
+    print(f"🔧 Quantizing {args.checkpoint} ({args.mode}, engine {torch.backends.quantized.engine})")
+    qstep = quantize_step(step, args.mode, calib)
+    exported = export_step(qstep, "trace")
+    parity = compare_steps(step, exported, calib)
+    print(f"✅ Error vs float: logits {parity['logits']:.3e}, values {parity['values']:.3e}, "
+          f"action agreement {parity['action_agreement']:.1%}")
+
+    quant_policy = StepModulePolicy(exported, num_envs=1, manifest=qstep.manifest())
+    obs = calib[0]
+    float_p50, _ = benchmark(lambda: float_policy.act(obs), args.repeats)
+    quant_p50, quant_p90 = benchmark(lambda: quant_policy.act(obs), args.repeats)
+    print(f"⏱️  Latency/step ({args.threads} thread(s)): float {float_p50:.3f} ms, "
+          f"int8 {quant_p50:.3f} ms (p90 {quant_p90:.3f}), speedup x{float_p50 / quant_p50:.2f}")
+
+    report = {"mode": args.mode, "engine": torch.backends.quantized.engine, "parity": parity,
+              "latency_ms_p50": {"float": float_p50, "int8": quant_p50}}
+    if env is not None and args.episodes > 0:
+        print(f"🎮 Reward delta on {env_name} ({args.episodes} episodes each, same seeds)...")
+        delta = reward_delta(run_episodes(env, float_policy, args.episodes, args.seed),
+                             run_episodes(env, quant_policy, args.episodes, args.seed))
+        for name in ("float", "int8", "delta"):
+            s = delta[name]
+            print(f"   {name:<6} {s['mean']:8.2f}  95% CI [{s['ci_low']:.2f}, {s['ci_high']:.2f}]")
+        report["reward"] = {name: {"mean": s["mean"], "ci_low": s["ci_low"], "ci_high": s["ci_high"]}
+                            for name, s in delta.items()}
+    if env is not None:
+        env.close()
+
+    out = Path(args.out) if args.out else default_artifact(args.checkpoint, args.mode)
+    save_step_module(exported, out, qstep.manifest({"source": str(args.checkpoint), "quantization": report}))
+    print(f"💾 Saved: {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
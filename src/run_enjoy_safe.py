@@ -9,10 +9,11 @@ torch.serialization.add_safe_globals([
 ])
 
 # --- 2. 关键修复：移除之前的 Hacky Patch，因为问题不在 Key 名字，而在模型架构 ---
-original_torch_load = torch.load
+# 统一走 checkpoint_io 的加载（weights_only=False，能 mmap 时直接映射文件）
+from src.checkpoint_io import load_torch_file
 def patched_torch_load(*args, **kwargs):
     kwargs['weights_only'] = False
-    return original_torch_load(*args, **kwargs)
+    return load_torch_file(*args, **kwargs)
 torch.load = patched_torch_load
 
 # --- 3. 导入 Sample Factory 和 项目模块 ---
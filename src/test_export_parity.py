@@ -0,0 +1,67 @@
+import tempfile
+import os
+
+import numpy as np
+import torch
+import gymnasium as gym
+
+from src.checkpoint_io import policy_cfg_from_manifest
+from src.models.custom_model import make_vizdoom_actor_critic
+from src.export_policy import InferenceStep, export_step, check_parity, save_step_module, StepModulePolicy, benchmark
+from src.policy_runtime import PolicyRuntime
+
+def make_model(encoder_variant, obs_uint8, frame_stack=1, frame_cache=False, use_rnn=True):
+    cfg = policy_cfg_from_manifest({
+        "use_rnn": use_rnn,
+        "rnn_size": 64,
+        "decoder_mlp_layers": [128],
+        "encoder_variant": encoder_variant,
+        "doom_obs_uint8": obs_uint8,
+        "doom_frame_stack": frame_stack,
+        "encoder_frame_cache": frame_cache,
+    })
+    obs_space = gym.spaces.Dict({
+        "obs": gym.spaces.Box(low=0, high=255, shape=(3 * frame_stack, 72, 128),
+                              dtype=np.uint8 if obs_uint8 else np.float32)
+    })
+    model = make_vizdoom_actor_critic(cfg, obs_space, gym.spaces.Discrete(5)).eval()
+    # 让归一化统计量非平凡，检验融合后的 scale/shift
+    rms = model.obs_normalizer.running_mean_std.running_mean_std["obs"]
+    rms.running_mean.uniform_(0.0, 0.3)
+    rms.running_var.uniform_(0.5, 2.0)
+    return model
+
+def test_export_parity():
+    print("Testing single-step export parity...")
+    cases = [
+        ("legacy", False, 1, False, True),
+        ("depthwise", True, 1, False, True),
+        ("global_pool", True, 4, True, True),
+        ("spatial_pool", True, 1, False, False),
+    ]
+    for encoder_variant, obs_uint8, frame_stack, frame_cache, use_rnn in cases:
+        model = make_model(encoder_variant, obs_uint8, frame_stack, frame_cache, use_rnn)
+        step = InferenceStep(model).eval()
+        for method in ("trace", "script"):
+            exported = export_step(step, method)
+            worst = check_parity(model, exported, steps=10)
+            print(f"✓ {encoder_variant:<12} {method:<6} uint8={obs_uint8} stack={frame_stack} rnn={use_rnn}: "
+                  + ", ".join(f"{k} {v:.1e}" for k, v in worst.items()))
+
+        # 存盘再加载，动作与 eager runtime 一致（确定性模式）
+        path = os.path.join(tempfile.mkdtemp(), "policy.step.pt")
+        save_step_module(export_step(step, "trace"), path, step.manifest())
+        loaded = StepModulePolicy(path, num_envs=2, deterministic=True)
+        eager = PolicyRuntime(model, num_envs=2, deterministic=True)
+        obs = (np.random.rand(2, *step.obs_shape) * (255 if obs_uint8 else 1)).astype(np.uint8 if obs_uint8 else np.float32)
+        assert np.array_equal(loaded.act(obs), eager.act(obs)), "reloaded module picks different actions"
+        assert torch.allclose(loaded.last_logits, eager.last_logits, atol=1e-4)
+
+        eager_ms, _ = benchmark(lambda: eager.act(obs), repeats=20, warmup=3)
+        export_ms, _ = benchmark(lambda: loaded.act(obs), repeats=20, warmup=3)
+        print(f"  latency (batch 2): eager {eager_ms:.2f} ms, exported {export_ms:.2f} ms")
+
+    print("✓ Export parity verification successful!")
+
+if __name__ == "__main__":
+    test_export_parity()
@@ -0,0 +1,57 @@
+import numpy as np
+import gymnasium as gym
+
+from src.envs.wrappers import FrameStackWrapper
+from src.envs.vec_env import VecDoomEnv, step_with_autoreset
+
+class CountingEnv(gym.Env):
+    """每帧的像素值等于帧号，episode 长度固定，方便检查最后一帧"""
+    observation_space = gym.spaces.Box(low=0, high=255, shape=(1, 4, 4), dtype=np.uint8)
+    action_space = gym.spaces.Discrete(2)
+
+    def __init__(self, episode_len=5):
+        self.episode_len = episode_len
+        self.t = 0
+
+    def _frame(self):
+        return np.full(self.observation_space.shape, self.t, dtype=np.uint8)
+
+    def reset(self, seed=None, options=None):
+        self.t = 100
+        return self._frame(), {}
+
+    def step(self, action):
+        self.t += 1
+        done = self.t - 100 >= self.episode_len
+        return self._frame(), 0.0, done, False, {}
+
+def test_final_observation():
+    print("Testing final_observation with frame stacking...")
+    k, episode_len = 4, 5
+    # 单个环境：reset 之后 final_observation 仍是上一 episode 的最后 k 帧
+    env = FrameStackWrapper(CountingEnv(episode_len), k)
+    env.reset()
+    for _ in range(episode_len - 1):
+        step_with_autoreset(env, 0)
+    obs, _, terminated, _, info = step_with_autoreset(env, 0)
+    assert terminated
+    final = info["final_observation"]
+    expected = np.arange(100 + episode_len - k + 1, 100 + episode_len + 1)
+    assert np.array_equal(final[:, 0, 0], expected), final[:, 0, 0]
+    assert np.all(obs == 100), "auto-reset obs should be the first frame of the new episode"
+    print("✓ step_with_autoreset keeps the terminal frame stack")
+
+    # 向量化环境（线程池版本）
+    vec = VecDoomEnv(None, 2, env_fns=[lambda: FrameStackWrapper(CountingEnv(episode_len), k) for _ in range(2)])
+    vec.reset()
+    for _ in range(episode_len):
+        obs, _, terminated, _, infos = vec.step(np.zeros(2, dtype=np.int64))
+    assert terminated.all()
+    for info in infos:
+        assert np.array_equal(info["final_observation"][:, 0, 0], expected), info["final_observation"][:, 0, 0]
+    assert np.all(obs == 100)
+    vec.close()
+    print("✓ VecDoomEnv final_observation survives the auto-reset")
+
+if __name__ == "__main__":
+    test_final_observation()
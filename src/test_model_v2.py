@@ -45,7 +45,7 @@ def test_model_registration():
         
         # 执行前向传播
         # ActorCritic 的 forward 返回一个包含 action_logits, values 等的 dict
-        output = model(obs_dict, rnn_states)
+        output = model(model.normalize_obs(obs_dict), rnn_states)
         print("✓ Forward pass successful!")
         
         print("✓ Phase 2 Verification Successful!")
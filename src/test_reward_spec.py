@@ -0,0 +1,86 @@
+import numpy as np
+
+from src.envs.reward_spec import compile_reward_spec
+
+# 变量顺序与 DEFAULT_REWARD_SPEC["variables"] 一致
+HIT, KILL, HEALTH, AMMO = range(4)
+
+def baseline_reward(curr, prev, action_idx, last_action_idx):
+    """原 RewardShapingWrapper.step 中手写的 if 链（env 奖励记为 0）"""
+    diff_hits = curr[HIT] - prev[HIT]
+    diff_kills = curr[KILL] - prev[KILL]
+    diff_health = curr[HEALTH] - prev[HEALTH]
+    diff_ammo = prev[AMMO] - curr[AMMO]
+
+    reward = 0.0
+    reward += 0.01
+    if diff_kills > 0:
+        reward += 15.0 * diff_kills
+    if diff_hits > 0:
+        reward += 2.0 * diff_hits
+    if diff_ammo > 0:
+        if diff_hits > 0:
+            reward += 0.5
+        else:
+            reward -= 0.5
+    if diff_health < 0:
+        reward += 0.2 * diff_health
+    if diff_health < 0:
+        if diff_hits == 0:
+            if action_idx in [0, 1, 3, 4]:
+                reward += 0.5
+            else:
+                reward -= 1.0
+    if diff_ammo == 0:
+        if action_idx in [0, 1]:
+            reward += 0.05
+        else:
+            reward -= 0.01
+    if (last_action_idx == 0 and action_idx == 1) or \
+       (last_action_idx == 1 and action_idx == 0):
+        reward -= 0.5
+
+    info = {"HIT_INC": diff_hits, "KILL_INC": diff_kills, "AMMO_USED": diff_ammo, "HEALTH_DIFF": diff_health}
+    return reward, info
+
+def random_cases(rng, n):
+    """小范围的整数值，让差值为 0 / 正 / 负的分支都经常出现"""
+    prev = rng.integers(0, 4, size=(n, 4)).astype(np.float64)
+    delta = rng.integers(-2, 3, size=(n, 4)).astype(np.float64)
+    curr = prev + delta
+    action = rng.integers(0, 5, size=n)
+    prev_action = rng.integers(0, 5, size=n)
+    return curr, prev, action, prev_action
+
+def test_reward_spec():
+    print("Testing the default reward spec against the original reward logic...")
+    program = compile_reward_spec()
+    curr, prev, action, prev_action = random_cases(np.random.default_rng(0), 5000)
+
+    expected = [baseline_reward(c, p, int(a), int(pa)) for c, p, a, pa in zip(curr, prev, action, prev_action)]
+    expected_total = np.array([r for r, _ in expected])
+
+    # 单环境逐步求值
+    for i, (total, info) in enumerate(expected):
+        shaped, log_info = program.step_scalar(curr[i].tolist(), prev[i].tolist(), int(action[i]), int(prev_action[i]))
+        assert abs(shaped - total) < 1e-9, (i, shaped, total)
+        assert log_info == info, (i, log_info, info)
+    print("✓ step_scalar matches the original if-chain (totals and info)")
+
+    # 向量化环境的批量求值（VecDoomEnv._apply_batched_shaping 的调用方式）
+    shaped, log_info = program(curr, prev, action, prev_action)
+    assert shaped.shape == (len(curr),)
+    assert np.allclose(shaped, expected_total, atol=1e-5), np.abs(shaped - expected_total).max()
+    for key in expected[0][1]:
+        values = np.broadcast_to(log_info[key], (len(curr),))
+        assert np.array_equal(values, [info[key] for _, info in expected]), key
+    print("✓ batched evaluation matches the original if-chain (totals and info)")
+
+    # 各项贡献之和等于总奖励
+    _, _, terms = program(curr, prev, action, prev_action, return_terms=True)
+    term_sum = sum(np.broadcast_to(v, (len(curr),)) for v in terms.values())
+    assert np.allclose(term_sum, expected_total, atol=1e-5)
+    print("✓ per-term contributions add up to the total")
+
+if __name__ == "__main__":
+    test_reward_spec()
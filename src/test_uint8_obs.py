@@ -0,0 +1,48 @@
+import numpy as np
+import torch
+
+from src.test_export_parity import make_model
+
+def prepare_and_normalize_obs(model, obs):
+    """按 Sample Factory learner / inference worker 的顺序：先按 type_for_input_tensor 转类型，再 normalize_obs"""
+    obs = {k: torch.as_tensor(v).type(model.type_for_input_tensor(k)) for k, v in obs.items()}
+    return model.normalize_obs(obs)
+
+def test_uint8_obs():
+    print("Testing uint8 observations on the learner path...")
+    uint8_model = make_model("legacy", True)
+    float_model = make_model("legacy", False)
+    float_model.load_state_dict(uint8_model.state_dict())
+    assert uint8_model.type_for_input_tensor("obs") == torch.uint8
+    assert float_model.type_for_input_tensor("obs") == torch.float32
+
+    calls = []
+    fused = uint8_model._normalize_uint8_obs
+    uint8_model._normalize_uint8_obs = lambda obs_dict: calls.append(obs_dict["obs"].dtype) or fused(obs_dict)
+
+    frames = (np.random.rand(4, *uint8_model.encoder.obs_shape) * 255).astype(np.uint8)
+    normalized = prepare_and_normalize_obs(uint8_model, {"obs": frames})
+    assert calls == [torch.uint8], "normalize_obs did not take the fused uint8 path"
+    print("✓ normalize_obs receives uint8 and runs the fused conversion")
+
+    # 与 float 模式（SF 默认的 ObservationNormalizer）数值一致；legacy 缩放对应旧 Wrapper 输出的 float [0,1]
+    reference = prepare_and_normalize_obs(float_model, {"obs": frames.astype(np.float32) / 255.0})
+    assert normalized["obs"].dtype == torch.float32
+    assert torch.allclose(normalized["obs"], reference["obs"], atol=1e-5)
+    with torch.no_grad():
+        assert torch.allclose(uint8_model.encoder(normalized), float_model.encoder(reference), atol=1e-4)
+    print("✓ uint8 and float observations normalize to the same values")
+
+    # learner 的完整顺序：prepare_and_normalize_obs -> forward_head，encoder 收到的是只归一化一次的张量
+    for model, obs in ((uint8_model, frames), (float_model, frames.astype(np.float32) / 255.0)):
+        seen = []
+        handle = model.encoder.register_forward_pre_hook(lambda module, inputs: seen.append(inputs[0]["obs"].clone()))
+        with torch.no_grad():
+            model.forward_head(prepare_and_normalize_obs(model, {"obs": obs}))
+        handle.remove()
+        assert len(seen) == 1
+        assert torch.allclose(seen[0], reference["obs"], atol=1e-5), "forward_head normalized the obs a second time"
+    print("✓ forward_head passes the normalized obs to the encoder unchanged")
+
+if __name__ == "__main__":
+    test_uint8_obs()
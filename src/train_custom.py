@@ -5,7 +5,13 @@ from sf_examples.vizdoom.doom.doom_params import add_doom_env_args, doom_overrid
 
 # 关键：导入 src.envs 以触发环境注册
 import src.envs 
-from src.models import register_models
+from src.envs.vizdoom_env import add_custom_doom_env_args
+from src.models import register_models, add_custom_model_args
+from src.autotune import load_autotune_config
+from src.profiling import add_profiling_args, export_profile_env, install_learner_profiler
+
+# learner 在子进程里：spawn 出来的子进程会重新执行这里，按环境变量装上性能采样窗口
+install_learner_profiler()
 
 def main():
     """
@@ -20,13 +26,23 @@ def main():
     
     # 添加 ViZDoom 特有参数
     add_doom_env_args(parser)
+    add_custom_doom_env_args(parser)
+    add_custom_model_args(parser)
+    add_profiling_args(parser)
     doom_override_defaults(parser)
+    parser.add_argument(
+        "--autotune_config",
+        default=None,
+        type=str,
+        help="JSON written by `python main.py --autotune`; its rollout settings become defaults (explicit flags still win)",
+    )
     
     # 强制修改默认参数
     parser.set_defaults(
         model="custom_vizdoom_model",
-        # 【新增】叠加最近4帧，让 Agent 能感知"速度"和运动方向
-        frame_stack=4, 
+        # 叠帧默认关闭：原来的 frame_stack=4 不是 SF 的参数，实际从未生效；
+        # 需要感知"速度"和运动方向时用 --doom_frame_stack 4（FrameStackWrapper 环形缓冲区，观察通道数 x4）
+        doom_frame_stack=1,
         # 【明确设置】env_frameskip=1（更细粒度控制，以利于精准瞄准）
         # frameskip=1 提供最高操作频率，适合需要精确操作的任务
         env_frameskip=1,
@@ -36,7 +52,15 @@ def main():
         entropy_coeff=0.01 
     )
     
+    # 自动调优的 num_workers / num_envs_per_worker / rollout / batch_size 只作为默认值
+    known, _ = parser.parse_known_args()
+    if known.autotune_config:
+        parser.set_defaults(**load_autotune_config(known.autotune_config))
+
     cfg = parse_full_cfg(parser)
+    # 先写环境变量再装补丁：serial 模式下 learner 就在本进程，fork 出来的子进程直接继承
+    if export_profile_env(cfg):
+        install_learner_profiler()
     
     status = run_rl(cfg)
     return status
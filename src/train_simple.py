@@ -42,16 +42,23 @@ def main():
     # 关键：为解析器提供默认 env / experiment，避免必填参数阻塞
     parser.set_defaults(env=env_name)
     parser.set_defaults(experiment="defend_simple_test")
+    parser.add_argument("--autotune_config", default=None, type=str,
+                        help="JSON written by `python main.py --autotune`, replaces the minimal worker settings below")
     doom_override_defaults(partial_cfg)
 
     # 配置训练参数（简化版）
     cfg = parse_full_cfg(parser)
 
-    # 最小化资源配置，确保能跑通
-    cfg.num_workers = 2              # 减少worker数
-    cfg.num_envs_per_worker = 2      # 每个worker只运行2个环境
+    # 最小化资源配置，确保能跑通（给了 autotune 配置时用本机调优的结果）
+    if cfg.autotune_config:
+        from src.autotune import load_autotune_config
+        for key, value in load_autotune_config(cfg.autotune_config).items():
+            setattr(cfg, key, value)
+    else:
+        cfg.num_workers = 2              # 减少worker数
+        cfg.num_envs_per_worker = 2      # 每个worker只运行2个环境
+        cfg.batch_size = 512             # 减小批次大小
     cfg.train_for_env_steps = 100000 # 减少总步数，快速验证
-    cfg.batch_size = 512             # 减小批次大小
 
     # 基础超参数
     cfg.learning_rate = 0.0001